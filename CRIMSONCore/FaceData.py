@@ -15,7 +15,10 @@ class FaceData(PropertyStorage):
         self.faceIdentifiers = []
 
     def setFaceIdentifiers(self, faceIdentifiers):  # for use in CPP code
+        faceIdentifiersChanged = list(faceIdentifiers) != list(self.faceIdentifiers)
         self.faceIdentifiers = faceIdentifiers
+        if faceIdentifiersChanged:
+            self.markChanged('faceIdentifiers')
 
     def getFaceIdentifiers(self):  # for use in CPP code
         return self.faceIdentifiers
\ No newline at end of file
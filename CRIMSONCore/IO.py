@@ -1,32 +1,424 @@
 from __future__ import print_function
 
 import cPickle
+import io
+import os
+import struct
+import zlib
+
+import numpy
+
 from CRIMSONCore.VersionedObject import VersionedObject
 
 """
     NOTE: The methods in this file are called by
     crimson\Modules\PythonSolverSetupService\src\SolverSetupPythonObjectIO.h
+
+    The objects are saved with the highest pickle protocol. The numpy arrays (e.g. waveforms and material tables) are not
+    part of the pickle, their raw data is stored after it, each buffer aligned to bufferAlignment bytes in the file, and
+    compressed with zlib if compressionLevel > 0.
+
+    The large attributes of the LazyAttributesObject objects (e.g. the netlist files) are stored after the other buffers
+    as sidecar entries: raw buffers for arrays, pickles for anything else. They are read by loadFromFile, unless
+    lazyLoading is set, see LazyAttributesObject.
+
+    The layout of a file is:
+
+        header: _magic, format version, compression level, length of the pickle, length of the buffer tables
+        the pickle of the object, where the arrays are persistent ids ('ndarray', <buffer index>, <dtype>, <shape>) and
+            the sidecar entries ('sidecar', <sidecar index>, <dtype>, <shape>), the dtype and shape being None for the
+            pickled ones
+        the pickle of the buffer tables, ([buffer], [sidecar]), each one (<offset from the data section>,
+            <stored length>, <raw length>). Format version 1 has no sidecar table.
+        padding up to bufferAlignment
+        the data section: the buffers, then the sidecar entries, each one padded up to bufferAlignment
+
+    Files saved before this format, i.e. protocol 0 pickles, are recognised by not starting with _magic and are still
+    loaded. Note, that versions of CRIMSON before this format cannot load the files it writes, set writeLegacyFormat to
+    save files for them.
+
+    CRIMSONCore/__init__.py also loads this file as the top level module IO, whose classes are not the ones of
+    CRIMSONCore.IO. The lazy attributes objects and the payloads are therefore recognised by their class attributes
+    (_lazyAttributes, _isLazyPayload) rather than with isinstance, so that a file can be saved or loaded with either.
 """
 
-def saveToFile(obj, filename):
+# zlib level the buffers and the pickle are compressed with, 0 for no compression
+compressionLevel = 0
+
+# Smaller arrays stay in the pickle
+minimumOutOfBandArrayBytes = 1024
+
+# Smaller lazy attributes stay in the pickle, and are loaded with the object
+minimumSidecarBytes = 64 * 1024
+
+# Read the sidecar entries on their first access, rather than when the object is loaded. Only for files which stay in
+# place until the objects are discarded: the scene files are extracted to a temporary directory which is removed once
+# the scene is loaded, the entries of a removed file cannot be read.
+lazyLoading = False
+
+bufferAlignment = 64
+
+# Save protocol 0 pickles, which can be loaded by any version of CRIMSON
+writeLegacyFormat = False
+
+# Cannot be the start of a pickle: protocol 0 pickles start with a printable opcode, the later protocols with '\x80'
+_magic = b'\x93CRIMSON'
+_formatVersion = 2
+_header = struct.Struct('<8sIIQQ')
+
+
+def _alignedLength(length):
+    return (length + bufferAlignment - 1) // bufferAlignment * bufferAlignment
+
+
+class LazyPayload(object):
+    """
+        A sidecar entry of a loaded file, which has not been read yet
+    """
+    _isLazyPayload = True
+
+    def __init__(self, sidecarFile, sidecarIndex, dtype, shape):
+        self.sidecarFile = sidecarFile
+        self.sidecarIndex = sidecarIndex
+        self.dtype = dtype
+        self.shape = shape
+
+    def load(self):
+        return self.sidecarFile.load(self.sidecarIndex, self.dtype, self.shape)
+
+
+class _SidecarFile(object):
+    """
+        Reads the sidecar entries of a file, while it is loaded or, with lazyLoading, on their first access. In the latter
+        case, the file is opened for each entry rather than kept open, as a scene has many objects, and python 2 on Windows limits the number of open files and locks them. The header, size and
+        modification time of the file are checked on every read, so that an entry is not read from another file saved
+        in the meantime; the lazy attributes of an object are read before it is saved, see
+        LazyAttributesObject.__getstate__.
+    """
+    def __init__(self, f, header, dataStart, level, sidecarTable):
+        self.filename = f.name
+        self.header = header
+        self.fileStatus = self._getFileStatus(f)
+        self.dataStart = dataStart
+        self.level = level
+        self.sidecarTable = sidecarTable
+
+        # <sidecar index>: value, so that an entry referenced by several attributes is loaded as one object
+        self.values = {}
+
+    def _read(self, f, sidecarIndex):
+        offset, storedLength, rawLength = self.sidecarTable[sidecarIndex]
+        f.seek(self.dataStart + offset)
+        # A bytearray keeps the arrays writable
+        data = bytearray(storedLength)
+        if f.readinto(data) != storedLength:
+            raise RuntimeError('The file "{0}" is truncated'.format(self.filename))
+        return data
+
+    @staticmethod
+    def _getFileStatus(f):
+        status = os.fstat(f.fileno())
+        return (status.st_size, status.st_mtime)
+
+    def load(self, sidecarIndex, dtype, shape, f=None):
+        """
+            f: the file while it is being loaded, the file is opened again otherwise
+        """
+        if sidecarIndex in self.values:
+            return self.values[sidecarIndex]
+
+        if f is not None:
+            data = self._read(f, sidecarIndex)
+        else:
+            with open(self.filename, 'rb') as f:
+                if f.read(len(self.header)) != self.header or self._getFileStatus(f) != self.fileStatus:
+                    raise RuntimeError('The file "{0}" changed since it was loaded, its lazy attributes cannot be read'.format(self.filename))
+                data = self._read(f, sidecarIndex)
+
+        rawLength = self.sidecarTable[sidecarIndex][2]
+        if self.level > 0:
+            data = bytearray(zlib.decompress(bytes(data)))
+
+        if dtype is None:
+            value = cPickle.loads(bytes(data))
+        else:
+            value = numpy.frombuffer(data, dtype=dtype, count=rawLength // dtype.itemsize).reshape(shape)
+
+        self.values[sidecarIndex] = value
+        return value
+
+
+class LazyAttributesObject(object):
+    '''
+    Base class for the objects whose large attributes, listed in ``_lazyAttributes``, are saved as sidecar entries by
+    ``saveToFile``. With ``lazyLoading``, the attributes which were saved as sidecar entries are not set by
+    ``loadFromFile``; each one is read from the file on its first access, so that opening a scene only reads what is
+    used. An attribute which cannot be read, e.g. as its file was removed, stays pending, and saving the object fails
+    rather than saving it without the attribute.
+
+    The values of the lazy attributes should not be referenced by the other objects of the scene, as such references
+    would be loaded as LazyPayload objects.
+    '''
+    _lazyAttributes = []
+
+    def __getattr__(self, name):
+        # Only called for the attributes which are not set, e.g. the ones which were not read yet
+        lazyPayloads = self.__dict__.get('_lazyPayloads')
+        if not lazyPayloads or name not in lazyPayloads:
+            raise AttributeError("'{0}' object has no attribute '{1}'".format(self.__class__.__name__, name))
+
+        # The payload is only discarded once it is read
+        value = lazyPayloads[name].load()
+        self.__dict__[name] = value
+        del lazyPayloads[name]
+        return value
+
+    def loadLazyAttributes(self):
+        '''
+        Read all the lazy attributes which were not read yet.
+        '''
+        lazyPayloads = self.__dict__.get('_lazyPayloads')
+        if not lazyPayloads:
+            return
+
+        for name in list(lazyPayloads):
+            if name in self.__dict__:
+                # The attribute was set since the object was loaded
+                del lazyPayloads[name]
+            else:
+                getattr(self, name)
+
+    def __getstate__(self):
+        self.loadLazyAttributes()
+        odict = self.__dict__.copy()  # copy the dict
+        odict.pop('_lazyPayloads', None)
+        return odict
+
+    def __setstate__(self, dict):
+        self.__dict__.update(dict)
+
+        # The sidecar entries are read on the first access of their attributes, see __getattr__
+        lazyPayloads = {}
+        for name, value in list(self.__dict__.items()):
+            if getattr(type(value), '_isLazyPayload', False):
+                lazyPayloads[name] = value
+                del self.__dict__[name]
+        if lazyPayloads:
+            self._lazyPayloads = lazyPayloads
+
+
+def _payloadLength(value):
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, dict):
+        # e.g. the netlist files, {<file name>: <contents>}
+        return sum(_payloadLength(item) for item in value.values())
+    return 0
+
+
+class _BufferPickler(object):
+    def __init__(self, level):
+        self.level = level
+        self.arrays = []
+        # id(<array>): persistent id. The pickler asks for the persistent id before looking at its memo, so an array
+        # referenced several times would otherwise be stored several times, and loaded as separate arrays.
+        self._persistentIds = {}
+        # The objects given persistent ids, so that their ids stay unique
+        self._pickledObjects = []
+
+        # id(<value of a lazy attribute>): persistent id, None until the value is stored as a sidecar entry
+        self._sidecarIds = {}
+        # [(<stored buffer>, <raw length>)]
+        self.sidecars = []
+
+    def _addLazyAttributes(self, obj):
+        # Called before the attributes of obj are pickled, so that the pickler recognises its lazy attributes
+        obj.loadLazyAttributes()
+        for name in obj._lazyAttributes:
+            value = obj.__dict__.get(name)
+            # A value already pickled, e.g. an array shared with another attribute, stays where it is
+            if value is None or id(value) in self._sidecarIds or id(value) in self._persistentIds:
+                continue
+            if _payloadLength(value) >= minimumSidecarBytes:
+                self._pickledObjects.append(value)
+                self._sidecarIds[id(value)] = None
+
+    def _addSidecar(self, obj):
+        if isinstance(obj, numpy.ndarray) and not obj.dtype.hasobject:
+            data = numpy.ascontiguousarray(obj).tobytes()
+            persistentId = ('sidecar', len(self.sidecars), obj.dtype, obj.shape)
+        else:
+            data = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+            persistentId = ('sidecar', len(self.sidecars), None, None)
+
+        self.sidecars.append((zlib.compress(data, self.level) if self.level > 0 else data, len(data)))
+        self._sidecarIds[id(obj)] = persistentId
+        return persistentId
+
+    def persistent_id(self, obj):
+        if getattr(type(obj), '_lazyAttributes', None) is not None:
+            self._addLazyAttributes(obj)
+            return None
+
+        if id(obj) in self._sidecarIds:
+            return self._sidecarIds[id(obj)] or self._addSidecar(obj)
+
+        if type(obj) is not numpy.ndarray or obj.dtype.hasobject or obj.nbytes < minimumOutOfBandArrayBytes:
+            return None
+
+        persistentId = self._persistentIds.get(id(obj))
+        if persistentId is None:
+            self._pickledObjects.append(obj)
+            self.arrays.append(obj if obj.flags.c_contiguous else obj.copy(order='C'))
+            persistentId = ('ndarray', len(self.arrays) - 1, obj.dtype, obj.shape)
+            self._persistentIds[id(obj)] = persistentId
+        return persistentId
+
+    def dumps(self, obj):
+        stream = io.BytesIO()
+        pickler = cPickle.Pickler(stream, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self.persistent_id
+        pickler.dump(obj)
+
+        objectPickle = stream.getvalue()
+        if self.level > 0:
+            objectPickle = zlib.compress(objectPickle, self.level)
+        return objectPickle
+
+    def getStoredBuffers(self):
+        # The arrays are written as they are when they are not compressed, see _writeBuffers
+        if self.level > 0:
+            return [(zlib.compress(array.tobytes(), self.level), array.nbytes) for array in self.arrays]
+        return [(array, array.nbytes) for array in self.arrays]
+
+
+def _storedLength(storedBuffer):
+    return storedBuffer.nbytes if isinstance(storedBuffer, numpy.ndarray) else len(storedBuffer)
+
+
+def _writeBuffers(f, storedBuffers):
+    for (storedBuffer, rawLength) in storedBuffers:
+        if isinstance(storedBuffer, numpy.ndarray):
+            storedBuffer.tofile(f)
+        else:
+            f.write(storedBuffer)
+        length = _storedLength(storedBuffer)
+        f.write(b'\0' * (_alignedLength(length) - length))
+
+
+def _saveToFile(obj, filename, level):
+    bufferPickler = _BufferPickler(level)
+    objectPickle = bufferPickler.dumps(obj)
+    storedBuffers = bufferPickler.getStoredBuffers()
+
+    tables = ([], [])
+    offset = 0
+    for (table, buffers) in zip(tables, [storedBuffers, bufferPickler.sidecars]):
+        for (storedBuffer, rawLength) in buffers:
+            table.append((offset, _storedLength(storedBuffer), rawLength))
+            offset += _alignedLength(_storedLength(storedBuffer))
+    tablesPickle = cPickle.dumps(tables, cPickle.HIGHEST_PROTOCOL)
+
     with open(filename, 'wb') as f:
-        cPickle.dump(obj, f)
+        f.write(_header.pack(_magic, _formatVersion, level, len(objectPickle), len(tablesPickle)))
+        f.write(objectPickle)
+        f.write(tablesPickle)
+        headerLength = _header.size + len(objectPickle) + len(tablesPickle)
+        f.write(b'\0' * (_alignedLength(headerLength) - headerLength))
+        _writeBuffers(f, storedBuffers)
+        _writeBuffers(f, bufferPickler.sidecars)
+
+
+def _loadFromFile(f, header):
+    magic, formatVersion, level, objectPickleLength, tablesPickleLength = _header.unpack(header)
+    if formatVersion > _formatVersion:
+        raise RuntimeError('The file was saved by a newer version of CRIMSON (format version {0}, this version reads up to {1})'
+                           .format(formatVersion, _formatVersion))
+
+    objectPickle = f.read(objectPickleLength)
+    tables = cPickle.loads(f.read(tablesPickleLength))
+    bufferTable, sidecarTable = (tables, []) if formatVersion == 1 else tables
+    if level > 0:
+        objectPickle = zlib.decompress(objectPickle)
+
+    dataStart = _alignedLength(_header.size + objectPickleLength + tablesPickleLength)
+    f.seek(dataStart)
+    if level > 0:
+        buffers = []
+        for (offset, storedLength, rawLength) in bufferTable:
+            f.seek(dataStart + offset)
+            buffers.append(bytearray(zlib.decompress(f.read(storedLength))))
+        offsets = [0] * len(bufferTable)
+    else:
+        # All the buffers are read at once, the arrays are views of it. A bytearray keeps the arrays writable.
+        # The sidecar entries, which come after the buffers, are not read.
+        dataLength = bufferTable[-1][0] + bufferTable[-1][1] if len(bufferTable) > 0 else 0
+        data = bytearray(dataLength)
+        if f.readinto(data) != dataLength:
+            raise RuntimeError('The file is truncated')
+        buffers = [data] * len(bufferTable)
+        offsets = [offset for (offset, storedLength, rawLength) in bufferTable]
+
+    sidecarFile = _SidecarFile(f, header, dataStart, level, sidecarTable) if len(sidecarTable) > 0 else None
+    arrays = {}
+
+    def persistent_load(persistentId):
+        kind, index, dtype, shape = persistentId
+        if kind == 'sidecar':
+            if lazyLoading:
+                return LazyPayload(sidecarFile, index, dtype, shape)
+            return sidecarFile.load(index, dtype, shape, f)
+
+        if kind != 'ndarray':
+            raise cPickle.UnpicklingError('Unknown persistent id {0}'.format(kind))
+
+        if index not in arrays:
+            rawLength = bufferTable[index][2]
+            arrays[index] = numpy.frombuffer(buffers[index], dtype=dtype, count=rawLength // dtype.itemsize,
+                                             offset=offsets[index]).reshape(shape)
+        return arrays[index]
+
+    unpickler = cPickle.Unpickler(io.BytesIO(objectPickle))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+def saveToFile(obj, filename, level=None):
+    """
+        level: the zlib compression level, compressionLevel by default
+    """
+    if writeLegacyFormat:
+        with open(filename, 'wb') as f:
+            cPickle.dump(obj, f)
+        return
+
+    try:
+        _saveToFile(obj, filename, compressionLevel if level is None else level)
+    except (cPickle.PicklingError, TypeError) as e:
+        # Everything is pickled before the file is opened, nothing has been written
+        print('Warning: Failed to save "', filename, '" with the highest pickle protocol (', e, '), saving it with protocol 0.', sep='')
+        with open(filename, 'wb') as f:
+            cPickle.dump(obj, f)
 
 def loadFromFile(filename):
     with open(filename, 'rb') as f:
-        obj = cPickle.load(f)
+        header = f.read(_header.size)
+        if header.startswith(_magic):
+            obj = _loadFromFile(f, header)
+        else:
+            f.seek(0)
+            obj = cPickle.load(f)
 
     if(obj is None):
         print('Loaded obj from fileName "', filename, '" that contained no data.', sep='')
         return obj
-    
+
     if(isinstance(obj, VersionedObject)):
         obj.upgradeToLatest()
-    
+
     else:
-        print('Loaded object of type "', obj.__class__.__name__, ' from filename "', fileName, '" that was not upgradable.', sep='')
+        print('Loaded object of type "', obj.__class__.__name__, ' from filename "', filename, '" that was not upgradable.', sep='')
 
     return obj
-        
-
-
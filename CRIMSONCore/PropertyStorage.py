@@ -1,8 +1,21 @@
+import itertools
+from collections import OrderedDict
+
 from CRIMSONCore.VersionedObject import VersionedObject, Versions
+from CRIMSONCore.IO import LazyAttributesObject
+
+# Separates the names of the groups in the property paths, e.g. 'Time parameters/Number of time steps'
+PropertyPathSeparator = '/'
+
+# The revisions of all the PropertyStorage objects come from the same counter, so that a revision taken from one
+# object is also meaningful for objects created or loaded afterwards
+_revisionCounter = itertools.count(1)
 
 class PropertyAccessor(object):
-    def __init__(self, propertyList):
+    def __init__(self, propertyList, propertyStorage=None):
         self.propertyList = propertyList
+        # When given, the names are looked up in the index of the storage rather than by walking the properties
+        self.propertyStorage = propertyStorage
 
     @staticmethod
     def getNameAndValueKey(property):
@@ -25,40 +38,179 @@ class PropertyAccessor(object):
                 if result is not None:
                     return result
 
+    @staticmethod
+    def findItemPath(propertyList, itemPath):
+        """
+            Returns the (list, index, value key) of the property at the path, where each name of the path is looked up
+            case-insensitively among the properties of the previous group only. None if there is no such property.
+        """
+        result = None
+        for itemName in itemPath.split(PropertyPathSeparator):
+            if result is not None:
+                propertyList = result[0][result[1]][result[2]]
+                if not isinstance(propertyList, list):
+                    return None
+
+            result = None
+            for i, property in enumerate(propertyList):
+                propertyName, propertyValueKey = PropertyAccessor.getNameAndValueKey(property)
+                if propertyName.lower() == itemName.lower():
+                    result = (propertyList, i, propertyValueKey)
+                    break
+            if result is None:
+                return None
+
+        return result
+
+    @staticmethod
+    def checkValue(itemName, propertyValue, value):
+        """
+            Raises TypeError if the property with the value propertyValue cannot be set to value
+        """
+        if isinstance(propertyValue, list):
+            raise TypeError("It is forbidden to modify the property lists")
+
+        # This type check fails "duck typing" checks, and will, for example, fail if you attempt to treat a unicode string as a byte string, or vice versa.
+        # It also fails to account for inheritance. This is not an ideal way to check for type equivalence.
+        if type(propertyValue) != type(value):
+            raise TypeError("It is forbidden to change the type of properties. Propery name: '" + itemName 
+                            + "' Set with '" + str(propertyValue) + "', data of type: '" + type(propertyValue).__name__ 
+                            + "', received value '" + str(value) + "' of type: '" + type(value).__name__ + "'")
+
+    def _findItemIndex(self, itemName):
+        if self.propertyStorage is None:
+            return PropertyAccessor.findItemIndex(self.propertyList, itemName)
+        return self.propertyStorage.findPropertyItemIndex(self.propertyList, itemName)
+
     def __getitem__(self, itemName):
-        propertyListAndIndexAndValueKey = PropertyAccessor.findItemIndex(self.propertyList, itemName)
+        propertyListAndIndexAndValueKey = self._findItemIndex(itemName)
         if propertyListAndIndexAndValueKey is None:
             raise KeyError("Item with name '" + itemName + "' not found")
 
         propertyList, index, valueKey = propertyListAndIndexAndValueKey
         value = propertyList[index][valueKey]
         if isinstance(value, list):
-            return PropertyAccessor(value)
+            return PropertyAccessor(value, self.propertyStorage)
         return value
 
 
     def __setitem__(self, itemName, value):
-        propertyListAndIndexAndValueKey = PropertyAccessor.findItemIndex(self.propertyList, itemName)
+        propertyListAndIndexAndValueKey = self._findItemIndex(itemName)
         if propertyListAndIndexAndValueKey is None:
             raise KeyError("Item with name '" + itemName + "' not found")
 
         propertyList, index, valueKey = propertyListAndIndexAndValueKey
-        propertyValue = propertyList[index][valueKey]
+        PropertyAccessor.checkValue(itemName, propertyList[index][valueKey], value)
 
-        if isinstance(propertyValue, list):
-            raise TypeError("It is forbidden to modify the property lists")
+        valueChanged = propertyList[index][valueKey] != value
+        propertyList[index][valueKey] = value
+        if valueChanged and self.propertyStorage is not None:
+            self.propertyStorage.propertyValueChanged(propertyList, index, itemName)
 
-        # This type check fails "duck typing" checks, and will, for example, fail if you attempt to treat a unicode string as a byte string, or vice versa.
-        # It also fails to account for inheritance. This is not an ideal way to check for type equivalence.
-        if type(propertyValue) != type(value):
-            raise TypeError("It is forbidden to change the type of properties. Propery name: '" + itemName 
-                            + "' Set with '" + str(propertyValue) + "', data of type: '" + type(propertyValue).__name__ 
-                            + "', received value '" + str(value) + "' of type: '" + type(value).__name__ + "'")
 
-        propertyList[index][valueKey] = value
+class PropertyIndex(object):
+    """
+        Maps the lower case property names to their (list, index, value key), for every property list of a property tree,
+        so that PropertyAccessor does not need to walk the tree on every access.
 
+        Each name maps to the match PropertyAccessor.findItemIndex would find, i.e. the first one of a depth-first walk,
+        so ambiguous names resolve exactly as they did without the index. The property paths (see
+        PropertyAccessor.findItemPath) are indexed as well.
 
-class PropertyStorage(VersionedObject):
+        The index is only valid for the structure it was built from. isValidFor catches the top-level list being replaced
+        or grown, and findItemIndex checks that the property it returns still has the name; other changes to the
+        structure need PropertyStorage.propertyStructureChanged.
+    """
+    def __init__(self, propertyList):
+        self.propertyList = propertyList
+        self.length = len(propertyList)
+
+        # id(<property list>): (<property list>, {<lower case name>: (<property list>, <index>, <value key>)})
+        # The lists are kept so that their ids cannot be reused while the index exists.
+        self._itemsByList = {}
+        # <lower case path>: (<property list>, <index>, <value key>), see PropertyAccessor.findItemPath
+        self._itemsByPath = {}
+        # (id(<property list>), <index>): <path>, the path of every property
+        self._pathsByItem = {}
+        self._addList(propertyList, '', '')
+
+    def _addList(self, propertyList, pathPrefix, namePrefix):
+        items = {}
+        for i, property in enumerate(propertyList):
+            propertyName, propertyValueKey = PropertyAccessor.getNameAndValueKey(property)
+            # setdefault keeps the first match, in the order of PropertyAccessor.findItemIndex
+            items.setdefault(propertyName.lower(), (propertyList, i, propertyValueKey))
+            self._pathsByItem[(id(propertyList), i)] = namePrefix + propertyName
+
+            # Only the first of the properties with the same name in a group can be reached by path,
+            # the pathPrefix of the groups which cannot be reached is None
+            childPathPrefix = None
+            if pathPrefix is not None:
+                path = pathPrefix + propertyName.lower()
+                if path not in self._itemsByPath:
+                    self._itemsByPath[path] = (propertyList, i, propertyValueKey)
+                    childPathPrefix = path + PropertyPathSeparator
+
+            if isinstance(property[propertyValueKey], list):
+                for itemName, item in self._addList(property[propertyValueKey], childPathPrefix,
+                                                    namePrefix + propertyName + PropertyPathSeparator).items():
+                    items.setdefault(itemName, item)
+
+        self._itemsByList[id(propertyList)] = (propertyList, items)
+        return items
+
+    def getItemPath(self, propertyList, index):
+        """
+            Returns the path of the property propertyList[index], None if it is not in the index
+        """
+        if self._itemsByList.get(id(propertyList), (None,))[0] is not propertyList:
+            return None
+        return self._pathsByItem.get((id(propertyList), index))
+
+    def isValidFor(self, propertyList):
+        return self.propertyList is propertyList and self.length == len(propertyList)
+
+    """
+        Returns the (list, index, value key) of the property, None if it is not in the index.
+        A property list that is not part of the index is walked as PropertyAccessor.findItemIndex does.
+    """
+    def findItemIndex(self, propertyList, itemName):
+        listAndItems = self._itemsByList.get(id(propertyList))
+        if listAndItems is None or listAndItems[0] is not propertyList:
+            return PropertyAccessor.findItemIndex(propertyList, itemName)
+
+        lowerItemName = itemName.lower()
+        result = listAndItems[1].get(lowerItemName)
+        if result is None:
+            return None
+
+        return PropertyIndex._checkItem(result, lowerItemName)
+
+    """
+        Returns the (list, index, value key) of the property at the path, see PropertyAccessor.findItemPath.
+        None if it is not in the index.
+    """
+    def findItemPath(self, itemPath):
+        lowerItemPath = itemPath.lower()
+        result = self._itemsByPath.get(lowerItemPath)
+        if result is None:
+            return None
+
+        return PropertyIndex._checkItem(result, lowerItemPath.split(PropertyPathSeparator)[-1])
+
+    @staticmethod
+    def _checkItem(item, lowerItemName):
+        # The property may have been removed or replaced since the index was built
+        itemList, index, valueKey = item
+        if index >= len(itemList) or valueKey not in itemList[index]:
+            return None
+        propertyName, _ = PropertyAccessor.getNameAndValueKey(itemList[index])
+        if propertyName.lower() != lowerItemName:
+            return None
+        return item
+
+
+class PropertyStorage(VersionedObject, LazyAttributesObject):
     '''
     The PropertyStorage class is a convenience class for communicating the various properties of a boundary condition
     or solver parameters to the C++ code for the user to edit.
@@ -250,9 +402,29 @@ class PropertyStorage(VersionedObject):
                 "attributes": {"enumNames": CouplingType.enumNames}
             }
     '''
+    # Attributes which are rebuilt when needed, and are not pickled
+    _transientAttributes = ['_propertyIndex', '_revision', '_changedPaths', '_changeSubscribers']
+
+    # Large attributes which are only read from the scene when they are used, see CRIMSONCore.IO.LazyAttributesObject
+    _lazyAttributes = []
+
     def __init__(self):
         VersionedObject.__init__(self)
         self.properties = []
+        self._propertyIndex = None
+        self._resetChangeTracking()
+
+    def __getstate__(self):
+        odict = LazyAttributesObject.__getstate__(self)  # copy the dict
+        for attributeName in self._transientAttributes:
+            odict.pop(attributeName, None)
+        return odict
+
+    def __setstate__(self, dict):
+        LazyAttributesObject.__setstate__(self, dict)
+        self._propertyIndex = None
+        # A loaded object counts as changed for every revision taken before it was loaded
+        self._resetChangeTracking()
 
     def getProperties(self):
         '''
@@ -268,4 +440,165 @@ class PropertyStorage(VersionedObject):
             
         to disambiguate the access.
         '''
-        return PropertyAccessor(self.properties)
\ No newline at end of file
+        return PropertyAccessor(self.properties, self)
+
+    def propertyStructureChanged(self):
+        '''
+        Discards the name index of the properties. Call this after adding, removing or replacing properties inside
+        the property groups, as the index only notices the ``properties`` list itself being replaced or grown.
+        '''
+        self._propertyIndex = None
+
+    def _getPropertyIndex(self):
+        # Objects loaded from file before the index existed do not have the attribute
+        propertyIndex = getattr(self, '_propertyIndex', None)
+        if propertyIndex is None or not propertyIndex.isValidFor(self.properties):
+            propertyIndex = PropertyIndex(self.properties)
+            self._propertyIndex = propertyIndex
+        return propertyIndex
+
+    def findPropertyItemIndex(self, propertyList, itemName):
+        '''
+        Same as ``PropertyAccessor.findItemIndex``, using the name index of the properties.
+        '''
+        result = self._getPropertyIndex().findItemIndex(propertyList, itemName)
+        if result is None:
+            # Either the name does not exist, or the structure changed since the index was built
+            result = PropertyAccessor.findItemIndex(propertyList, itemName)
+            if result is not None:
+                self.propertyStructureChanged()
+        return result
+
+    def findPropertyItemPath(self, itemPath):
+        '''
+        Same as ``PropertyAccessor.findItemPath`` on the properties, using the index of the properties.
+        '''
+        result = self._getPropertyIndex().findItemPath(itemPath)
+        if result is None:
+            result = PropertyAccessor.findItemPath(self.properties, itemPath)
+            if result is not None:
+                self.propertyStructureChanged()
+        return result
+
+    def getPropertyValues(self):
+        '''
+        Get all the property values at once, e.g. to refresh a user interface in a single call. The values are returned
+        in a flat dictionary keyed by the path of the property, i.e. the names of its groups and its own name, separated
+        by ``PropertyPathSeparator``::
+
+            {
+                'Time parameters/Number of time steps': 200,
+                'Time parameters/Time step size': 0.01,
+                ...
+            }
+
+        The values keep their types. The groups themselves are not included. Where several properties of a group have
+        the same name, only the first one is included.
+        '''
+        values = {}
+        self._addPropertyValues(self.properties, '', set(), values)
+        return values
+
+    def _addPropertyValues(self, propertyList, pathPrefix, lowerPaths, values):
+        for property in propertyList:
+            propertyName, propertyValueKey = PropertyAccessor.getNameAndValueKey(property)
+            path = pathPrefix + propertyName
+            # Paths are case-insensitive, see PropertyAccessor.findItemPath
+            if path.lower() in lowerPaths:
+                continue
+            lowerPaths.add(path.lower())
+
+            value = property[propertyValueKey]
+            if isinstance(value, list):
+                self._addPropertyValues(value, path + PropertyPathSeparator, lowerPaths, values)
+            else:
+                values[path] = value
+
+    def setPropertyValues(self, values):
+        '''
+        Set several property values at once, from a dictionary keyed by the property paths of ``getPropertyValues``.
+        The values are checked as ``getProperties()[name] = value`` checks them, and none of them are set if any of
+        them fails: ``KeyError`` is raised for an unknown path and ``TypeError`` for a value of the wrong type.
+        '''
+        items = []
+        for itemPath, value in values.items():
+            propertyListAndIndexAndValueKey = self.findPropertyItemPath(itemPath)
+            if propertyListAndIndexAndValueKey is None:
+                raise KeyError("Item with path '" + itemPath + "' not found")
+
+            propertyList, index, valueKey = propertyListAndIndexAndValueKey
+            PropertyAccessor.checkValue(itemPath, propertyList[index][valueKey], value)
+            items.append((itemPath, propertyList, index, valueKey, value))
+
+        for itemPath, propertyList, index, valueKey, value in items:
+            if propertyList[index][valueKey] != value:
+                propertyList[index][valueKey] = value
+                self.propertyValueChanged(propertyList, index, itemPath)
+
+    def _resetChangeTracking(self):
+        self._revision = next(_revisionCounter)
+        # <path>: <revision of its last change>, ordered by revision
+        self._changedPaths = OrderedDict()
+        self._changeSubscribers = []
+
+    def getRevision(self):
+        '''
+        Get the revision of the object. It increases with every change, and comes from a counter shared by all the
+        objects, so that it can be compared with ``hasChangedSince`` and ``getChangedPathsSince`` later on.
+        '''
+        return self._revision
+
+    def hasChangedSince(self, revision):
+        '''
+        Returns whether anything changed after ``revision`` was taken with ``getRevision``.
+        '''
+        return self._revision > revision
+
+    def getChangedPathsSince(self, revision):
+        '''
+        Get the paths changed after ``revision`` was taken with ``getRevision``, most recent first. The paths are the
+        property paths of ``getPropertyValues``, or the paths of the other data of the object given to ``markChanged``,
+        e.g. ``'faceIdentifiers'``.
+
+        The changes of a loaded object are not known, use ``hasChangedSince`` to tell whether the object was loaded after
+        ``revision``.
+        '''
+        changedPaths = []
+        for path in reversed(self._changedPaths):
+            if self._changedPaths[path] <= revision:
+                break
+            changedPaths.append(path)
+        return changedPaths
+
+    def markChanged(self, path):
+        '''
+        Record a change of the data at ``path``, and notify the subscribers. Property changes made through
+        ``getProperties`` and ``setPropertyValues`` are recorded automatically, other data of the object should be
+        recorded by the code changing it.
+        '''
+        self._revision = next(_revisionCounter)
+        # Moves the path to the end, to keep the paths ordered by revision
+        self._changedPaths.pop(path, None)
+        self._changedPaths[path] = self._revision
+
+        for subscriber in list(self._changeSubscribers):
+            subscriber(self, path, self._revision)
+
+    def propertyValueChanged(self, propertyList, index, itemName):
+        '''
+        Record the change of the value of the property ``propertyList[index]``, which was set by the name ``itemName``.
+        '''
+        path = self._getPropertyIndex().getItemPath(propertyList, index)
+        self.markChanged(path if path is not None else itemName)
+
+    def subscribeToChanges(self, subscriber):
+        '''
+        Call ``subscriber(propertyStorage, path, revision)`` after every change, see ``markChanged``.
+        The subscribers are not saved with the object.
+        '''
+        if subscriber not in self._changeSubscribers:
+            self._changeSubscribers.append(subscriber)
+
+    def unsubscribeFromChanges(self, subscriber):
+        if subscriber in self._changeSubscribers:
+            self._changeSubscribers.remove(subscriber)
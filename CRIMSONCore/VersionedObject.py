@@ -48,9 +48,11 @@ class Versions:
     # See git tags for when these versions were introduced
     v2021A = '2021A' 
     v2021B = '2021B'
+    v2021C = '2021C'
+    v2021D = '2021D'
 
     # the order in which upgrades should be applied
-    Sequence = [Pre2021, v2021A, v2021B]
+    Sequence = [Pre2021, v2021A, v2021B, v2021C, v2021D]
     
     @staticmethod
     def indexOfVersion(versionToGetIndexOf):
@@ -66,7 +68,7 @@ class Versions:
 
 # Change this as needed when you add or remove fields from classes and need to preserve backwards compatibility with the original
 def GetCurrentVersion():
-    return Versions.v2021B
+    return Versions.v2021D
 
 """
     When a Python object is depickled, its fields get loaded as-is, which means that any fields that are added to a new version of Crimson will not be present.
@@ -7,6 +7,7 @@ class Netlist(FaceData):
     unique = False
     humanReadableName = "Netlist"
     applicableFaceTypes = [FaceType.ftCapInflow, FaceType.ftCapOutflow]
+    _lazyAttributes = ['netlistSurfacesDat', 'circuitDynamicAdjustmentFiles', 'circuitAdditionalDataFiles']
 
     def __init__(self):
         FaceData.__init__(self)
@@ -32,11 +33,13 @@ class Netlist(FaceData):
     def addDynamicAdjusterFile(self, fileName, fileContents):
         fileNameWasAlreadyKnown = self.circuitDynamicAdjustmentFiles.__contains__(fileName)
         self.circuitDynamicAdjustmentFiles[fileName] = fileContents
+        self.markChanged('circuitDynamicAdjustmentFiles/' + fileName)
         return fileNameWasAlreadyKnown
 
     def addAdditionalDataFile(self, fileName, fileContents):
         fileNameWasAlreadyKnown = self.circuitAdditionalDataFiles.__contains__(fileName)
         self.circuitAdditionalDataFiles[fileName] = fileContents
+        self.markChanged('circuitAdditionalDataFiles/' + fileName)
         return fileNameWasAlreadyKnown
 
     def addCircuitFile(self, fileName, fileContents):
@@ -44,6 +47,7 @@ class Netlist(FaceData):
             self.circuitDescriptionFileRemover()
         self.netlistSurfacesDatFileName = fileName
         self.netlistSurfacesDat = fileContents
+        self.markChanged('netlistSurfacesDat')
 
     def getFile(self, fileName):
         if self.circuitDynamicAdjustmentFiles.__contains__(fileName):
@@ -71,11 +75,14 @@ class Netlist(FaceData):
     def removeFile(self, fileName):
         if fileName in self.circuitDynamicAdjustmentFiles:
             del self.circuitDynamicAdjustmentFiles[fileName]
+            self.markChanged('circuitDynamicAdjustmentFiles/' + fileName)
         elif self.netlistSurfacesDatFileName == fileName:
             self.netlistSurfacesDat = ''
             self.netlistSurfacesDatFileName = ''
+            self.markChanged('netlistSurfacesDat')
         elif fileName in self.circuitAdditionalDataFiles:
             del self.circuitAdditionalDataFiles[fileName]
+            self.markChanged('circuitAdditionalDataFiles/' + fileName)
         else:
             # error: unknown file. should never reach here.
             Utils.logWarning('Attempted to remove unknown file \'{0}\'. Skipping.'.format(fileName))
@@ -84,12 +91,12 @@ class Netlist(FaceData):
         self.circuitDescriptionFileRemover = fileRemover
 
     def __getstate__(self):
-        odict = self.__dict__.copy()  # copy the dict
+        odict = FaceData.__getstate__(self)  # copy the dict, without the transient attributes
         del odict['editor']  # editor shouldn't be pickled
         del odict['circuitDescriptionFileRemover']
         return odict
 
     def __setstate__(self, dict):
-        self.__dict__.update(dict)
+        FaceData.__setstate__(self, dict)
         self.editor = None  # Reload classes on un-pickling
         self.circuitDescriptionFileRemover = None
\ No newline at end of file
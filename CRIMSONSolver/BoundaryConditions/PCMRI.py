@@ -30,10 +30,10 @@ class PCMRI(FaceData):
         return self.pcmriNodeUID
 
     def __getstate__(self):
-        odict = self.__dict__.copy()  # copy the dict
+        odict = FaceData.__getstate__(self)  # copy the dict, without the transient attributes
         del odict['pcmriData']  # pcmriData shouldn't be pickled
         return odict
 
     def __setstate__(self, dict):
-        self.__dict__.update(dict)
+        FaceData.__setstate__(self, dict)
         self.pcmriData = None  # Reload classes on un-pickling
\ No newline at end of file
@@ -14,6 +14,7 @@ class PrescribedVelocities(FaceData):
     unique = False
     humanReadableName = "Prescribed velocities (analytic)"
     applicableFaceTypes = [FaceType.ftCapInflow, FaceType.ftCapOutflow]
+    _lazyAttributes = ['originalWaveform', 'smoothedWaveform']
 
     def __init__(self):
         FaceData.__init__(self)
@@ -46,11 +47,11 @@ class PrescribedVelocities(FaceData):
         return self.editor.getEditorWidget()
 
     def __getstate__(self):
-        odict = self.__dict__.copy() # copy the dict
+        odict = FaceData.__getstate__(self) # copy the dict, without the transient attributes
         del odict['editor'] # editor shouldn't be pickled
         return odict
 
     def __setstate__(self, dict):
-        self.__dict__.update(dict)
+        FaceData.__setstate__(self, dict)
         self.editor = None # Reload classes on un-pickling
 
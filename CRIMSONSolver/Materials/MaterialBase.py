@@ -35,15 +35,19 @@ class MaterialBase(FaceData):
 
     def createCustomEditorWidget(self):
         if not self.editor:
-            self.editor = MaterialEditor(self.materialDatas)
+            self.editor = MaterialEditor(self.materialDatas, self.materialDataChanged)
         return self.editor.getEditorWidget()
 
+    def materialDataChanged(self, materialData):
+        # The table, script or representation of the material data was edited
+        self.markChanged('materialDatas/' + materialData.name)
+
     def __getstate__(self):
-        odict = self.__dict__.copy() # copy the dict
+        odict = FaceData.__getstate__(self) # copy the dict, without the transient attributes
         del odict['editor'] # editor shouldn't be pickled
         return odict
 
     def __setstate__(self, dict):
-        self.__dict__.update(dict)
+        FaceData.__setstate__(self, dict)
         self.editor = None # Reload classes on un-pickling
 
@@ -1,5 +1,7 @@
 import numpy
 
+from CRIMSONCore.IO import LazyAttributesObject
+
 class RepresentationType(object):
     Table, Script, Constant = range(3)
 
@@ -7,16 +9,38 @@ class RepresentationType(object):
 class InputVariableType(object):
     DistanceAlongPath, LocalRadius, x, y, z = range(5)
 
-class TableData(object):
+class TableData(LazyAttributesObject):
+    _lazyAttributes = ['data']
+
     def __init__(self, data=None, inputVariableType=InputVariableType.DistanceAlongPath):
         self.data = data
         self.inputVariableType = inputVariableType
 
 
+# The default material script, computing the material value for a single mesh face at a time
+defaultScript = 'def computeMaterialValue(info):\n\treturn 0'
+
+# Template for the array form of the material script, computing the material values for all the mesh faces at once.
+# Formatted with the number of components of the material.
+arrayScriptTemplate = \
+'''import numpy
+
+# infoArrays contains the information about all the mesh faces the material is applied to:
+#   infoArrays.getNumberOfFaces()               - number of mesh faces
+#   infoArrays.getFaceCenters()                 - [nFaces, 3] array of face centers
+#   infoArrays.getLocalRadii()                  - [nFaces] array of distances to the closest vessel path
+#   infoArrays.getArcLengths()                  - [nFaces] array of positions along the closest vessel path
+#   infoArrays.getVesselPathCoordinateFrames()  - [nFaces, 9] array of vessel path coordinate frames
+# The return value should be a [nFaces, {0}] array.
+def computeMaterialValues(infoArrays):
+\treturn numpy.zeros((infoArrays.getNumberOfFaces(), {0}))
+'''
+
+
 class MaterialData(object):
     def __init__(self, name='', nComponents=1, componentNames=None, repr=RepresentationType.Constant,
                  tableData = None,
-                 scriptData='def computeMaterialValue(info):\n\treturn 0'):
+                 scriptData=defaultScript):
         self.name = name
         self.nComponents = nComponents
         self.componentNames = componentNames
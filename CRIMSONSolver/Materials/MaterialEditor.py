@@ -1,4 +1,4 @@
-from CRIMSONSolver.Materials.MaterialData import RepresentationType
+from CRIMSONSolver.Materials.MaterialData import RepresentationType, defaultScript, arrayScriptTemplate
 
 try:
     import os
@@ -20,8 +20,10 @@ except:
 
 else:
     class SingleMaterialEditor(object):
-        def __init__(self, materialData):
+        def __init__(self, materialData, changeCallback=None):
             self.materialData = materialData
+            # Called with the material data after every edit
+            self.changeCallback = changeCallback
 
             uiPath =  os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui")
             uiFileName = os.path.join(uiPath, "SingleMaterialEditorWidget.ui")
@@ -38,6 +40,7 @@ else:
             self.scriptTextEditor.connect('textChanged()', self.saveScriptText)
             self.helpButton = findChild("helpButton")
             self.helpButton.connect('clicked(bool)', self.showHelpTooltip)
+            findChild("arrayScriptTemplateButton").connect('clicked(bool)', self.insertArrayScriptTemplate)
 
             self.inputVariableComboBox = findChild("inputVariableComboBox")
             self.inputVariableComboBox.setCurrentIndex(self.materialData.tableData.inputVariableType)
@@ -81,15 +84,21 @@ else:
             self.tableWidget.model().connect('dataChanged(QModelIndex, QModelIndex)', self.fillDataFromTable)
             self.tableWidget.model().connect('rowsRemoved(QModelIndex, int, int)', self.fillDataFromTable)
 
+        def dataChanged(self):
+            if self.changeCallback is not None:
+                self.changeCallback(self.materialData)
+
         def enableRepresentationOverride(self, enable):
             if enable:
                 self.materialData.representation = RepresentationType.Table
                 self.representationComboBox.setCurrentIndex(RepresentationType.Table)
             else:
                 self.materialData.representation = RepresentationType.Constant
+            self.dataChanged()
 
         def setRepresentationByComboBoxIndex(self, index):
             self.materialData.representation = index
+            self.dataChanged()
 
         ################################################################################
         # Table handling
@@ -128,10 +137,12 @@ else:
                 for col in xrange(self.tableWidget.columnCount):
                     item = self.tableWidget.item(row, col)
                     self.materialData.tableData.data[col, row] = float(item.text()) if item is not None else 0
+            self.dataChanged()
 
         def setInputVariableType(self, type):
             self.materialData.tableData.inputVariableType = type
             self.fillTableFromData()
+            self.dataChanged()
 
         def addRowBefore(self):
             curRow = self.tableWidget.currentRow()
@@ -182,6 +193,7 @@ else:
 
             self.materialData.tableData.data = data
             self.fillTableFromData()
+            self.dataChanged()
 
         def saveTableToFile(self):
             if self.materialData.tableData is None:
@@ -200,12 +212,23 @@ else:
         ################################################################################
         def saveScriptText(self):
             self.materialData.scriptData = self.scriptTextEditor.toPlainText()
+            self.dataChanged()
+
+        def insertArrayScriptTemplate(self):
+            if self.materialData.scriptData != defaultScript:
+                if QtGui.QMessageBox.question(None, 'Replace material script?',
+                                              'The current script will be replaced by the array script template.',
+                                              QtGui.QMessageBox.Ok | QtGui.QMessageBox.Cancel,
+                                              QtGui.QMessageBox.Cancel) != QtGui.QMessageBox.Ok:
+                    return
+
+            self.scriptTextEditor.setText(arrayScriptTemplate.format(self.materialData.nComponents))
 
         def showHelpTooltip(self):
             QtGui.QToolTip.showText(self.helpButton.mapToGlobal(QtCore.QPoint(0, 0)), self.helpButton.toolTip)
 
     class MaterialEditor(object):
-        def __init__(self, materials):
+        def __init__(self, materials, changeCallback=None):
             self.materials = materials
             uiFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                                       "ui", "MaterialEditorWidget.ui")
@@ -213,7 +236,7 @@ else:
             self.ui = QtUiTools.QUiLoader().load(QtCore.QFile(str(uiFileName)))
             self.materialsWidget = self.ui
 
-            self.singleMaterialEditors = [SingleMaterialEditor(m) for m in self.materials]
+            self.singleMaterialEditors = [SingleMaterialEditor(m, changeCallback) for m in self.materials]
             for e in self.singleMaterialEditors:
                 self.materialsWidget.layout().addWidget(e.ui)
 
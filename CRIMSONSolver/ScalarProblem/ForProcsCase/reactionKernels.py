@@ -0,0 +1,500 @@
+"""
+    Generates numpy kernels computing the reaction terms of the scalar problem and their gradients.
+
+    This file needs to be placed in 1-procs-case, alongside scalarProblemSpecification.py.
+
+    The kernels are generated as python source code, which:
+        - runs sympy's common subexpression elimination (cse) across all the expressions computed by a kernel,
+          so that e.g. k1*I**2*II is computed once for the reaction and the gradient of every species that uses it,
+        - optionally simplifies the expressions with sympy's horner or factor first,
+        - evaluates the array-valued operations with numpy ufuncs writing into preallocated buffers (out=...),
+          so that no temporary arrays are allocated when the kernels run,
+        - evaluates the subexpressions which only depend on the reaction coefficients as plain python floats.
+
+    The generated source defines, for every species (by its zero based scalarIndex):
+        reaction_<scalarIndex>(out, buffers, <symbols>)
+        gradient_<scalarIndex>(out, buffers, <symbols>)
+        reactionAndGradient_<scalarIndex>(reactionOut, gradientOut, buffers, <symbols>)
+    and
+        allReactionsAndGradients(reactionOuts, gradientOuts, buffers, <symbols>)
+        allReactions(reactionOuts, buffers, <symbols>)
+        jacobian(jacobianOuts, buffers, <symbols>)
+    where <symbols> are the values of the symbols in the order given to GenerateReactionKernelsSource, buffers is a
+    list of at least NumberOfBuffers arrays of the same shape as the output arrays, and reactionOuts and gradientOuts
+    are lists of output arrays ordered by scalarIndex. The jacobian kernel computes the non-zero entries of the
+    Jacobian of the reactions, d(reaction of scalar i)/d(scalar j), in the order of the (i, j) scalarIndex pairs in
+    JacobianStructure.
+
+    The kernels are also listed in the ReactionKernels, GradientKernels and ReactionAndGradientKernels dictionaries,
+    keyed by scalar name. ReactionDependencies and GradientDependencies list, for every scalar name, the names of the
+    scalars its reaction (resp. the gradient of its reaction) depends on.
+
+    GenerateReactionKernelsModuleSource generates the kernels from the text of generated_scalarProblemSpecification.py,
+    when the solver setup is written, into generated_reactionKernels.py. That module also contains the plain data of the
+    specification and its checksum, so the flowsolver can use it without sympy as long as it is up to date.
+
+    sympy is only imported when generating kernels, so the rest of this module can be used without it.
+"""
+
+from __future__ import print_function
+
+import __future__
+import hashlib
+import sys
+
+import numpy
+
+# Increment when the interface of the generated kernels changes, so that older generated modules are detected as stale
+KernelFormatVersion = 3
+
+
+# Simplifications that can be applied to the expressions before the common subexpression elimination
+class Simplification(object):
+    NoSimplification = None
+    Horner = 'horner'
+    Factor = 'factor'
+
+
+# sympy functions which have a numpy ufunc counterpart that can write into a buffer
+_ufuncNames = {
+    'exp': 'numpy.exp',
+    'log': 'numpy.log',
+    'sqrt': 'numpy.sqrt',
+    'sin': 'numpy.sin',
+    'cos': 'numpy.cos',
+    'tan': 'numpy.tan',
+    'tanh': 'numpy.tanh',
+    'Abs': 'numpy.absolute',
+}
+
+# Integer powers up to this are computed by repeated multiplication, which is much faster than numpy.power
+_maxPowerByMultiplication = 4
+
+
+def _ArgumentName(symbolName):
+    # The symbol names are valid python identifiers (they are python variables in the generated specification),
+    # the prefix keeps them apart from the names used by the kernels themselves.
+    return 's_' + symbolName
+
+
+"""
+    Returns the names of the scalars the expression depends on, ordered as scalarNames
+"""
+def ScalarDependencies(expression, scalarNames, symbols):
+    freeSymbols = expression.free_symbols if hasattr(expression, 'free_symbols') else set()
+    return [scalarName for scalarName in scalarNames if scalarName in symbols and symbols[scalarName] in freeSymbols]
+
+
+def _Simplify(expression, simplification):
+    import sympy
+
+    if(simplification == Simplification.Horner):
+        try:
+            return sympy.horner(expression)
+        except (sympy.PolynomialError, sympy.polys.polyerrors.GeneratorsNeeded):
+            return expression
+
+    if(simplification == Simplification.Factor):
+        return sympy.factor(expression)
+
+    return expression
+
+
+def _CreatePrinter():
+    try:
+        from sympy.printing.numpy import NumPyPrinter
+    except ImportError:
+        # sympy < 1.7
+        from sympy.printing.pycode import NumPyPrinter
+
+    class Printer(NumPyPrinter):
+        # Print the floats with full precision, so the kernels reproduce the lambdas
+        def _print_Float(self, expr):
+            return repr(float(expr))
+
+        def _print_Rational(self, expr):
+            return repr(float(expr))
+
+        def _print_Integer(self, expr):
+            return repr(float(expr))
+
+    return Printer({'fully_qualified_modules': True, 'inline': True})
+
+
+class _KernelEmitter(object):
+    """
+        Emits the body of a single kernel, computing a list of expressions into a list of output arrays.
+    """
+    def __init__(self, arraySymbols):
+        self.lines = []
+        self.arraySymbols = set(arraySymbols)
+        self.freeBuffers = []
+        self.nBuffers = 0
+        self.subexpressionBuffers = {}
+        self.printer = _CreatePrinter()
+
+    def _isArray(self, expression):
+        return len(expression.free_symbols & self.arraySymbols) > 0
+
+    def _scalar(self, expression):
+        return '(' + self.printer.doprint(expression) + ')'
+
+    def _allocateBuffer(self):
+        if(len(self.freeBuffers) > 0):
+            return self.freeBuffers.pop()
+
+        name = '_b{}'.format(self.nBuffers)
+        self.nBuffers += 1
+        return name
+
+    def _releaseBuffer(self, name):
+        if(name is not None):
+            self.freeBuffers.append(name)
+
+    # Returns (operand, temporary buffer to release after the operand has been used, or None)
+    def _operand(self, expression):
+        if(expression.is_Symbol):
+            return (expression.name, None)
+
+        buffer = self._allocateBuffer()
+        self._emit(expression, buffer)
+        return (buffer, buffer)
+
+    def _emitAddOrMul(self, expression, target):
+        import sympy
+
+        ufunc = 'numpy.add' if expression.is_Add else 'numpy.multiply'
+        operation = sympy.Add if expression.is_Add else sympy.Mul
+
+        scalarArguments = [argument for argument in expression.args if not self._isArray(argument)]
+        compoundArguments = [argument for argument in expression.args if self._isArray(argument) and not argument.is_Symbol]
+        symbolArguments = [argument for argument in expression.args if self._isArray(argument) and argument.is_Symbol]
+
+        if(len(compoundArguments) > 0):
+            # The first compound argument can be computed straight into the target
+            self._emit(compoundArguments[0], target)
+            remainingArguments = compoundArguments[1:] + symbolArguments
+        elif(len(symbolArguments) > 1):
+            self.lines.append('{}({}, {}, out={})'.format(ufunc, symbolArguments[0].name, symbolArguments[1].name, target))
+            remainingArguments = symbolArguments[2:]
+        elif(len(scalarArguments) > 0):
+            self.lines.append('{}({}, {}, out={})'.format(ufunc, symbolArguments[0].name,
+                                                         self._scalar(operation(*scalarArguments)), target))
+            return
+        else:
+            self.lines.append('numpy.copyto({}, {})'.format(target, symbolArguments[0].name))
+            remainingArguments = []
+
+        for argument in remainingArguments:
+            (operand, temporary) = self._operand(argument)
+            self.lines.append('{}({}, {}, out={})'.format(ufunc, target, operand, target))
+            self._releaseBuffer(temporary)
+
+        if(len(scalarArguments) > 0):
+            self.lines.append('{}({}, {}, out={})'.format(ufunc, target, self._scalar(operation(*scalarArguments)), target))
+
+    def _emitPow(self, expression, target):
+        import sympy
+
+        (base, exponent) = expression.args
+
+        if(exponent.is_Integer and 1 <= abs(int(exponent)) <= _maxPowerByMultiplication):
+            (operand, temporary) = self._operand(base)
+            self.lines.append('numpy.multiply({}, {}, out={})'.format(operand, operand, target)
+                              if abs(int(exponent)) > 1 else 'numpy.copyto({}, {})'.format(target, operand))
+            for _ in range(abs(int(exponent)) - 2):
+                self.lines.append('numpy.multiply({}, {}, out={})'.format(target, operand, target))
+            self._releaseBuffer(temporary)
+
+            if(exponent < 0):
+                self.lines.append('numpy.divide(1.0, {}, out={})'.format(target, target))
+            return
+
+        (operand, temporary) = self._operand(base)
+        if(exponent == sympy.Rational(1, 2)):
+            self.lines.append('numpy.sqrt({}, out={})'.format(operand, target))
+        else:
+            self.lines.append('numpy.power({}, {}, out={})'.format(operand, self._scalar(exponent), target))
+        self._releaseBuffer(temporary)
+
+    # Emits the code computing the array-valued expression into target
+    def _emit(self, expression, target):
+        if(expression.is_Symbol):
+            self.lines.append('numpy.copyto({}, {})'.format(target, expression.name))
+
+        elif(expression.is_Add or expression.is_Mul):
+            self._emitAddOrMul(expression, target)
+
+        elif(expression.is_Pow and not self._isArray(expression.args[1])):
+            self._emitPow(expression, target)
+
+        elif(expression.is_Function and len(expression.args) == 1 and type(expression).__name__ in _ufuncNames):
+            (operand, temporary) = self._operand(expression.args[0])
+            self.lines.append('{}({}, out={})'.format(_ufuncNames[type(expression).__name__], operand, target))
+            self._releaseBuffer(temporary)
+
+        else:
+            # Anything else is evaluated by numpy as a whole, which does allocate temporaries
+            self.lines.append('{}[...] = {}'.format(target, self.printer.doprint(expression)))
+
+    def _emitOutput(self, expression, target):
+        if(self._isArray(expression)):
+            self._emit(expression, target)
+        else:
+            self.lines.append('{}[...] = {}'.format(target, self._scalar(expression)))
+
+    def emitExpressions(self, expressions, targets):
+        """
+            Emits the code computing the expressions into the targets, with the common subexpressions computed once.
+        """
+        import sympy
+
+        (replacements, reducedExpressions) = sympy.cse(expressions, symbols=sympy.numbered_symbols('_x'))
+
+        statements = replacements + list(zip(targets, reducedExpressions))
+
+        # Index of the last statement using each subexpression, after which its buffer can be reused
+        lastUse = {}
+        for statementIndex, (_, expression) in enumerate(statements):
+            for symbol in expression.free_symbols:
+                lastUse[symbol] = statementIndex
+
+        for statementIndex, (target, expression) in enumerate(statements):
+            if(isinstance(target, sympy.Symbol)):
+                # Common subexpression
+                if(self._isArray(expression)):
+                    self.arraySymbols.add(target)
+                    buffer = self._allocateBuffer()
+                    self.lines.append('{} = {}'.format(target.name, buffer))
+                    self._emit(expression, buffer)
+                    self.subexpressionBuffers[target] = buffer
+                else:
+                    self.lines.append('{} = {}'.format(target.name, self._scalar(expression)))
+            else:
+                self._emitOutput(expression, target)
+
+            for symbol in expression.free_symbols:
+                if(lastUse.get(symbol) == statementIndex and symbol in self.subexpressionBuffers):
+                    self._releaseBuffer(self.subexpressionBuffers.pop(symbol))
+
+    def getBody(self):
+        bufferLines = ['{} = buffers[{}]'.format('_b{}'.format(i), i) for i in range(self.nBuffers)]
+        return bufferLines + self.lines
+
+
+def _EmitKernel(name, outputArguments, expressions, targets, symbolNames, arraySymbols):
+    emitter = _KernelEmitter(arraySymbols)
+    emitter.emitExpressions(expressions, targets)
+
+    arguments = outputArguments + ['buffers'] + [_ArgumentName(symbolName) for symbolName in symbolNames]
+    lines = ['def {}({}):'.format(name, ', '.join(arguments))]
+    lines += ['    ' + line for line in emitter.getBody()]
+    lines.append('')
+
+    return (lines, emitter.nBuffers)
+
+
+"""
+    Generates the source of the reaction kernels, see the module documentation.
+
+    Parameters:
+        symbolNames: names of all the symbols, in the order of the kernel arguments
+        scalarNames: names of the scalars, ordered by scalarIndex. These symbols are arrays, all the others are scalars.
+        symbols: dictionary of <symbol name>:<sympy symbol>
+        reactionExpressions: dictionary of <scalar name>:<sympy expression of the reaction>
+        gradientExpressions: dictionary of <scalar name>:<sympy expression of the derivative of the reaction with
+            respect to the scalar>
+        simplification: one of Simplification
+"""
+def GenerateReactionKernelsSource(symbolNames, scalarNames, symbols, reactionExpressions, gradientExpressions,
+                                  simplification=Simplification.NoSimplification):
+    import sympy
+
+    # Rename the symbols to the names of the kernel arguments
+    renamedSymbols = dict((symbols[symbolName], sympy.Symbol(_ArgumentName(symbolName))) for symbolName in symbolNames)
+    arraySymbols = [renamedSymbols[symbols[scalarName]] for scalarName in scalarNames]
+
+    def prepare(expression):
+        return _Simplify(sympy.sympify(expression).xreplace(renamedSymbols), simplification)
+
+    reactions = [prepare(reactionExpressions[scalarName]) for scalarName in scalarNames]
+    gradients = [prepare(gradientExpressions[scalarName]) for scalarName in scalarNames]
+
+    lines = ['# Reaction kernels generated by reactionKernels.py, do not edit',
+             'from __future__ import division',
+             'import numpy',
+             '']
+
+    kernels = []
+    for scalarIndex in range(len(scalarNames)):
+        kernels.append(_EmitKernel('reaction_{}'.format(scalarIndex), ['out'],
+                                   [reactions[scalarIndex]], ['out'], symbolNames, arraySymbols))
+        kernels.append(_EmitKernel('gradient_{}'.format(scalarIndex), ['out'],
+                                   [gradients[scalarIndex]], ['out'], symbolNames, arraySymbols))
+        kernels.append(_EmitKernel('reactionAndGradient_{}'.format(scalarIndex), ['reactionOut', 'gradientOut'],
+                                   [reactions[scalarIndex], gradients[scalarIndex]], ['reactionOut', 'gradientOut'],
+                                   symbolNames, arraySymbols))
+
+    allTargets = (['reactionOuts[{}]'.format(i) for i in range(len(scalarNames))] +
+                  ['gradientOuts[{}]'.format(i) for i in range(len(scalarNames))])
+    kernels.append(_EmitKernel('allReactionsAndGradients', ['reactionOuts', 'gradientOuts'], reactions + gradients,
+                               allTargets, symbolNames, arraySymbols))
+    kernels.append(_EmitKernel('allReactions', ['reactionOuts'], reactions, allTargets[:len(scalarNames)],
+                               symbolNames, arraySymbols))
+
+    # The diagonal entries are the gradients, the others are only non-zero if the reaction depends on the other scalar
+    jacobianStructure = []
+    jacobianEntries = []
+    for (i, reaction) in enumerate(reactions):
+        for (j, scalarSymbol) in enumerate(arraySymbols):
+            entry = gradients[i] if i == j else reaction.diff(scalarSymbol)
+            if(entry != 0):
+                jacobianStructure.append((i, j))
+                jacobianEntries.append(entry)
+    kernels.append(_EmitKernel('jacobian', ['jacobianOuts'], jacobianEntries,
+                               ['jacobianOuts[{}]'.format(k) for k in range(len(jacobianEntries))], symbolNames, arraySymbols))
+
+    for (kernelLines, _) in kernels:
+        lines += kernelLines
+
+    lines.append('NumberOfBuffers = {}'.format(max(nBuffers for (_, nBuffers) in kernels)))
+    lines.append('SymbolNames = {!r}'.format(list(symbolNames)))
+    lines.append('ScalarNames = {!r}'.format(list(scalarNames)))
+    lines.append('JacobianStructure = {!r}'.format(jacobianStructure))
+    for (dictionaryName, kernelName) in [('ReactionKernels', 'reaction'), ('GradientKernels', 'gradient'),
+                                         ('ReactionAndGradientKernels', 'reactionAndGradient')]:
+        entries = ', '.join('{!r}: {}_{}'.format(scalarName, kernelName, scalarIndex)
+                            for (scalarIndex, scalarName) in enumerate(scalarNames))
+        lines.append('{} = {{{}}}'.format(dictionaryName, entries))
+    for (dictionaryName, expressions) in [('ReactionDependencies', reactionExpressions), ('GradientDependencies', gradientExpressions)]:
+        entries = ', '.join('{!r}: {!r}'.format(scalarName, ScalarDependencies(sympy.sympify(expressions[scalarName]), scalarNames, symbols))
+                            for scalarName in scalarNames)
+        lines.append('{} = {{{}}}'.format(dictionaryName, entries))
+    lines.append('')
+
+    return '\n'.join(lines)
+
+
+"""
+    The checksum of the text of generated_scalarProblemSpecification.py, stored in generated_reactionKernels.py
+"""
+def ComputeSpecificationChecksum(specificationSource):
+    if(not isinstance(specificationSource, bytes)):
+        specificationSource = specificationSource.encode('utf-8')
+
+    return hashlib.sha1(specificationSource).hexdigest()
+
+
+"""
+    Whether / is true division when generated_scalarProblemSpecification.py runs in this interpreter
+"""
+def UsesTrueDivision():
+    return sys.version_info[0] >= 3
+
+
+def _RunSpecification(specificationSource, trueDivision):
+    flags = __future__.division.compiler_flag if trueDivision else 0
+    specification = {}
+    exec(compile(specificationSource, 'generated_scalarProblemSpecification.py', 'exec', flags, True), specification)
+    return specification
+
+
+"""
+    Generates the source of generated_reactionKernels.py from the source of generated_scalarProblemSpecification.py.
+
+    Besides the kernels, the module contains the data of the specification that the flowsolver needs (everything
+    but the sympy symbols and expressions), the checksum of the specification and the KernelFormatVersion.
+
+    A reaction like 1/2*k1 depends on the python version running the specification, so TrueDivision records which
+    kind of division the kernels were generated with, or None if the reactions do not depend on it.
+"""
+def GenerateReactionKernelsModuleSource(specificationSource, simplification=Simplification.NoSimplification):
+    # Running the specification gives exactly the symbols and expressions the flowsolver would get from it
+    specification = _RunSpecification(specificationSource, UsesTrueDivision())
+
+    if(not UsesTrueDivision()):
+        trueDivisionExpressions = _RunSpecification(specificationSource, True)['ReactionExpressions']
+        trueDivision = None if specification['ReactionExpressions'] == trueDivisionExpressions else False
+    else:
+        # Python 3 can't run the specification with integer division. Dividing two integers gives a float there, so
+        # any float in the reactions could come from a division.
+        import sympy
+        hasFloats = any(len(expression.atoms(sympy.Float)) > 0 for expression in specification['ReactionExpressions'].values())
+        trueDivision = True if hasFloats else None
+
+    symbols = specification['Symbols']
+    scalarNames = specification['ScalarNames']
+    reactionExpressions = specification['ReactionExpressions']
+    gradientExpressions = dict((scalarName, reactionExpressions[scalarName].diff(symbols[scalarName])) for scalarName in reactionExpressions)
+
+    lines = [GenerateReactionKernelsSource(list(symbols), scalarNames, symbols, reactionExpressions, gradientExpressions, simplification)]
+
+    lines.append('# Data of generated_scalarProblemSpecification.py')
+    for name in ['NumberOfFluidIterations', 'Iterations', 'DiffusionCoefficients', 'ReactionCoefficients']:
+        lines.append('{} = {!r}'.format(name, specification[name]))
+    # Not in specifications generated before reaction sub-stepping
+    lines.append('ReactionSubstepping = {!r}'.format(specification.get('ReactionSubstepping', {})))
+    lines.append('')
+    lines.append('SpecificationChecksum = {!r}'.format(ComputeSpecificationChecksum(specificationSource)))
+    lines.append('KernelFormatVersion = {!r}'.format(KernelFormatVersion))
+    lines.append('TrueDivision = {!r}'.format(trueDivision))
+    lines.append('')
+
+    return '\n'.join(lines)
+
+
+"""
+    Compiles the source generated by GenerateReactionKernelsSource.
+
+    Returns:
+        The namespace of the compiled kernels, e.g. namespace['ReactionKernels']
+"""
+def CompileReactionKernels(source, fileName='<reaction kernels>'):
+    namespace = {}
+    exec(compile(source, fileName, 'exec'), namespace)
+    return namespace
+
+
+class KernelBuffers(object):
+    """
+        The buffers passed to the kernels, reallocated only when the shape of the output arrays changes.
+
+        With growOnly, the buffers of 1d outputs are views of buffers which are only reallocated, to twice their length,
+        when an output is longer than them. This is for outputs whose length changes from call to call, e.g. the
+        active nodes of the active region.
+    """
+    def __init__(self, numberOfBuffers, growOnly=False):
+        self.numberOfBuffers = numberOfBuffers
+        self.growOnly = growOnly
+        self.buffers = []
+        self.shape = None
+
+    def _allocate(self, shape):
+        self.buffers = [numpy.empty(shape) for _ in range(self.numberOfBuffers)]
+        self.shape = shape
+
+    def get(self, shape):
+        if(self.growOnly and len(shape) == 1):
+            if(self.shape is None or len(self.shape) != 1):
+                self._allocate(shape)
+            elif(self.shape[0] < shape[0]):
+                self._allocate((max(shape[0], 2 * self.shape[0]),))
+
+            if(self.shape != shape):
+                return [buffer[:shape[0]] for buffer in self.buffers]
+
+        elif(shape != self.shape):
+            self._allocate(shape)
+
+        return self.buffers
+
+    """
+        Returns the buffers for a block of blockLength nodes, as views of buffers of blockSize nodes, so that the
+        shorter last block of a range does not reallocate them.
+    """
+    def getBlock(self, blockSize, blockLength):
+        buffers = self.get((blockSize,))
+        if(blockLength == blockSize):
+            return buffers
+
+        return [buffer[:blockLength] for buffer in buffers]
@@ -0,0 +1,257 @@
+"""
+    Profiling of the reaction terms of the scalar problem, to see how much of the flowsolver's wall time goes to them.
+
+    This file needs to be placed in 1-procs-case, alongside scalarProblemSpecification.py.
+
+    Each rank records every reaction term computation: the time it took, the number of nodes, how it was computed
+    (e.g. memoised, kernels, lambdas) and optionally the memory it allocated. Statistics aggregated over intervals of
+    timesteps are appended to scalarProblemProfile-rank<rank>.csv in the working directory, one row per
+    (reaction term, evaluation path), with the wall time of the interval.
+
+    Running this script merges the files of all the ranks and reports the hottest reaction terms:
+        python reactionProfiling.py [profile files...]
+    By default, the files of the current directory are merged. The expressions of the hottest reactions are also
+    printed if generated_scalarProblemSpecification.py can be imported.
+"""
+
+from __future__ import print_function, division
+
+import atexit
+import collections
+import csv
+import glob
+import os
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+
+ProfileFileNameTemplate = 'scalarProblemProfile-rank{}.csv'
+
+_columns = ['rank', 'firstTimestep', 'lastTimestep', 'intervalSeconds', 'name', 'computeGradient', 'path',
+            'calls', 'totalSeconds', 'minSeconds', 'maxSeconds', 'nodes', 'peakAllocatedBytes']
+
+# The name the Jacobian of the reactions is recorded under
+JacobianName = '<jacobian>'
+
+
+"""
+    Returns whether the memory allocated by each computation can be traced, which needs tracemalloc.reset_peak (python 3.9)
+"""
+def CanTraceAllocations():
+    return tracemalloc is not None and hasattr(tracemalloc, 'reset_peak')
+
+
+class ReactionProfiler(object):
+    """
+        Parameters:
+            mpiRank: the rank, which names the file
+            firstTimestep: the timestep the flowsolver starts at, see setTimestep for the following ones
+            timestepsPerWrite: the number of timesteps the statistics are aggregated over
+            traceAllocations: whether to trace the memory allocated by each computation, see CanTraceAllocations
+            directory: where the file is written
+    """
+    def __init__(self, mpiRank, firstTimestep, timestepsPerWrite, traceAllocations=False, directory='.'):
+        self.mpiRank = mpiRank
+        self.timestepsPerWrite = max(1, timestepsPerWrite)
+        self.fileName = os.path.join(directory, ProfileFileNameTemplate.format(mpiRank))
+
+        self.traceAllocations = traceAllocations and CanTraceAllocations()
+        if(self.traceAllocations and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+
+        self._timestep = firstTimestep
+        self._startInterval(firstTimestep)
+
+        atexit.register(self.write)
+
+    def _startInterval(self, firstTimestep):
+        self._intervalFirstTimestep = firstTimestep
+        self._intervalStartTime = timeit.default_timer()
+
+        # (<name>, <computeGradient>, <path>): [calls, totalSeconds, minSeconds, maxSeconds, nodes, peakAllocatedBytes]
+        self._statistics = {}
+
+    """
+        Returns the token to pass to endCall
+    """
+    def startCall(self):
+        if(self.traceAllocations):
+            tracemalloc.reset_peak()
+            return (timeit.default_timer(), tracemalloc.get_traced_memory()[0])
+
+        return (timeit.default_timer(), 0)
+
+    """
+        Records a computation.
+
+        Parameters:
+            token: returned by startCall at the start of the computation
+            name: the scalar name of the reaction term
+            path: how the reaction term was computed
+            nodes: the number of nodes computed
+    """
+    def endCall(self, token, name, computeGradient, path, nodes):
+        seconds = timeit.default_timer() - token[0]
+        peakAllocatedBytes = tracemalloc.get_traced_memory()[1] - token[1] if self.traceAllocations else 0
+
+        key = (name, computeGradient, path)
+        statistics = self._statistics.get(key)
+        if(statistics is None):
+            self._statistics[key] = [1, seconds, seconds, seconds, nodes, peakAllocatedBytes]
+        else:
+            statistics[0] += 1
+            statistics[1] += seconds
+            statistics[2] = min(statistics[2], seconds)
+            statistics[3] = max(statistics[3], seconds)
+            statistics[4] += nodes
+            statistics[5] = max(statistics[5], peakAllocatedBytes)
+
+    """
+        Sets the current timestep, before the computations of the timestep are recorded. The statistics are written
+        once they cover timestepsPerWrite timesteps.
+    """
+    def setTimestep(self, timestep):
+        if(timestep == self._timestep):
+            return
+
+        self._timestep = timestep
+        if(self._timestep - self._intervalFirstTimestep >= self.timestepsPerWrite):
+            self.write()
+
+    """
+        Appends the statistics since the last write to the file, and starts a new interval
+    """
+    def write(self):
+        if(len(self._statistics) == 0):
+            return
+
+        intervalSeconds = timeit.default_timer() - self._intervalStartTime
+        writeHeader = not os.path.exists(self.fileName)
+
+        try:
+            with open(self.fileName, 'a') as profileFile:
+                writer = csv.writer(profileFile)
+                if(writeHeader):
+                    writer.writerow(_columns)
+
+                for key in sorted(self._statistics):
+                    (name, computeGradient, path) = key
+                    writer.writerow([self.mpiRank, self._intervalFirstTimestep, self._timestep, repr(intervalSeconds),
+                                     name, int(computeGradient), path] +
+                                    [repr(value) if isinstance(value, float) else value for value in self._statistics[key]])
+        except IOError as e:
+            print('Warning: Failed to write the reaction profile to', self.fileName, ':', e)
+
+        self._startInterval(self._timestep)
+
+
+"""
+    Reads the rows of the profile files.
+
+    Returns:
+        A list of dictionaries of <column name>:<value>
+"""
+def ReadProfiles(fileNames):
+    rows = []
+    for fileName in fileNames:
+        with open(fileName) as profileFile:
+            for row in csv.DictReader(profileFile):
+                for column in ['rank', 'firstTimestep', 'lastTimestep', 'computeGradient', 'calls', 'nodes', 'peakAllocatedBytes']:
+                    row[column] = int(row[column])
+                for column in ['intervalSeconds', 'totalSeconds', 'minSeconds', 'maxSeconds']:
+                    row[column] = float(row[column])
+                rows.append(row)
+
+    return rows
+
+
+"""
+    Merges the rows of the profiles of all the ranks.
+
+    Returns:
+        ({<rank>: [wall seconds, reaction seconds]},
+         {(<name>, <computeGradient>): {'calls', 'totalSeconds', 'maxSeconds', 'nodes', 'peakAllocatedBytes', 'paths': {<path>: seconds}}})
+"""
+def MergeProfiles(rows):
+    ranks = {}
+    intervals = set()
+    reactionTerms = collections.OrderedDict()
+
+    for row in rows:
+        rankTimes = ranks.setdefault(row['rank'], [0.0, 0.0])
+
+        # Every row of an interval has the wall time of the interval
+        interval = (row['rank'], row['firstTimestep'], row['lastTimestep'], row['intervalSeconds'])
+        if(interval not in intervals):
+            intervals.add(interval)
+            rankTimes[0] += row['intervalSeconds']
+        rankTimes[1] += row['totalSeconds']
+
+        merged = reactionTerms.setdefault((row['name'], bool(row['computeGradient'])),
+                                          {'calls': 0, 'totalSeconds': 0.0, 'maxSeconds': 0.0, 'nodes': 0, 'peakAllocatedBytes': 0, 'paths': {}})
+        merged['calls'] += row['calls']
+        merged['totalSeconds'] += row['totalSeconds']
+        merged['maxSeconds'] = max(merged['maxSeconds'], row['maxSeconds'])
+        merged['nodes'] += row['nodes']
+        merged['peakAllocatedBytes'] = max(merged['peakAllocatedBytes'], row['peakAllocatedBytes'])
+        merged['paths'][row['path']] = merged['paths'].get(row['path'], 0.0) + row['totalSeconds']
+
+    return (ranks, reactionTerms)
+
+
+def _importReactionExpressions():
+    try:
+        sys.path.insert(0, os.getcwd())
+        import generated_scalarProblemSpecification
+        return generated_scalarProblemSpecification.ReactionExpressions
+    except Exception:
+        return None
+
+
+def Report(fileNames, numberOfHottest=10):
+    (ranks, reactionTerms) = MergeProfiles(ReadProfiles(fileNames))
+
+    print('Rank  wall time (s)  reactions (s)  share')
+    for rank in sorted(ranks):
+        (wallSeconds, reactionSeconds) = ranks[rank]
+        print('{:>4} {:>14.3f} {:>14.3f} {:>5.1f}%'.format(rank, wallSeconds, reactionSeconds, 100.0 * reactionSeconds / wallSeconds if wallSeconds > 0 else 0.0))
+
+    totalSeconds = sum(merged['totalSeconds'] for merged in reactionTerms.values())
+    hottest = sorted(reactionTerms.items(), key=lambda item: -item[1]['totalSeconds'])[:numberOfHottest]
+
+    print()
+    print('{:<20} {:>8} {:>10} {:>12} {:>7} {:>12} {:>12} {:>12}  paths'.format(
+        'reaction term', 'gradient', 'calls', 'total (s)', 'share', 'mean (ms)', 'ns / node', 'peak alloc.'))
+    for ((name, computeGradient), merged) in hottest:
+        paths = ', '.join('{} {:.0f}%'.format(path, 100.0 * seconds / merged['totalSeconds'] if merged['totalSeconds'] > 0 else 0.0)
+                          for (path, seconds) in sorted(merged['paths'].items(), key=lambda item: -item[1]))
+        print('{:<20} {:>8} {:>10} {:>12.3f} {:>6.1f}% {:>12.3f} {:>12.2f} {:>10.1f}MB  {}'.format(
+            name, 'yes' if computeGradient else 'no', merged['calls'], merged['totalSeconds'],
+            100.0 * merged['totalSeconds'] / totalSeconds if totalSeconds > 0 else 0.0,
+            1000.0 * merged['totalSeconds'] / merged['calls'],
+            1e9 * merged['totalSeconds'] / merged['nodes'] if merged['nodes'] > 0 else 0.0,
+            merged['peakAllocatedBytes'] / 1024.0 / 1024.0, paths))
+
+    reactionExpressions = _importReactionExpressions()
+    if(reactionExpressions is not None):
+        print()
+        printedNames = []
+        for ((name, _), _) in hottest:
+            if(name in reactionExpressions and name not in printedNames):
+                print(name, '=', reactionExpressions[name])
+                printedNames.append(name)
+
+
+if __name__ == '__main__':
+    fileNames = sys.argv[1:] or sorted(glob.glob(ProfileFileNameTemplate.format('*')))
+    if(len(fileNames) == 0):
+        print('No profile files found (', ProfileFileNameTemplate.format('*'), ')', sep='')
+        sys.exit(1)
+
+    Report(fileNames)
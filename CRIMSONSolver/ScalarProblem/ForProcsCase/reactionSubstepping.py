@@ -0,0 +1,240 @@
+"""
+    Operator-split integration of the reactions of the scalar problem.
+
+    This file needs to be placed in 1-procs-case, alongside scalarProblemSpecification.py.
+
+    Stiff reactions (e.g. coagulation cascades) are only stable with tiny flow timesteps when the flowsolver treats
+    them as an ordinary source term. Instead, the reaction ODE system
+        dc/dt = R(c)
+    is integrated on its own over the flow timestep, at every node at once, with a number of linearly implicit
+    sub-steps which use the Jacobian of the reactions. The flowsolver is then given the equivalent source term
+        (c(t + dt) - c(t)) / dt
+    which stays bounded for any flow timestep.
+
+    The nodes are independent of each other, so they are integrated in chunks, which bounds the memory used by the
+    [nodes, scalars, scalars] iteration matrices.
+"""
+
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+import reactionKernels
+
+
+class Method(object):
+    # One linearly implicit (Rosenbrock) Euler step: first order, L-stable
+    LinearlyImplicitEuler = 'linearlyImplicitEuler'
+
+    # The two stage Rosenbrock method of Verwer et al. (1999): second order, L-stable.
+    # Both stages use the Jacobian at the start of the sub-step, so a stiff reaction which has not started yet
+    # (e.g. k*B**2 with B = 0) is not damped by the first stage, and the second stage can overshoot badly.
+    Rosenbrock2 = 'ros2'
+
+_rosenbrock2Gamma = 1.0 + 1.0 / math.sqrt(2.0)
+
+# Number of nodes integrated together
+nodesPerChunk = 16384
+
+
+class ReactionSubstepper(object):
+    """
+        Integrates the reactions with the allReactions and jacobian kernels of reactionKernels.py.
+
+        Parameters:
+            kernels: the namespace of the kernels
+            symbolNames: the names of the symbols, in the order of the kernel arguments
+            scalarNames: the names of the scalars, ordered by scalarIndex
+            reactionCoefficients: dictionary of <coefficient name>:<value>
+            method: one of Method
+            numberOfSubsteps: the number of equal sub-steps a timestep is integrated with
+    """
+    def __init__(self, kernels, symbolNames, scalarNames, reactionCoefficients, method, numberOfSubsteps):
+        if(method not in [Method.LinearlyImplicitEuler, Method.Rosenbrock2]):
+            raise RuntimeError('Unknown reaction sub-stepping method "{}"'.format(method))
+
+        if(numberOfSubsteps < 1):
+            raise RuntimeError('The number of reaction sub-steps must be at least 1, not {}'.format(numberOfSubsteps))
+
+        self.kernels = kernels
+        self.nScalars = len(scalarNames)
+        self.method = method
+        self.numberOfSubsteps = numberOfSubsteps
+
+        self._scalarArgumentIndices = [symbolNames.index(scalarName) for scalarName in scalarNames]
+        self._arguments = [reactionCoefficients.get(symbolName) for symbolName in symbolNames]
+
+        self._jacobianRows = np.array([i for (i, _) in kernels['JacobianStructure']], dtype=int)
+        self._jacobianColumns = np.array([j for (_, j) in kernels['JacobianStructure']], dtype=int)
+
+        self._kernelBuffers = reactionKernels.KernelBuffers(kernels['NumberOfBuffers'])
+
+    def _setConcentrations(self, concentrations):
+        for scalarIndex in range(self.nScalars):
+            self._arguments[self._scalarArgumentIndices[scalarIndex]] = concentrations[scalarIndex]
+
+    # reactions[scalarIndex, node] = R(concentrations)
+    def _evaluateReactions(self, concentrations, reactions):
+        self._setConcentrations(concentrations)
+        self.kernels['allReactions'](reactions, self._kernelBuffers.get(reactions[0].shape), *self._arguments)
+
+    # Returns I - hGamma * J(concentrations), as [node, scalarIndex, scalarIndex]
+    def _iterationMatrices(self, concentrations, hGamma):
+        nNodes = concentrations.shape[1]
+
+        jacobianValues = np.empty((len(self._jacobianRows), nNodes))
+        self._setConcentrations(concentrations)
+        self.kernels['jacobian'](jacobianValues, self._kernelBuffers.get((nNodes,)), *self._arguments)
+
+        matrices = np.zeros((nNodes, self.nScalars, self.nScalars))
+        matrices[:, np.arange(self.nScalars), np.arange(self.nScalars)] = 1.0
+        # Each (i, j) appears once in the structure, so the fancy-indexed assignment does not lose entries
+        matrices[:, self._jacobianRows, self._jacobianColumns] -= hGamma * jacobianValues.T
+
+        return matrices
+
+    @staticmethod
+    def _solve(matrices, rightHandSides):
+        return np.linalg.solve(matrices, rightHandSides.T[:, :, np.newaxis])[:, :, 0].T
+
+    def _integrateChunk(self, concentrations, timestepSize):
+        h = float(timestepSize) / self.numberOfSubsteps
+        reactions = np.empty_like(concentrations)
+
+        for _ in range(self.numberOfSubsteps):
+            self._evaluateReactions(concentrations, reactions)
+
+            if(self.method == Method.LinearlyImplicitEuler):
+                matrices = self._iterationMatrices(concentrations, h)
+                concentrations += h * self._solve(matrices, reactions)
+            else:
+                matrices = self._iterationMatrices(concentrations, _rosenbrock2Gamma * h)
+                k1 = self._solve(matrices, reactions)
+
+                self._evaluateReactions(concentrations + h * k1, reactions)
+                k2 = self._solve(matrices, reactions - 2.0 * k1)
+
+                concentrations += h * (1.5 * k1 + 0.5 * k2)
+
+        return concentrations
+
+    """
+        Integrates the reactions over timestepSize.
+
+        Parameters:
+            concentrations: [scalarIndex, node] array of the concentrations at the start of the timestep
+
+        Returns:
+            [scalarIndex, node] array of the concentrations at the end of the timestep
+    """
+    def integrate(self, concentrations, timestepSize):
+        concentrations = np.array(concentrations, dtype=float)
+
+        for chunkStart in range(0, concentrations.shape[1], nodesPerChunk):
+            chunk = np.ascontiguousarray(concentrations[:, chunkStart:chunkStart + nodesPerChunk])
+            concentrations[:, chunkStart:chunkStart + nodesPerChunk] = self._integrateChunk(chunk, timestepSize)
+
+        return concentrations
+
+    """
+        Returns the [scalarIndex, node] source term equivalent to integrating the reactions over timestepSize
+    """
+    def computeEquivalentSourceTerms(self, concentrations, timestepSize):
+        return (self.integrate(concentrations, timestepSize) - concentrations) / timestepSize
+
+
+class ReactionTimestepTracker(object):
+    """
+        Follows the flow timesteps for reaction sub-stepping and profiling.
+
+        The reliable way is for the flowsolver to call beginTimestep (ScalarProblemSpecification.beginReactionTimestep)
+        at the start of every timestep. Once it has, the timesteps are only started by beginTimestep.
+
+        As a fallback, for a flowsolver which does not, the timesteps are guessed from the reaction requests (without
+        the gradient), which is only right as long as the flowsolver's call pattern is the expected one.
+
+        In a timestep, the flowsolver solves the species in the order of the iterations of the specification, and asks
+        for the reaction of the species being solved once per solve iteration. The requests are checked against that
+        sequence. A request which does not follow it means that the flowsolver's call pattern is not the expected one:
+        a warning is printed, and the tracker resynchronises on the request. A repeated request for the species just
+        requested stays in the same timestep; a request for a species later in the sequence skips to it; a request for
+        a species earlier in the sequence starts a new timestep.
+
+        Parameters:
+            requestSequence: the scalar names of the reaction requests of a timestep, in order
+            firstTimestep: the timestep the flowsolver starts at
+    """
+    def __init__(self, requestSequence, firstTimestep):
+        self.requestSequence = list(requestSequence)
+        self.timestep = firstTimestep
+
+        # Index in requestSequence of the previous request, None at the start of a timestep
+        self._position = None
+        self._startedTimestep = False
+        # Whether beginTimestep has been called, in which case the requests do not start timesteps
+        self._beginsTimesteps = False
+        self.numberOfUnexpectedRequests = 0
+
+    """
+        Starts a new timestep, at the next request.
+    """
+    def beginTimestep(self):
+        if(self._startedTimestep):
+            self.timestep += 1
+        self._position = None
+        self._beginsTimesteps = True
+
+    """
+        Counts a reaction request.
+
+        Returns:
+            True if the request is the first one of a timestep
+    """
+    def countRequest(self, scalarName):
+        if(self._beginsTimesteps):
+            newTimestep = (self._position is None)
+            self._startedTimestep = True
+            self._position = 0
+            return newTimestep
+
+        if(not self.requestSequence):
+            return False
+
+        if(self._position is None):
+            self._startedTimestep = True
+            self._position = 0
+            if(scalarName != self.requestSequence[0]):
+                self._warnUnexpectedRequest(scalarName, self.requestSequence[0])
+                if(scalarName in self.requestSequence):
+                    self._position = self.requestSequence.index(scalarName)
+            return True
+
+        nextPosition = (self._position + 1) % len(self.requestSequence)
+        if(scalarName == self.requestSequence[nextPosition]):
+            self._position = nextPosition
+            newTimestep = (nextPosition == 0)
+        else:
+            self._warnUnexpectedRequest(scalarName, self.requestSequence[nextPosition])
+            laterPositions = [position for position in range(self._position + 1, len(self.requestSequence)) if self.requestSequence[position] == scalarName]
+
+            if(scalarName == self.requestSequence[self._position] or scalarName not in self.requestSequence):
+                newTimestep = False
+            elif(laterPositions):
+                self._position = laterPositions[0]
+                newTimestep = False
+            else:
+                self._position = self.requestSequence.index(scalarName)
+                newTimestep = True
+
+        if(newTimestep):
+            self.timestep += 1
+        return newTimestep
+
+    def _warnUnexpectedRequest(self, scalarName, expectedScalarName):
+        self.numberOfUnexpectedRequests += 1
+        if(self.numberOfUnexpectedRequests == 1):
+            print('Warning: The flowsolver asked for the reaction of "', scalarName, '" where "', expectedScalarName, '" was expected from the iterations of the '
+                  'scalar problem. The reaction requests do not follow the expected order, so the timesteps of reaction sub-stepping and profiling may be wrong. '
+                  'Further unexpected requests are not reported.', sep='')
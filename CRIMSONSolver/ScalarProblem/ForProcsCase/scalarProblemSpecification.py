@@ -15,19 +15,217 @@
 
 from __future__ import print_function
 
+import collections
+import os
+
 # sympy may use numpy behind the scenes, so let's make sure we have it!
 import numpy as np
-from sympy import lambdify
-
-# rather poor choice of naming on this sympy function
-from sympy import symbols as create_sympy_symbols
 
 from CRIMSONScalarProblem import AbstractRuntimeVectorHandler
 
+import reactionKernels
+import reactionProfiling
+import reactionSubstepping
+
+
+"""
+    Verbosity of the messages printed by this script.
+        Quiet: errors only
+        Info: set up messages (the default)
+        Debug: also the symbol values, the expressions and the results of every reaction term computation.
+            This will get very out of hand for real meshes.
+
+    Set with the CRIMSON_SCALAR_PROBLEM_LOG_LEVEL environment variable, e.g. CRIMSON_SCALAR_PROBLEM_LOG_LEVEL=debug
+"""
+class LogLevel(object):
+    Quiet, Info, Debug = range(3)
+
+def _getLogLevelFromEnvironment():
+    logLevelName = os.environ.get('CRIMSON_SCALAR_PROBLEM_LOG_LEVEL', 'info').strip().lower()
+    logLevels = {'quiet': LogLevel.Quiet, 'info': LogLevel.Info, 'debug': LogLevel.Debug}
+
+    if(logLevelName not in logLevels):
+        print('Unknown CRIMSON_SCALAR_PROBLEM_LOG_LEVEL "', logLevelName, '", using "info"', sep='')
+        return LogLevel.Info
+
+    return logLevels[logLevelName]
+
+logLevel = _getLogLevelFromEnvironment()
+
+def _log(level, *args, **kwargs):
+    if(level <= logLevel):
+        print(*args, **kwargs)
+
+
+"""
+    How the reaction terms are evaluated:
+        fused: numpy kernels with the common subexpressions eliminated, which write into preallocated buffers (the default).
+            See reactionKernels.py.
+        lambdas: the sympy lambdas.
+
+    Set with the CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION environment variable, e.g. CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION=lambdas
+
+    The expressions can be simplified before generating the fused kernels by setting
+    CRIMSON_SCALAR_PROBLEM_KERNEL_SIMPLIFICATION to horner or factor.
+"""
+useFusedReactionKernels = os.environ.get('CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION', 'fused').strip().lower() != 'lambdas'
+reactionKernelSimplification = os.environ.get('CRIMSON_SCALAR_PROBLEM_KERNEL_SIMPLIFICATION', '').strip().lower() or None
+
+
+"""
+    Memoisation of the reaction terms.
+
+    The flowsolver asks for the reaction and the gradient of several species in a nonlinear sweep, often without the
+    scalar state vectors having changed. Each result is kept with the versions of the state vectors its expression
+    depends on, and reused until one of them changes. The state vectors may be updated in place, so a change is
+    detected by comparing each state vector with a copy of it on every request. This costs a copy of every state vector
+    in memory, plus the cached reaction terms and gradients of every species, i.e. about three times the memory of the
+    state vectors, so it is disabled by default. It is only worth it on meshes small enough for the memory not to
+    matter, when the reactions are expensive.
+
+    Set CRIMSON_SCALAR_PROBLEM_MEMOISE_REACTIONS=1 to enable.
+"""
+memoiseReactionTerms = os.environ.get('CRIMSON_SCALAR_PROBLEM_MEMOISE_REACTIONS', '0').strip().lower() in ['1', 'true', 'yes', 'on']
+
+
+"""
+    Evaluation of the reaction terms on the active region only.
+
+    The reactions are usually only happening on a small part of the mesh, the rest of it staying at the initial
+    concentrations. The state vectors at the first reaction request are kept as the baseline. A node becomes active
+    once the concentration of any scalar differs from its baseline by more than activeRegionTolerance, and stays active.
+    The reaction terms are then only evaluated on the active nodes, the other nodes are given the reaction terms of
+    the baseline, which are computed once.
+
+    The active region is only updated with the state vectors which have changed since the previous request. Changes
+    are detected as for the memoisation, which costs a copy of every state vector in memory, plus the baseline.
+
+    When more than activeRegionMaximumFraction of the nodes are active, every node is evaluated instead.
+
+    Set CRIMSON_SCALAR_PROBLEM_ACTIVE_REGION_TOLERANCE to the (absolute) concentration tolerance to enable, e.g.
+    CRIMSON_SCALAR_PROBLEM_ACTIVE_REGION_TOLERANCE=1e-12
+"""
+def _getActiveRegionToleranceFromEnvironment():
+    toleranceString = os.environ.get('CRIMSON_SCALAR_PROBLEM_ACTIVE_REGION_TOLERANCE', '').strip()
+    if(not toleranceString):
+        return None
+
+    try:
+        return float(toleranceString)
+    except ValueError:
+        print('Unknown CRIMSON_SCALAR_PROBLEM_ACTIVE_REGION_TOLERANCE "', toleranceString, '", the reactions will be evaluated on every node', sep='')
+        return None
+
+activeRegionTolerance = _getActiveRegionToleranceFromEnvironment()
+activeRegionMaximumFraction = 0.5
+
+
+
+"""
+    Evaluation of the reaction terms in blocks of nodes.
+
+    Every intermediate result of the kernels and the lambdas is an array over the nodes, which are far larger than
+    the caches on real meshes. The nodes are instead evaluated in blocks small enough for the state vectors, the
+    outputs and the intermediate results of a block to stay in the cache, each written directly to its part of the output.
+
+    Set CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE to the number of nodes of the blocks, or 0 to evaluate all the nodes at once.
+    By default (auto), the block size is chosen to fit the arrays of a block within blockCacheBytes.
+    Smaller blocks use less memory for the intermediate results, larger ones have less python overhead.
+"""
+def _getBlockSizeFromEnvironment():
+    blockSizeString = os.environ.get('CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE', 'auto').strip().lower()
+    if(blockSizeString == 'auto'):
+        return None
+
+    try:
+        return max(0, int(blockSizeString))
+    except ValueError:
+        print('Unknown CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE "', blockSizeString, '", using "auto"', sep='')
+        return None
+
+reactionEvaluationBlockSize = _getBlockSizeFromEnvironment()
+
+# The arrays of a block are sized for a share of the last level cache rather than a core's own caches: every numpy
+# call of a block costs a few microseconds of python, which outweighs the gain of smaller blocks
+blockCacheBytes = 16 * 1024 * 1024
+minimumAutomaticBlockSize = 16384
+automaticBlockSizeMultiple = 4096
+
+# Estimated number of intermediate arrays of a lambda alive at once, numpy frees them as the expression is evaluated
+lambdaTemporaryArrays = 4
+
+
+"""
+    Profiling of the reaction term computations, see reactionProfiling.py.
+
+    Set CRIMSON_SCALAR_PROBLEM_PROFILE to the number of timesteps the statistics are aggregated over before they are
+    written, e.g. CRIMSON_SCALAR_PROBLEM_PROFILE=10, or 0 to disable (the default).
+    Set CRIMSON_SCALAR_PROBLEM_PROFILE_ALLOCATIONS=1 to also trace the memory allocated by each computation, which
+    slows everything down and needs python 3.9.
+"""
+def _getProfileTimestepsFromEnvironment():
+    timestepsString = os.environ.get('CRIMSON_SCALAR_PROBLEM_PROFILE', '0').strip()
+    try:
+        return max(0, int(timestepsString))
+    except ValueError:
+        print('Unknown CRIMSON_SCALAR_PROBLEM_PROFILE "', timestepsString, '", profiling is disabled', sep='')
+        return 0
+
+profileTimesteps = _getProfileTimestepsFromEnvironment()
+profileAllocations = os.environ.get('CRIMSON_SCALAR_PROBLEM_PROFILE_ALLOCATIONS', '0').strip().lower() in ['1', 'true', 'yes', 'on']
+
+
+"""
+    generated_reactionKernels.py is written by the UI alongside generated_scalarProblemSpecification.py. It contains the
+    fused reaction kernels and the plain data of the specification, so that it can be used without importing sympy,
+    building the expressions, differentiating them and generating the kernels on every rank.
+
+    Returns the module, or None if it is missing, or if it was not generated from the current
+    generated_scalarProblemSpecification.py (e.g. the specification was edited by hand) or by the current reactionKernels.py.
+    The symbolic path is then used instead.
+"""
+def _importPrecompiledReactionKernels():
+    if(not useFusedReactionKernels):
+        return None
+
+    try:
+        import generated_reactionKernels
+    except ImportError:
+        _log(LogLevel.Info, 'generated_reactionKernels.py not found, the reaction kernels will be generated at start up.')
+        return None
+
+    specificationPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_scalarProblemSpecification.py')
+    try:
+        with open(specificationPath, 'rb') as specificationFile:
+            specificationChecksum = reactionKernels.ComputeSpecificationChecksum(specificationFile.read())
+    except IOError:
+        specificationChecksum = None
+
+    trueDivision = getattr(generated_reactionKernels, 'TrueDivision', None)
+
+    if(getattr(generated_reactionKernels, 'SpecificationChecksum', None) != specificationChecksum or
+       getattr(generated_reactionKernels, 'KernelFormatVersion', None) != reactionKernels.KernelFormatVersion or
+       (trueDivision is not None and trueDivision != reactionKernels.UsesTrueDivision())):
+        _log(LogLevel.Info, 'generated_reactionKernels.py is out of date with generated_scalarProblemSpecification.py, the reaction kernels will be generated at start up.')
+        return None
+
+    return generated_reactionKernels
+
+PrecompiledReactionKernels = _importPrecompiledReactionKernels()
+
 """
     This file contains configuration information from the UI. It should be in the same directory as this script.
+
+    When the precompiled reaction kernels are up to date, they contain the same data and sympy is not needed.
 """
-import generated_scalarProblemSpecification as Generated
+if(PrecompiledReactionKernels is not None):
+    Generated = PrecompiledReactionKernels
+else:
+    import generated_scalarProblemSpecification as Generated
+
+def _importGeneratedSpecification():
+    import generated_scalarProblemSpecification
+    return generated_scalarProblemSpecification
 
 
 """
@@ -54,6 +252,35 @@ def CalculateDerivativeOfExpressions(expressions, symbols):
 
     return expressions_dSymbol
 
+"""
+    Calculates the partial derivative of each expression with respect to every scalar, i.e. the Jacobian of the
+    reactions. Only the entries which are not identically zero are kept.
+
+    Returns:
+        An ordered dictionary of (<scalar name of the expression>, <scalar name of the derivative>):<sympy expression>,
+        ordered by the expressions, then the derivatives, in the order of scalarNames
+
+    Throws:
+        KeyError: If an expression relates to an undefined scalar symbol
+"""
+def CalculateJacobianOfExpressions(expressions, symbols, scalarNames):
+
+    jacobian = collections.OrderedDict()
+
+    for scalarName in scalarNames:
+        if(scalarName not in symbols):
+            raise KeyError('Scalar name ' + scalarName + ' is referenced in an expression but it is not present in symbols.')
+
+        expression = expressions[scalarName]
+
+        for derivativeScalarName in scalarNames:
+            expression_dSymbol = expression.diff(symbols[derivativeScalarName])
+
+            if(expression_dSymbol != 0):
+                jacobian[(scalarName, derivativeScalarName)] = expression_dSymbol
+
+    return jacobian
+
 """
     Converts 
         a dictionary of <scalar name>:<sympy expression>
@@ -63,10 +290,12 @@ def CalculateDerivativeOfExpressions(expressions, symbols):
 def ExpressionsToLambdas(symbols, expressions, style = 'numpy'):
     reactionLambdas = dict()
 
+    from sympy import lambdify
+
     for scalarName in expressions:
         expression = expressions[scalarName]
 
-        scalarLambda = lambdify(symbols.values(), expression, style)
+        scalarLambda = lambdify(list(symbols.values()), expression, style)
 
         reactionLambdas[scalarName] = scalarLambda
 
@@ -137,19 +366,57 @@ class ScalarProblemSpecification(AbstractRuntimeVectorHandler):
 
         # Reaction initialization:
 
+        if(PrecompiledReactionKernels is not None):
+            _log(LogLevel.Info, "Using the precompiled reaction kernels from generated_reactionKernels.py")
+
+            # The order of the arguments of the precompiled kernels
+            self._symbolNameArray = list(PrecompiledReactionKernels.SymbolNames)
+
+            # The sympy symbols, expressions and lambdas are only set up if they are needed, see _initializeSymbolicReactions
+            self._symbols = None
+            self._reactionExpressions = None
+            self._reactionGradientExpressions = None
+            self._symbolLambdas = None
+            self._symbolGradientLambdas = None
+
+            self._setReactionKernels(vars(PrecompiledReactionKernels))
+        else:
+            # The order of the arguments of the lambdas and the kernels
+            self._symbolNameArray = list(Generated.Symbols)
+
+            self._initializeSymbolicReactions()
+
+            self._setReactionKernels(None)
+            if(useFusedReactionKernels):
+                self._generateReactionKernels()
+
+        self._bindSymbols()
+        self._initializeReactionTermCache()
+        self._initializeReactionTimestepTracker(timestepIndexAtConstruction)
+        self._initializeReactionSubstepping()
+        self.resetActiveRegion()
+
+        # Set up on first use, see _initializeReactionJacobian
+        self._reactionJacobianStructure = None
+
+        self._initializeReactionProfiler(mpi_rank, timestepIndexAtConstruction)
+
+    def _initializeSymbolicReactions(self):
+        Specification = _importGeneratedSpecification()
+
         """
             A dictionary of all sympy symbols used in the reaction, this includes scalar symbols and reaction coefficients
         """
-        self._symbols = Generated.Symbols
+        self._symbols = collections.OrderedDict((symbolName, Specification.Symbols[symbolName]) for symbolName in self._symbolNameArray)
 
-        print("Pre-calculating reaction equations....")
+        _log(LogLevel.Info, "Pre-calculating reaction equations....")
         
         """
             Expressions for the reaction of each scalar.
             These are provided so that you can do custom things with the expressions, e.g., take the derivative on the fly during a timestep's calculation.
             I precompute lambdas for the reactions and their derivatives, though, for speed reasons.
         """
-        self._reactionExpressions = Generated.ReactionExpressions
+        self._reactionExpressions = Specification.ReactionExpressions
 
         """
             Expressions for the partial derivative of each scalar's reaction, with respect to that scalar.
@@ -170,58 +437,475 @@ class ScalarProblemSpecification(AbstractRuntimeVectorHandler):
         self._symbolGradientLambdas = ExpressionsToLambdas(self._symbols, self._reactionGradientExpressions)
 
     """
-        Throws only on internal error conditions: 
-            RuntimeError: If `self._symbols` is out of sync with `ReactionCoefficients` and `ScalarNames`
-            RuntimeError: If you or I made a typo in this method and didn't set `value` to anything
-            RuntimeError: if a symbol does not have a state vector associated with it in the flowsolver
+        Fused kernels computing the reactions and their derivatives (the namespace of the kernels module), None if the lambdas are used instead.
+    """
+    def _setReactionKernels(self, kernels):
+        self._reactionKernels = kernels
+        if(kernels is not None):
+            self._kernelBuffers = reactionKernels.KernelBuffers(kernels['NumberOfBuffers'])
+            # The active nodes are evaluated with buffers of their own, which grow with the active region, so that
+            # evaluating all the nodes (e.g. the baseline) in between does not reallocate either of them
+            self._activeRegionKernelBuffers = reactionKernels.KernelBuffers(kernels['NumberOfBuffers'], growOnly=True)
+
+    def _generateReactionKernels(self):
+        try:
+            source = reactionKernels.GenerateReactionKernelsSource(self._symbolNameArray, ScalarIndexToName, self._symbols,
+                                                                   self._reactionExpressions, self._reactionGradientExpressions,
+                                                                   reactionKernelSimplification)
+            self._setReactionKernels(reactionKernels.CompileReactionKernels(source))
+        except Exception as e:
+            print('Failed to generate the fused reaction kernels, falling back to the lambdas:', e)
+            self._setReactionKernels(None)
+            return
+
+        _log(LogLevel.Debug, 'Reaction kernels:')
+        _log(LogLevel.Debug, source)
 
-        Gets an array containing the current state of each scalar, plus the constants.
-        Of the form:
-        [<constant value>, <constant value>, ..... <scalar value>, <scalar value>, ....]
+    """
+        Sets up the memoisation of the reaction terms, see memoiseReactionTerms.
+    """
+    def _initializeReactionTermCache(self):
+        # The scalar numbers each reaction and gradient depends on
+        self._reactionDependencies = {}
+        self._gradientDependencies = {}
+
+        for scalarName in ScalarIndexToName:
+            if(self._reactionKernels is not None and 'ReactionDependencies' in self._reactionKernels):
+                reactionDependencies = self._reactionKernels['ReactionDependencies'][scalarName]
+                gradientDependencies = self._reactionKernels['GradientDependencies'][scalarName]
+            else:
+                reactionDependencies = reactionKernels.ScalarDependencies(self._reactionExpressions[scalarName], ScalarIndexToName, self._symbols)
+                gradientDependencies = reactionKernels.ScalarDependencies(self._reactionGradientExpressions[scalarName], ScalarIndexToName, self._symbols)
 
-        Where the size of the array and the order of these items MUST match the order of of items in symbols
+            self._reactionDependencies[scalarName] = [_scalarNumber(ScalarNameToIndex[name]) for name in reactionDependencies]
+            self._gradientDependencies[scalarName] = [_scalarNumber(ScalarNameToIndex[name]) for name in gradientDependencies]
 
-        For ease of validation I decided to have this also return an array of symbol names.
+        # <scalar number>: version, incremented whenever the state vector is found to have changed
+        self._scalarStateVersions = {}
+
+        # <scalar number>: copy of the state vector when its version was last checked
+        self._scalarStateSnapshots = {}
+
+        # (<scalar name>, <computeGradient>): (<versions of the dependencies>, <result>)
+        self._reactionTermCache = {}
 
     """
-    def getSymbolStateArray(self):
-        symbolNameArray = []
-        valueArray = []
+        Follows the flow timesteps through the reaction requests, for reaction sub-stepping and profiling.
+        See reactionSubstepping.ReactionTimestepTracker.
+    """
+    def _initializeReactionTimestepTracker(self, firstTimestep):
+        # The flowsolver asks for the reaction of the species being solved once per solve iteration
+        requestSequence = []
+        for iterationDict in Generated.Iterations:
+            requestSequence.extend([iterationDict["Operation"]] * iterationDict["Iterations"])
+
+        self._reactionTimestepTracker = reactionSubstepping.ReactionTimestepTracker(requestSequence, firstTimestep)
+
+    """
+        Sets up the operator-split integration of the reactions, if it is enabled in the solver parameters.
+        See reactionSubstepping.py.
+    """
+    def _initializeReactionSubstepping(self):
+        self._reactionSubstepper = None
+
+        # Not in specifications generated before reaction sub-stepping
+        settings = getattr(Generated, 'ReactionSubstepping', None) or {}
+        if(not settings.get('Enabled', False)):
+            return
+
+        if(self._reactionKernels is None):
+            print('Warning: Reaction sub-stepping needs the fused reaction kernels, which are not available. The reactions will not be sub-stepped.')
+            return
+
+        self._reactionSubstepper = reactionSubstepping.ReactionSubstepper(self._reactionKernels, self._symbolNameArray, ScalarIndexToName,
+                                                                          Generated.ReactionCoefficients, settings['Method'], settings['Substeps'])
+        self._reactionSubsteppingTimestepSize = settings['TimeStepSize']
+
+        # Integrated at the first reaction request of every timestep, see _getSubsteppedReactionTerm
+        self._substeppedReactionTerms = None
+
+        _log(LogLevel.Info, 'Reactions are integrated with', settings['Substeps'], settings['Method'], 'sub-steps per timestep')
+
+    """
+        Sets up the profiling of the reaction term computations, if it is enabled, see profileTimesteps.
+    """
+    def _initializeReactionProfiler(self, mpiRank, firstTimestep):
+        self._reactionProfiler = None
+
+        # How the last reaction term was computed, for the profiler
+        self._evaluationPath = None
 
-        for symbolName in self._symbols:
+        if(profileTimesteps == 0):
+            return
 
-            value = None
+        if(profileAllocations and not reactionProfiling.CanTraceAllocations()):
+            print('Warning: Tracing the allocations of the reaction terms needs python 3.9, only their times will be profiled.')
 
-            # Detect what type of symbol it is, then get the (current) value of this symbol.
-            if(symbolName in ScalarIndexToName):
-                # The concentration of each scalar does change through the course of the simulation, so we 
-                # should use the scalar state dictionary to get the scalar values at this iteration
-                scalarNumber = _scalarNumber(ScalarNameToIndex[symbolName])
+        # The timesteps are followed by the tracker of the reaction requests, see _initializeReactionTimestepTracker
+        self._reactionProfiler = reactionProfiling.ReactionProfiler(mpiRank, firstTimestep, profileTimesteps, profileAllocations)
+
+        _log(LogLevel.Info, 'Profiling the reaction terms to', self._reactionProfiler.fileName, 'every', profileTimesteps, 'timesteps')
+
+    """
+        Starts a new flow timestep: with reaction sub-stepping, the next reaction request integrates the reactions
+        from the state vectors at that point.
+
+        This is the reliable way for the flowsolver to tell the timesteps of sub-stepping and profiling. Until it is
+        called, the timesteps are guessed from the order of the reaction requests, which is only a fallback: a call
+        pattern other than the iterations of the specification (e.g. a solve stopped early once converged) makes the
+        reactions integrated at the wrong time, see reactionSubstepping.ReactionTimestepTracker.
+    """
+    def beginReactionTimestep(self):
+        self._reactionTimestepTracker.beginTimestep()
+
+    """
+        The source term equivalent to integrating the reactions over the timestep, from the state vectors at the
+        first reaction request of the timestep. It is a constant of the timestep, so its gradient is 0.
+    """
+    def _getSubsteppedReactionTerm(self, scalarName, computeGradient):
+        if(computeGradient):
+            return 0.0
 
-                if(scalarNumber not in self.scalarStateVectorsDictionary):
-                    raise RuntimeError('Scalar number {} could not be found in scalarStateVectorsDictionary. Contents of dictionary: {}'.format(scalarNumber, self.scalarStateVectorsDictionary.keys()))
+        if(self._substeppedReactionTerms is None):
+            concentrations = np.array([self.scalarStateVectorsDictionary[_scalarNumber(scalarIndex)] for scalarIndex in range(len(ScalarIndexToName))], dtype=float)
+            sourceTerms = self._reactionSubstepper.computeEquivalentSourceTerms(concentrations.reshape(len(ScalarIndexToName), -1),
+                                                                                self._reactionSubsteppingTimestepSize)
+
+            self._substeppedReactionTerms = sourceTerms.reshape(concentrations.shape)
+
+        return self._substeppedReactionTerms[ScalarNameToIndex[scalarName]]
+
+    """
+        Returns the current version of the state vector of scalarNumber.
+    """
+    def _getScalarStateVersion(self, scalarNumber):
+        stateVector = self.scalarStateVectorsDictionary[scalarNumber]
+        snapshot = self._scalarStateSnapshots.get(scalarNumber)
+
+        if(snapshot is not None and snapshot.shape == np.shape(stateVector) and np.array_equal(snapshot, stateVector)):
+            return self._scalarStateVersions[scalarNumber]
+
+        self._scalarStateVersions[scalarNumber] = self._scalarStateVersions.get(scalarNumber, 0) + 1
+        if(snapshot is None or snapshot.shape != np.shape(stateVector)):
+            self._scalarStateSnapshots[scalarNumber] = np.array(stateVector, dtype=float)
+        else:
+            snapshot[...] = stateVector
+
+        return self._scalarStateVersions[scalarNumber]
+
+    def _getDependencyVersions(self, scalarNumbers):
+        return tuple(self._getScalarStateVersion(scalarNumber) for scalarNumber in scalarNumbers)
+
+    """
+        Returns the array the result for cacheKey should be written to, reusing the previous one if possible.
+    """
+    def _getReactionTermCacheArray(self, cacheKey, shape):
+        cached = self._reactionTermCache.pop(cacheKey, None)
+        if(cached is not None and cached[1].shape == shape):
+            return cached[1]
+
+        return np.empty(shape)
+
+    def _getCachedReactionTerm(self, cacheKey, versions, shape):
+        cached = self._reactionTermCache.get(cacheKey)
+        if(cached is not None and cached[0] == versions and cached[1].shape == shape):
+            return cached[1]
+
+        return None
+
+    """
+        Forgets all the memoised reaction terms.
+        Not needed when the scalar state vectors change, they are checked by every computation.
+    """
+    def clearReactionTermCache(self):
+        self._reactionTermCache.clear()
+
+        if(self._reactionJacobianStructure is not None):
+            self._reactionJacobianVersions = None
+
+    """
+        Forgets the active region and its baseline, see activeRegionTolerance.
+        The state vectors at the next reaction request become the new baseline.
+    """
+    def resetActiveRegion(self):
+        # <scalar number>: state vector at the first reaction request
+        self._activeRegionBaseline = None
+
+        # (<scalar name>, <computeGradient>): reaction term of the baseline
+        self._activeRegionBaselineResults = {}
+
+        # Boolean array of the nodes, and the flat indices of the active ones
+        self._activeNodes = None
+        self._activeNodeIndices = None
+
+        # <scalar number>: version of the state vector the active nodes were last updated with
+        self._activeRegionVersions = {}
+
+    """
+        Updates the active nodes with the state vectors of scalarNumbers.
+
+        A reaction term only needs the active nodes of the scalars it depends on to be up to date, the nodes where
+        they are at their baseline have the reaction term of the baseline whatever the other scalars are.
+
+        Parameters:
+            versions: the versions of the state vectors of scalarNumbers, those which have not changed since the last
+                update are skipped
+    """
+    def _updateActiveRegion(self, shape, scalarNumbers, versions):
+        if(self._activeRegionBaseline is None or self._activeNodes.shape != shape):
+            self.resetActiveRegion()
+            self._activeRegionBaseline = dict((_scalarNumber(scalarIndex), np.array(self.scalarStateVectorsDictionary[_scalarNumber(scalarIndex)], dtype=float))
+                                              for scalarIndex in range(len(ScalarIndexToName)))
+            self._activeNodes = np.zeros(shape, dtype=bool)
+            self._activeNodeIndices = np.flatnonzero(self._activeNodes)
+            self._activeRegionDifference = np.empty(shape)
+            self._activeRegionNewlyActiveNodes = np.empty(shape, dtype=bool)
+
+        for dependencyIndex in range(len(scalarNumbers)):
+            scalarNumber = scalarNumbers[dependencyIndex]
+
+            if(self._activeRegionVersions.get(scalarNumber) == versions[dependencyIndex]):
+                continue
+            self._activeRegionVersions[scalarNumber] = versions[dependencyIndex]
+
+            np.subtract(self.scalarStateVectorsDictionary[scalarNumber], self._activeRegionBaseline[scalarNumber], out=self._activeRegionDifference)
+            np.abs(self._activeRegionDifference, out=self._activeRegionDifference)
+            np.greater(self._activeRegionDifference, activeRegionTolerance, out=self._activeRegionNewlyActiveNodes)
+            np.logical_or(self._activeNodes, self._activeRegionNewlyActiveNodes, out=self._activeNodes)
+
+        # Nodes stay active, so the index only changes if there are more of them
+        if(np.count_nonzero(self._activeNodes) != len(self._activeNodeIndices)):
+            self._activeNodeIndices = np.flatnonzero(self._activeNodes)
+
+    def _getActiveRegionBaselineResult(self, scalarName, computeGradient, symbolStateArray):
+        cacheKey = (scalarName, computeGradient)
+        if(cacheKey not in self._activeRegionBaselineResults):
+            baselineStateArray = list(symbolStateArray)
+            for symbolIndex in range(len(self._symbolScalarNumbers)):
+                if(self._symbolScalarNumbers[symbolIndex] is not None):
+                    baselineStateArray[symbolIndex] = self._activeRegionBaseline[self._symbolScalarNumbers[symbolIndex]]
+
+            baselineResult = np.empty(self._activeNodes.shape)
+            self._evaluateReactionTerm(baselineResult, scalarName, computeGradient, baselineStateArray, self._reactionKernels is not None)
+            self._activeRegionBaselineResults[cacheKey] = baselineResult
+
+        return self._activeRegionBaselineResults[cacheKey]
+
+    """
+        Computes the reaction term on the active nodes, and copies it from the baseline on the others.
+
+        Returns False, without computing anything, if the active region is not used for this computation.
+
+        Parameters:
+            dependencies: the scalar numbers the reaction term depends on
+            versions: the versions of their state vectors, if already known
+    """
+    def _computeReactionTermOnActiveRegion(self, reactionTermOutput, scalarName, computeGradient, symbolStateArray, dependencies, versions):
+        if(activeRegionTolerance is None or not isinstance(reactionTermOutput, np.ndarray) or
+           not self._stateVectorsHaveShape(reactionTermOutput.shape, symbolStateArray)):
+            return False
+
+        if(versions is None):
+            versions = self._getDependencyVersions(dependencies)
+
+        self._updateActiveRegion(reactionTermOutput.shape, dependencies, versions)
+
+        activeNodeIndices = self._activeNodeIndices
+        if(len(activeNodeIndices) > activeRegionMaximumFraction * reactionTermOutput.size):
+            return False
+
+        _log(LogLevel.Debug, 'Evaluating on', len(activeNodeIndices), 'active nodes out of', reactionTermOutput.size)
+
+        reactionTermOutput[...] = self._getActiveRegionBaselineResult(scalarName, computeGradient, symbolStateArray)
+
+        if(len(activeNodeIndices) > 0):
+            # The state vectors the reaction term does not depend on are not used, so they are not gathered
+            activeStateArray = list(symbolStateArray)
+            for symbolIndex in range(len(self._symbolScalarNumbers)):
+                if(self._symbolScalarNumbers[symbolIndex] in dependencies):
+                    activeStateArray[symbolIndex] = np.take(symbolStateArray[symbolIndex], activeNodeIndices)
+
+            activeResult = np.empty(len(activeNodeIndices))
+            self._evaluateReactionTerm(activeResult, scalarName, computeGradient, activeStateArray, self._reactionKernels is not None,
+                                       self._activeRegionKernelBuffers if self._reactionKernels is not None else None)
+            np.put(reactionTermOutput, activeNodeIndices, activeResult)
+
+        return True
+
+    def _stateVectorsHaveShape(self, shape, symbolStateArray):
+        for symbolIndex in range(len(self._symbolScalarNumbers)):
+            if(self._symbolScalarNumbers[symbolIndex] is not None and np.shape(symbolStateArray[symbolIndex]) != shape):
+                return False
+
+        return True
+
+    """
+        The kernels write into buffers of the shape of the output with numpy ufuncs, which needs all the state vectors
+        to have that same shape. Anything else is left to the lambdas.
+    """
+    def _canUseReactionKernels(self, reactionTermOutput, symbolStateArray):
+        if(self._reactionKernels is None or not isinstance(reactionTermOutput, np.ndarray) or reactionTermOutput.dtype != np.float64):
+            return False
+
+        return self._stateVectorsHaveShape(reactionTermOutput.shape, symbolStateArray)
+
+    """
+        Writes the reaction term (or its gradient) for symbolStateArray into reactionTermOutput, with the kernel or the lambda.
+
+        Parameters:
+            kernelBuffers: the reactionKernels.KernelBuffers of the kernels, self._kernelBuffers by default
+    """
+    def _evaluateReactionTerm(self, reactionTermOutput, scalarName, computeGradient, symbolStateArray, useKernels, kernelBuffers=None):
+        if(useKernels):
+            kernel = self._reactionKernels['GradientKernels' if computeGradient else 'ReactionKernels'][scalarName]
+
+            def evaluateBlock(outputBlocks, stateArrayBlock, buffers):
+                kernel(outputBlocks[0], buffers, *stateArrayBlock)
+
+            self._evaluateInBlocks(evaluateBlock, [reactionTermOutput], symbolStateArray, useKernels, kernelBuffers)
+
+            _log(LogLevel.Debug, 'Result of kernel:', reactionTermOutput)
+            return
+
+        if(computeGradient):
+            lambdaToRun = self._symbolGradientLambdas[scalarName]
+        else:
+            lambdaToRun = self._symbolLambdas[scalarName]
+
+        def evaluateBlock(outputBlocks, stateArrayBlock, buffers):
+            result = lambdaToRun(*stateArrayBlock)
+
+            # NOTE: result could be just 0, not [0], e.g., if the gradient resolved to 0 because there were no instances of symbol 'I' need to handle that
+            # TODO: does a reaction that resolves to some constant k1 mean that the concentration of a scalar should be set to that at all nodes?
+            if(np.ndim(result) == 0):
+                _log(LogLevel.Debug, "Note: lambda returned non-array value, returning constant value for all nodes")
+
+            # Broadcasting writes both the array and the constant results in place, without any temporaries
+            outputBlocks[0][...] = result
+
+        self._evaluateInBlocks(evaluateBlock, [reactionTermOutput], symbolStateArray, useKernels)
+
+        _log(LogLevel.Debug, 'Result of lambda:', reactionTermOutput)
+
+    """
+        Calls evaluateBlock(<blocks of outputs>, <blocks of symbolStateArray>, <kernel buffers, or None for the lambdas>)
+        for each block of nodes, see reactionEvaluationBlockSize. The arrays are passed whole if they are not blocked.
+
+        Parameters:
+            kernelBuffers: the reactionKernels.KernelBuffers of the kernels, self._kernelBuffers by default
+    """
+    def _evaluateInBlocks(self, evaluateBlock, outputs, symbolStateArray, useKernels, kernelBuffers=None):
+        blockSize = self._getBlockSize(outputs, symbolStateArray, useKernels)
+        if(kernelBuffers is None and useKernels):
+            kernelBuffers = self._kernelBuffers
+
+        if(blockSize == 0):
+            evaluateBlock(outputs, symbolStateArray, kernelBuffers.get(outputs[0].shape) if useKernels else None)
+            return
+
+        # Views of the contiguous arrays, the state vectors are only copied if they are not contiguous
+        flatOutputs = [output.reshape(-1) for output in outputs]
+        flatStateArray = list(symbolStateArray)
+        for symbolIndex in range(len(self._symbolScalarNumbers)):
+            if(self._symbolScalarNumbers[symbolIndex] is not None):
+                flatStateArray[symbolIndex] = np.ravel(symbolStateArray[symbolIndex])
+
+        nNodes = flatOutputs[0].size
+        stateArrayBlock = list(flatStateArray)
+        for blockStart in range(0, nNodes, blockSize):
+            blockStop = min(blockStart + blockSize, nNodes)
+
+            for symbolIndex in range(len(self._symbolScalarNumbers)):
+                if(self._symbolScalarNumbers[symbolIndex] is not None):
+                    stateArrayBlock[symbolIndex] = flatStateArray[symbolIndex][blockStart:blockStop]
+
+            buffers = kernelBuffers.getBlock(blockSize, blockStop - blockStart) if useKernels else None
+            evaluateBlock([output[blockStart:blockStop] for output in flatOutputs], stateArrayBlock, buffers)
+
+    """
+        Returns the number of nodes of the blocks the outputs are evaluated in, 0 if they are evaluated whole.
+    """
+    def _getBlockSize(self, outputs, symbolStateArray, useKernels):
+        if(reactionEvaluationBlockSize == 0):
+            return 0
+
+        for output in outputs:
+            if(not isinstance(output, np.ndarray) or not output.flags.c_contiguous):
+                return 0
+
+        # Anything else relies on the broadcasting of the whole arrays
+        if(not self._stateVectorsHaveShape(outputs[0].shape, symbolStateArray)):
+            return 0
+
+        blockSize = reactionEvaluationBlockSize
+        if(blockSize is None):
+            # Every scalar, output and temporary array of a block should fit in the cache together
+            temporaryArrays = self._reactionKernels['NumberOfBuffers'] if useKernels else lambdaTemporaryArrays
+            arraysPerNode = len(ScalarIndexToName) + len(outputs) + temporaryArrays
+            blockSize = blockCacheBytes // (arraysPerNode * np.dtype(float).itemsize)
+            blockSize = max(minimumAutomaticBlockSize, blockSize - blockSize % automaticBlockSizeMultiple)
+
+        if(outputs[0].size <= blockSize):
+            return 0
+
+        return blockSize
+
+    """
+        Throws:
+            RuntimeError: If the symbols are out of sync with `ReactionCoefficients` and `ScalarNames`
+
+        Resolves every symbol to either the scalar number of its state vector, or its constant coefficient value.
+        This is only done once, so that getSymbolStateArray only needs to look up the current state vectors.
+    """
+    def _bindSymbols(self):
+        # The scalar number for the scalar symbols, None for the reaction coefficients
+        self._symbolScalarNumbers = []
+
+        # Reused by every getSymbolStateArray call. The reaction coefficients never change, so they are filled in here.
+        self._symbolStateArray = []
+
+        for symbolName in self._symbolNameArray:
+            if(symbolName in ScalarNameToIndex):
+                self._symbolScalarNumbers.append(_scalarNumber(ScalarNameToIndex[symbolName]))
+                self._symbolStateArray.append(None)
 
-                value = self.scalarStateVectorsDictionary[scalarNumber]
-                
             elif(symbolName in Generated.ReactionCoefficients):
-                # The value of these constants does not change through the course of the simulation, so we can just grab the generated value
-                value = Generated.ReactionCoefficients[symbolName]
+                self._symbolScalarNumbers.append(None)
+                self._symbolStateArray.append(Generated.ReactionCoefficients[symbolName])
 
             else:
                 raise RuntimeError("Unexpected error: Symbol '" + symbolName + "' is in the _symbols list but is not a reaction coefficient or scalar.")
 
-            # Need to use is, because for some reason numpy overloaded the == None check to say "is every element None", that's not what I meant
-            if(value is None):
-                # this is really just here to protect us if we happen to add another elif but forget to set value to something in it
-                raise RuntimeError("Unexpected error: Failed to set a value for symbol '" + symbolName + "'")
+    """
+        Throws only on internal error conditions: 
+            RuntimeError: if a symbol does not have a state vector associated with it in the flowsolver
+
+        Gets an array containing the current state of each scalar, plus the constants.
+        Of the form:
+        [<constant value>, <constant value>, ..... <scalar value>, <scalar value>, ....]
+
+        Where the size of the array and the order of these items MUST match the order of of items in symbols
+
+        For ease of validation I decided to have this also return an array of symbol names.
+
+        Note that the same lists are returned (and updated) by every call, the state vectors themselves are not copied.
+    """
+    def getSymbolStateArray(self):
+        for symbolIndex in range(len(self._symbolScalarNumbers)):
+            scalarNumber = self._symbolScalarNumbers[symbolIndex]
 
-            valueArray.append(value)
-            symbolNameArray.append(symbolName)
+            if(scalarNumber is None):
+                # Reaction coefficient, already set in _bindSymbols
+                continue
 
-        assert(len(self._symbols) == len(valueArray))
-        assert(len(valueArray) == len(symbolNameArray))
+            # The concentration of each scalar does change through the course of the simulation, so we 
+            # should use the scalar state dictionary to get the scalar values at this iteration
+            if(scalarNumber not in self.scalarStateVectorsDictionary):
+                raise RuntimeError('Scalar number {} could not be found in scalarStateVectorsDictionary. Contents of dictionary: {}'.format(scalarNumber, self.scalarStateVectorsDictionary.keys()))
 
-        return (valueArray, symbolNameArray) 
+            self._symbolStateArray[symbolIndex] = self.scalarStateVectorsDictionary[scalarNumber]
+
+        return (self._symbolStateArray, self._symbolNameArray)
     
     """
         Throws:
@@ -243,6 +927,15 @@ class ScalarProblemSpecification(AbstractRuntimeVectorHandler):
             KeyError: If `scalarNumber` is  < 1 (enforces that this must be 1 based and prevents indexing of -1)
     """
     def computeScalarLHSorRHSVectorForOneSpecies(self, reactionTermOutput, scalarNumber, computeGradient):
+        if(self._reactionProfiler is None):
+            return self._computeScalarLHSorRHSVectorForOneSpecies(reactionTermOutput, scalarNumber, computeGradient)
+
+        profilerToken = self._reactionProfiler.startCall()
+        self._computeScalarLHSorRHSVectorForOneSpecies(reactionTermOutput, scalarNumber, computeGradient)
+        self._reactionProfiler.setTimestep(self._reactionTimestepTracker.timestep)
+        self._reactionProfiler.endCall(profilerToken, ScalarIndexToName[scalarNumber - 1], computeGradient, self._evaluationPath, np.size(reactionTermOutput))
+
+    def _computeScalarLHSorRHSVectorForOneSpecies(self, reactionTermOutput, scalarNumber, computeGradient):
         if(scalarNumber > len(ScalarIndexToName)):
             print('Number of Scalars:', len(ScalarIndexToName))
             print(ScalarIndexToName)
@@ -253,50 +946,225 @@ class ScalarProblemSpecification(AbstractRuntimeVectorHandler):
         
         scalarName = ScalarIndexToName[scalarNumber - 1]
 
-        print('Scalar to be computed: "', scalarName, '" (scalarNumber=', scalarNumber, ')', sep ='')
+        _log(LogLevel.Debug, 'Scalar to be computed: "', scalarName, '" (scalarNumber=', scalarNumber, ')', sep ='')
 
+        (symbolStateArray, symbolNameArray) = self.getSymbolStateArray()
 
+        if(logLevel >= LogLevel.Debug):
+            print('The values for this iteration are:')
+            for symbolIndex in range(len(symbolStateArray)):
+                print('[',symbolIndex,'] "', symbolNameArray[symbolIndex], '" = ', symbolStateArray[symbolIndex], sep = '')
 
-        (symbolStateArray, symbolNameArray) = self.getSymbolStateArray()
+        if(not computeGradient and self._reactionTimestepTracker.countRequest(scalarName)):
+            # The reactions are integrated from the state vectors at the first request of the timestep
+            self._substeppedReactionTerms = None
 
-        assert(len(symbolStateArray) == len(symbolStateArray))
-        print('The values for this iteration are:')
-        
-        for symbolIndex in range(len(symbolStateArray)):
-            # For debugging purposes only, this print statement will get very out of hand for real meshes
-            print('[',symbolIndex,'] "', symbolNameArray[symbolIndex], '" = ', symbolStateArray[symbolIndex], sep = '')
-            pass
+        if(self._reactionSubstepper is not None):
+            self._evaluationPath = 'substepped'
+            reactionTermOutput[...] = self._getSubsteppedReactionTerm(scalarName, computeGradient)
+            _log(LogLevel.Debug, 'Result of reaction sub-stepping:', reactionTermOutput)
+            return
 
+        dependencies = self._gradientDependencies[scalarName] if computeGradient else self._reactionDependencies[scalarName]
+        versions = None
 
-        lambdaToRun = None
+        if(memoiseReactionTerms):
+            cacheKey = (scalarName, computeGradient)
+            versions = self._getDependencyVersions(dependencies)
 
-        if(computeGradient):
-            lambdaToRun = self._symbolGradientLambdas[scalarName]
-            scalarPolynomial = self._reactionGradientExpressions[scalarName]
+            cachedResult = self._getCachedReactionTerm(cacheKey, versions, np.shape(reactionTermOutput))
+            if(cachedResult is not None):
+                self._evaluationPath = 'memoised'
+                reactionTermOutput[...] = cachedResult
+                _log(LogLevel.Debug, 'Reused memoised result:', reactionTermOutput)
+                return
+
+        useKernels = self._canUseReactionKernels(reactionTermOutput, symbolStateArray)
+
+        # With the precompiled kernels, the expressions and lambdas are only needed for debugging and the shapes the kernels do not handle
+        if(self._symbolLambdas is None and (not useKernels or logLevel >= LogLevel.Debug)):
+            self._initializeSymbolicReactions()
+
+        if(logLevel >= LogLevel.Debug):
             print('Expression:')
-            print(scalarName, ' = ', scalarPolynomial, sep='')
+            if(computeGradient):
+                print(scalarName, ' = ', self._reactionGradientExpressions[scalarName], sep='')
+            else:
+                print(scalarName, ' = ', self._reactionExpressions[scalarName], sep='')
+
+        if(self._computeReactionTermOnActiveRegion(reactionTermOutput, scalarName, computeGradient, symbolStateArray, dependencies, versions)):
+            self._evaluationPath = 'activeRegion'
+            _log(LogLevel.Debug, 'Result on the active region:', reactionTermOutput)
+
+        elif(useKernels and memoiseReactionTerms and not computeGradient):
+            self._evaluationPath = 'reactionAndGradientKernel'
+            # The gradient is usually asked for next, with the same state vectors, so compute it in the same pass.
+            # Its dependencies are a subset of those of the reaction, which have just been checked.
+            gradientCacheKey = (scalarName, True)
+            gradientResult = self._getReactionTermCacheArray(gradientCacheKey, reactionTermOutput.shape)
+
+            kernel = self._reactionKernels['ReactionAndGradientKernels'][scalarName]
+
+            def evaluateBlock(outputBlocks, stateArrayBlock, buffers):
+                kernel(outputBlocks[0], outputBlocks[1], buffers, *stateArrayBlock)
+
+            self._evaluateInBlocks(evaluateBlock, [reactionTermOutput, gradientResult], symbolStateArray, useKernels)
+
+            self._reactionTermCache[gradientCacheKey] = (self._getDependencyVersions(self._gradientDependencies[scalarName]), gradientResult)
+            _log(LogLevel.Debug, 'Result of kernel:', reactionTermOutput)
+
         else:
-            scalarPolynomial = self._reactionExpressions[scalarName]
-            print('Expression:')
-            print(scalarName, ' = ', scalarPolynomial, sep='')
-            lambdaToRun = self._symbolLambdas[scalarName]
+            self._evaluationPath = 'kernel' if useKernels else 'lambda'
+            self._evaluateReactionTerm(reactionTermOutput, scalarName, computeGradient, symbolStateArray, useKernels)
 
-        result = lambdaToRun(*symbolStateArray)
+        if(memoiseReactionTerms):
+            cachedResult = self._getReactionTermCacheArray(cacheKey, np.shape(reactionTermOutput))
+            cachedResult[...] = reactionTermOutput
+            self._reactionTermCache[cacheKey] = (versions, cachedResult)
 
-        print('Result of lambda:', result)
+    """
+        Sets up the structure of the Jacobian of the reactions, and its lambdas if there are no kernels to compute it.
+    """
+    def _initializeReactionJacobian(self):
+        if(self._reactionJacobianStructure is not None):
+            return
 
-        # NOTE: result could be just 0, not [0], e.g., if the gradient resolved to 0 because there were no instances of symbol 'I' need to handle that        
-        resultIsArray = hasattr(result, '__getitem__')
-        
-        # TODO: does a reaction that resolves to some constant k1 mean that the concentration of a scalar should be set to that at all nodes?
-        if(resultIsArray):
-            reactionTermOutput[:] = result[:]
-        
+        self._reactionJacobianLambdas = None
+
+        if(self._reactionKernels is not None):
+            self._reactionJacobianStructure = [(ScalarIndexToName[i], ScalarIndexToName[j]) for (i, j) in self._reactionKernels['JacobianStructure']]
+        else:
+            self._reactionJacobianStructure = list(CalculateJacobianOfExpressions(self._reactionExpressions, self._symbols, ScalarIndexToName))
+            self._getReactionJacobianLambdas()
+
+        # The Jacobian depends on every scalar its reactions depend on
+        dependencies = set()
+        for (scalarName, _) in self._reactionJacobianStructure:
+            dependencies.update(self._reactionDependencies[scalarName])
+        self._reactionJacobianDependencies = sorted(dependencies)
+
+        # The array computeReactionJacobian returns by default, and the versions of the state vectors it was computed with
+        self._reactionJacobianValues = None
+        self._reactionJacobianVersions = None
+
+        _log(LogLevel.Info, 'The Jacobian of the reactions has', len(self._reactionJacobianStructure), 'non-zero entries')
+
+    """
+        Lambdas computing the entries of the Jacobian, in the order of the structure
+    """
+    def _getReactionJacobianLambdas(self):
+        if(self._reactionJacobianLambdas is None):
+            if(self._symbolLambdas is None):
+                self._initializeSymbolicReactions()
+
+            jacobianExpressions = CalculateJacobianOfExpressions(self._reactionExpressions, self._symbols, ScalarIndexToName)
+            entryExpressions = collections.OrderedDict((entry, jacobianExpressions.get(entry, 0)) for entry in self._reactionJacobianStructure)
+            self._reactionJacobianLambdas = ExpressionsToLambdas(self._symbols, entryExpressions)
+
+        return self._reactionJacobianLambdas
+
+    """
+        The entries of the Jacobian of the reactions, d(reaction of scalar i)/d(scalar j), which are not identically zero.
+
+        Returns:
+            A list of the (i, j) scalarNumber pairs of the entries, in the order of the rows of the array returned by
+            computeReactionJacobian. The diagonal entries are the gradients computeScalarLHSorRHSVectorForOneSpecies computes.
+    """
+    def getReactionJacobianStructure(self):
+        self._initializeReactionJacobian()
+        return [(_scalarNumber(ScalarNameToIndex[rowName]), _scalarNumber(ScalarNameToIndex[columnName]))
+                for (rowName, columnName) in self._reactionJacobianStructure]
+
+    """
+        Returns the row of the entry d(reaction of rowScalarNumber)/d(columnScalarNumber) in the array returned by
+        computeReactionJacobian, or None if the entry is identically zero.
+    """
+    def getReactionJacobianEntryIndex(self, rowScalarNumber, columnScalarNumber):
+        self._initializeReactionJacobian()
+
+        entry = (ScalarIndexToName[rowScalarNumber - 1], ScalarIndexToName[columnScalarNumber - 1])
+        if(entry not in self._reactionJacobianStructure):
+            return None
+
+        return self._reactionJacobianStructure.index(entry)
+
+    """
+        Computes the entries of the Jacobian of the reactions listed by getReactionJacobianStructure, at every node.
+
+        Parameters:
+            jacobianOutput: [number of entries, <shape of the state vectors>] array to write the entries into.
+                By default, an array belonging to this object is used, which is reused (and memoised) by every call,
+                so it must not be modified.
+
+        Returns:
+            The [number of entries, <shape of the state vectors>] array of the entries
+    """
+    def computeReactionJacobian(self, jacobianOutput=None):
+        if(self._reactionProfiler is None):
+            return self._computeReactionJacobian(jacobianOutput)
+
+        profilerToken = self._reactionProfiler.startCall()
+        jacobianOutput = self._computeReactionJacobian(jacobianOutput)
+        self._reactionProfiler.endCall(profilerToken, reactionProfiling.JacobianName, False, self._evaluationPath, np.size(jacobianOutput) // max(1, len(jacobianOutput)))
+
+        return jacobianOutput
+
+    def _computeReactionJacobian(self, jacobianOutput):
+        self._initializeReactionJacobian()
+
+        (symbolStateArray, _) = self.getSymbolStateArray()
+        shape = self.getScalarMatrixShape(_scalarNumber(0))
+        numberOfEntries = len(self._reactionJacobianStructure)
+
+        versions = None
+        if(jacobianOutput is None):
+            if(self._reactionJacobianValues is None or self._reactionJacobianValues.shape[1:] != shape):
+                self._reactionJacobianValues = np.empty((numberOfEntries,) + shape)
+                self._reactionJacobianVersions = None
+
+            jacobianOutput = self._reactionJacobianValues
+
+            if(memoiseReactionTerms):
+                versions = self._getDependencyVersions(self._reactionJacobianDependencies)
+                if(versions == self._reactionJacobianVersions):
+                    self._evaluationPath = 'memoised'
+                    _log(LogLevel.Debug, 'Reused memoised Jacobian of the reactions')
+                    return jacobianOutput
+
+        elif(np.shape(jacobianOutput) != (numberOfEntries,) + shape):
+            raise RuntimeError('The Jacobian of the reactions needs an array of shape {}, not {}'.format((numberOfEntries,) + shape, np.shape(jacobianOutput)))
+
+        if(numberOfEntries == 0):
+            self._evaluationPath = None
+            return jacobianOutput
+
+        entryOutputs = [jacobianOutput[entryIndex] for entryIndex in range(numberOfEntries)]
+
+        useKernels = self._canUseReactionKernels(entryOutputs[0], symbolStateArray)
+        self._evaluationPath = 'kernel' if useKernels else 'lambda'
+        if(useKernels):
+            kernel = self._reactionKernels['jacobian']
+
+            def evaluateBlock(outputBlocks, stateArrayBlock, buffers):
+                kernel(outputBlocks, buffers, *stateArrayBlock)
         else:
-            oldScalarShape = self.getScalarMatrixShape(scalarNumber)
-            print("Note: lambda returned non-array value, returning constant value for all nodes")
-            reactionTermOutput[:] = np.ones(oldScalarShape)*result
+            jacobianLambdas = self._getReactionJacobianLambdas()
+
+            def evaluateBlock(outputBlocks, stateArrayBlock, buffers):
+                for entryIndex in range(numberOfEntries):
+                    # Broadcasts the constant entries too
+                    outputBlocks[entryIndex][...] = jacobianLambdas[self._reactionJacobianStructure[entryIndex]](*stateArrayBlock)
+
+        self._evaluateInBlocks(evaluateBlock, entryOutputs, symbolStateArray, useKernels)
+
+        _log(LogLevel.Debug, 'Jacobian of the reactions:', jacobianOutput)
+
+        if(versions is not None):
+            self._reactionJacobianVersions = versions
+
+        return jacobianOutput
 
     def clearCalculatorCache(self):
         self.scalar1CoefficientsSet = False
         self.scalar2CoefficientsSet = False
+        self.clearReactionTermCache()
@@ -5,6 +5,8 @@
 from __future__ import print_function
 import json
 import datetime
+import imp
+import os
 
 _generatedCodeTemplate = """# Code generated by CRIMSON UI: {}
 #----------------------------------------------------------------------------------------------
@@ -22,6 +24,9 @@ ScalarNames = {}
 
 ReactionCoefficients = {}
 
+# Operator-split integration of the reactions, see reactionSubstepping.py
+ReactionSubstepping = {}
+
 # Coefficients
 {}
 
@@ -36,9 +41,9 @@ ReactionExpressions = {}
 # End code from UI
 #---------------------------------------------------------------------------------------------------"""
 
-def _FormatSpecification(numberOfFluidIterations, iterations, diffusionCoefficients, scalarNames, reactionCoefficients, coefficientSymbolSection, scalarSymbolsSection, symbolsSection, reactionExpressions):
+def _FormatSpecification(numberOfFluidIterations, iterations, diffusionCoefficients, scalarNames, reactionCoefficients, reactionSubstepping, coefficientSymbolSection, scalarSymbolsSection, symbolsSection, reactionExpressions):
     currentDateAndTime = datetime.datetime.now()
-    return _generatedCodeTemplate.format(currentDateAndTime, numberOfFluidIterations, iterations, diffusionCoefficients, scalarNames, reactionCoefficients, coefficientSymbolSection, scalarSymbolsSection, symbolsSection, reactionExpressions)
+    return _generatedCodeTemplate.format(currentDateAndTime, numberOfFluidIterations, iterations, diffusionCoefficients, scalarNames, reactionCoefficients, reactionSubstepping, coefficientSymbolSection, scalarSymbolsSection, symbolsSection, reactionExpressions)
 
 # Because \t doesn't seem to resolve to '    ', and I really don't want to mix tabs and spaces.
 # keep in sync with _ObjectToJSON().
@@ -150,11 +155,14 @@ def _FormatSymbolsSection(symbolNamesList):
     return symbolExpressionsLiteral
 
 
-def GenerateSpecification(fluidIterationsCount, scalarIterations, diffusionCoefficientsDict, scalarSymbolsList, reactionCoefficientsDict, reactionStringsDict):
+# reactionSubsteppingDict: {"Enabled": <bool>, "TimeStepSize": <flow timestep size>, "Substeps": <int>, "Method": <reactionSubstepping.Method>}
+def GenerateSpecification(fluidIterationsCount, scalarIterations, diffusionCoefficientsDict, scalarSymbolsList, reactionCoefficientsDict, reactionStringsDict, reactionSubsteppingDict=None):
     iterationsLiteral = _ObjectToJSON(scalarIterations)
     diffusionCoefficientsLiteral = _ObjectToJSON(diffusionCoefficientsDict)
     scalarNamesLiteral = _ObjectToJSON(scalarSymbolsList)
     reactionCoefficientsLiteral = _ObjectToJSON(reactionCoefficientsDict)
+    # JSON booleans are not python literals
+    reactionSubsteppingLiteral = repr(reactionSubsteppingDict or {})
 
     coefficientsDefinitions = _CreateSymbolDefinitionSection(reactionCoefficientsDict)
     scalarsDefinitions = _CreateSymbolDefinitionSection(scalarSymbolsList)
@@ -174,7 +182,31 @@ def GenerateSpecification(fluidIterationsCount, scalarIterations, diffusionCoeff
     # Also remember that this is 0 based
     numberOfFluidIterations = fluidIterationsCount * 2
 
-    return _FormatSpecification(numberOfFluidIterations, iterationsLiteral, diffusionCoefficientsLiteral, scalarNamesLiteral, reactionCoefficientsLiteral, coefficientsDefinitions, scalarsDefinitions, symbolNamesLiteral, reactionExpressionsLiteral)
+    return _FormatSpecification(numberOfFluidIterations, iterationsLiteral, diffusionCoefficientsLiteral, scalarNamesLiteral, reactionCoefficientsLiteral, reactionSubsteppingLiteral, coefficientsDefinitions, scalarsDefinitions, symbolNamesLiteral, reactionExpressionsLiteral)
+
+
+# Simplification applied to the reaction expressions of the precompiled reaction kernels, see ForProcsCase/reactionKernels.py
+reactionKernelSimplification = None
 
+"""
+    Generates generated_reactionKernels.py, the reaction kernels and data the flowsolver uses in place of the sympy
+    expressions of the specification, from the text returned by GenerateSpecification.
+
+    The generator is ForProcsCase/reactionKernels.py, which runs on the flowsolver side too.
 
-    
\ No newline at end of file
+    Returns:
+        The text of the module, or None if it could not be generated (e.g. sympy is not available to the UI), in which
+        case the flowsolver generates the kernels itself.
+"""
+def GenerateReactionKernels(specificationString):
+    reactionKernelsPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ForProcsCase', 'reactionKernels.py')
+
+    try:
+        reactionKernels = imp.load_source('CRIMSONReactionKernels', reactionKernelsPath)
+        return reactionKernels.GenerateReactionKernelsModuleSource(specificationString, reactionKernelSimplification)
+    except ImportError as e:
+        print('Warning: The reaction kernels will be generated by the flowsolver:', e)
+    except Exception as e:
+        print('Warning: Failed to generate the reaction kernels, they will be generated by the flowsolver:', e)
+
+    return None
@@ -72,6 +72,7 @@ class Scalar(PropertyStorage):
     
     def setScalarSymbol(self, scalarSymbol):
         self._scalarSymbol = scalarSymbol
+        self.markChanged('scalarSymbol')
 
     """
         This returns the reaction string with any newlines the user inserted. 
@@ -82,6 +83,7 @@ class Scalar(PropertyStorage):
     
     def setReactionString(self, reactionString):
         self._reactionString = reactionString
+        self.markChanged('reactionString')
 
     """
         Reaction equation with newlines stripped out
@@ -11,6 +11,66 @@ class SolverType(object):
     enumNames = ["memLS", "acusim"]
     memLS, acusim = range(2)
 
+class WaveformErrorNorm(object):
+    enumNames = ["L-infinity", "L2"]
+    LInfinity, L2 = range(2)
+
+# The bct resampling section is shared by newly created objects and by the 2021C upgrade
+def _createBctResamplingParameters():
+    return {
+        "Bct temporal resampling":
+        [
+            # When enabled, the prescribed velocity waveforms are written to bct.dat with the fewest timepoints
+            # such that the linearly interpolated waveform stays within the maximum error of the original one.
+            {
+                "Resample bct waveforms": False,
+            },
+            {
+                # Relative to the norm of the waveform, this parameter has no units
+                "Maximum waveform error": 0.001,
+                "attributes": {"minimum": 0.0, "maximum": 1.0, "singleStep": 0.001, "decimals": 6}
+            },
+            {
+                "Waveform error norm": WaveformErrorNorm.LInfinity,
+                "attributes": {"enumNames": WaveformErrorNorm.enumNames}
+            },
+            {
+                # Uniform resampling is only applied to analytic prescribed velocities,
+                # PC-MRI waveforms are always resampled at a subset of the acquired timepoints.
+                "Uniform resampling": False,
+            },
+        ]
+    }
+
+class ReactionIntegrator(object):
+    enumNames = ["Linearly implicit Euler", "Rosenbrock (ROS2)"]
+    LinearlyImplicitEuler, Rosenbrock2 = range(2)
+
+    # The names of the methods in ForProcsCase/reactionSubstepping.py
+    methodNames = ["linearlyImplicitEuler", "ros2"]
+
+# The reaction sub-stepping section is shared by newly created objects and by the 2021D upgrade
+def _createReactionSubsteppingParameters():
+    return {
+        "Reaction sub-stepping":
+        [
+            # When enabled, the flowsolver integrates the reactions of the scalars separately over each timestep,
+            # which keeps stiff reactions stable with larger timesteps.
+            {
+                "Operator-split reaction sub-stepping": False,
+            },
+            {
+                "Reaction sub-steps per time step": 10,
+                "attributes": {"minimum": 1}
+            },
+            {
+                # Rosenbrock is more accurate, but can overshoot from states where the stiff reactions have not started
+                "Reaction integrator": ReactionIntegrator.LinearlyImplicitEuler,
+                "attributes": {"enumNames": ReactionIntegrator.enumNames}
+            },
+        ]
+    }
+
 # Note: this class is primarily responsible for holding data that gets written to solver.inp
 class SolverParameters3D(PropertyStorage):
     # Where iterations is a list of dict
@@ -43,6 +103,7 @@ class SolverParameters3D(PropertyStorage):
     # ]
     def setIterations(self, iterations):
         self.Iterations = iterations
+        self.markChanged('Iterations')
     
     def getIterations(self):
         return self.Iterations
@@ -57,9 +118,12 @@ class SolverParameters3D(PropertyStorage):
         # I would normally have used a Python set here, but unfortunately it seems that PythonQt does not recognize Python sets.
         return ["Scalar simulation parameters"]
 
-    def _getStepConstructionSection(self):
+    def _getSimulationParameters(self):
         simParametersCategory = self.properties[2]
-        simParameters = simParametersCategory['Simulation parameters']
+        return simParametersCategory['Simulation parameters']
+
+    def _getStepConstructionSection(self):
+        simParameters = self._getSimulationParameters()
         stepConstructionSection = simParameters[5]
 
         return stepConstructionSection
@@ -75,6 +139,7 @@ class SolverParameters3D(PropertyStorage):
     def setFluidIterationCount(self, fluidIterationCount):
         stepConstructionSection = self._getStepConstructionSection()
         stepConstructionSection['Step construction'] = fluidIterationCount
+        self.propertyValueChanged(self._getSimulationParameters(), 5, 'Step construction')
 
         #print('DEBUG: [set] Properties is')
         #print(self.properties)
@@ -206,6 +271,8 @@ class SolverParameters3D(PropertyStorage):
 
                 ]
             },
+            _createBctResamplingParameters(),
+            _createReactionSubsteppingParameters(),
         ]
 
     def upgrade_Pre2021_To_v2021A(self):
@@ -303,9 +370,37 @@ class SolverParameters3D(PropertyStorage):
         
         scalarDiscontinuitySection["Scalar Discontinuity Capturing"] = boolValue
 
+    def upgrade_2021B_To_v2021C(self):
+        print('Applying v2021C upgrades to Solver Parameters...')
+
+        # Adaptive temporal resampling of bct.dat, disabled by default so the output of old studies does not change
+        self.properties.append(_createBctResamplingParameters())
+
+    def upgrade_2021C_To_v2021D(self):
+        print('Applying v2021D upgrades to Solver Parameters...')
+
+        # Operator-split reaction sub-stepping, disabled by default so old scalar simulations do not change
+        self.properties.append(_createReactionSubsteppingParameters())
+
+    def getReactionSubstepping(self):
+        props = self.getProperties()
+
+        return {
+            "Enabled": bool(props['Operator-split reaction sub-stepping']),
+            "TimeStepSize": float(props['Time step size']),
+            "Substeps": int(props['Reaction sub-steps per time step']),
+            "Method": ReactionIntegrator.methodNames[props['Reaction integrator']],
+        }
+
     def upgradeObject(self, toVersion):
         if(toVersion == Versions.v2021A):
             self.upgrade_Pre2021_To_v2021A()
 
         elif(toVersion == Versions.v2021B):
-            self.upgrade_2021A_To_v2021B()
\ No newline at end of file
+            self.upgrade_2021A_To_v2021B()
+
+        elif(toVersion == Versions.v2021C):
+            self.upgrade_2021B_To_v2021C()
+
+        elif(toVersion == Versions.v2021D):
+            self.upgrade_2021C_To_v2021D()
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""
+    Helpers for writing the time-varying velocity boundary condition files (bct.dat and bct_steady.dat).
+
+    Every node on a prescribed velocity face is written to the bct file in the form
+        <x> <y> <z> <numberOfTimepoints>
+        <vx> <vy> <vz> <t0>
+        <vx> <vy> <vz> <t1>
+        ...
+
+    Formatting these line by line with str.format is very slow for faces with thousands of nodes
+    and tens of timepoints, so the helpers below assemble blocks of nodes into a single numpy array
+    and format the whole block with a single string formatting operation.
+"""
+
+import numpy
+
+# Number of values written per bct line
+_valuesPerLine = 4
+
+# Matches the precision of str(float), which was used for the original line-by-line output
+_bctLineFormat = '%.12g %.12g %.12g %.12g\n'
+
+# Upper bound on the number of bct lines formatted at once, this keeps the size of the temporary strings reasonable
+_maxLinesPerChunk = 200000
+
+
+def getNodeChunkSize(numberOfTimepoints):
+    return max(1, _maxLinesPerChunk // (numberOfTimepoints + 1))
+
+
+def getNodeCoordinates(meshData, nodeIndices):
+    coordinates = numpy.empty((len(nodeIndices), 3))
+    for i, nodeIndex in enumerate(nodeIndices):
+        coordinates[i] = meshData.getNodeCoordinates(nodeIndex)
+    return coordinates
+
+
+def getMappedPCMRIVelocities(pcmriData, nodeIndexRange, timeIndices):
+    """
+        Returns a [len(nodeIndexRange), len(timeIndices), 3] array of mapped PC-MRI velocities.
+
+        Note that the node indices here are the indices of the nodes within the face as expected by the PC-MRI data object,
+        not the global mesh node indices.
+
+        The C++ PC-MRI data object only exposes the single vector accessor, so each vector is still fetched individually,
+        but each one is fetched exactly once and no other PC-MRI data is queried while doing so.
+    """
+    # PythonQt does not convert numpy integer types to C++ ints
+    timeIndices = [int(timeIndex) for timeIndex in timeIndices]
+
+    velocities = numpy.empty((len(nodeIndexRange), len(timeIndices), 3))
+    getSingleMappedPCMRIvector = pcmriData.getSingleMappedPCMRIvector
+
+    for i, nodeIndex in enumerate(nodeIndexRange):
+        nodeVelocities = velocities[i]
+        for j, timeIndex in enumerate(timeIndices):
+            nodeVelocities[j] = getSingleMappedPCMRIvector(nodeIndex, timeIndex)
+
+    return velocities
+
+
+def writeBctNodes(bctFile, nodeCoordinates, velocities, times):
+    """
+        Writes a block of nodes to a bct file.
+
+        Parameters:
+            nodeCoordinates: [nNodes, 3] array of node positions
+            velocities: [nNodes, nTimes, 3] array of velocity vectors
+            times: [nTimes] array of timepoints, shared by all the nodes in the block
+    """
+    nNodes = nodeCoordinates.shape[0]
+    nTimes = len(times)
+
+    if nNodes == 0:
+        return
+
+    lines = numpy.empty((nNodes, nTimes + 1, _valuesPerLine))
+    lines[:, 0, :3] = nodeCoordinates
+    lines[:, 0, 3] = nTimes
+    lines[:, 1:, :3] = velocities
+    lines[:, 1:, 3] = times
+
+    nLines = nNodes * (nTimes + 1)
+    bctFile.write((_bctLineFormat * nLines) % tuple(lines.ravel()))
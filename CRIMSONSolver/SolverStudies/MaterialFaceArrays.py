@@ -0,0 +1,175 @@
+import numpy
+
+from CRIMSONSolver.SolverStudies import VesselPathIndex, MaterialGeometryCache
+
+
+def getNodeCoordinatesArray(meshData, nodeIds):
+    """
+        Returns the coordinates of the nodes in nodeIds as an array of shape nodeIds.shape + (3,).
+        Every distinct node is only queried from the mesh once.
+    """
+    nodeIds = numpy.asarray(nodeIds)
+    uniqueNodeIds, inverse = numpy.unique(nodeIds, return_inverse=True)
+
+    uniqueCoordinates = numpy.empty((len(uniqueNodeIds), 3))
+    for i, nodeId in enumerate(uniqueNodeIds):
+        uniqueCoordinates[i] = meshData.getNodeCoordinates(int(nodeId))
+
+    return uniqueCoordinates[inverse].reshape(nodeIds.shape + (3,))
+
+
+class MaterialFaceArrays(object):
+    """
+        The array counterpart of MaterialFaceInfo: lazily evaluated per-face quantities for all the mesh faces
+        belonging to a list of face identifiers, used to compute materials for all faces at once.
+
+        The mesh faces are ordered by face identifier, and in the order returned by meshData.getMeshFaceInfoForFace
+        within each face identifier.
+    """
+    def __init__(self, vesselForestData, meshData, faceIdentifiers):
+        self.vesselForestData = vesselForestData
+        self.meshData = meshData
+        self.faceIdentifiers = list(faceIdentifiers)
+
+        meshFaceInfos = []
+        faceIdentifierIndices = []
+        for faceIdentifierIndex, faceIdentifier in enumerate(self.faceIdentifiers):
+            infos = meshData.getMeshFaceInfoForFace(faceIdentifier)
+            meshFaceInfos.extend(infos)
+            faceIdentifierIndices.extend([faceIdentifierIndex] * len(infos))
+
+        # [elementIndex, faceIndex, nodeIndex1, nodeIndex2, nodeIndex3] for every mesh face
+        self.meshFaceInfo = numpy.array(meshFaceInfos, dtype=numpy.int64).reshape((len(meshFaceInfos), 5))
+        # Index into self.faceIdentifiers for every mesh face
+        self.faceIdentifierIndices = numpy.array(faceIdentifierIndices, dtype=numpy.int64)
+
+    def getSubset(self, faceMask):
+        """
+            Returns a MaterialFaceArrays for the faces selected by faceMask (a boolean or an index array).
+            Quantities already computed for this object are not recomputed for the subset.
+        """
+        subset = MaterialFaceArrays.__new__(MaterialFaceArrays)
+        subset.vesselForestData = self.vesselForestData
+        subset.meshData = self.meshData
+        subset.faceIdentifiers = self.faceIdentifiers
+        subset.meshFaceInfo = self.meshFaceInfo[faceMask]
+        subset.faceIdentifierIndices = self.faceIdentifierIndices[faceMask]
+
+        for name in ['faceNodeCoordinates', 'centers', 'localRadii', 'arcLengths', 'vesselPathCoordinateFrames']:
+            if name in self.__dict__:
+                setattr(subset, name, getattr(self, name)[faceMask])
+
+        return subset
+
+    def getNumberOfFaces(self):
+        return self.meshFaceInfo.shape[0]
+
+    def getMeshFaceInfo(self):
+        return self.meshFaceInfo
+
+    def getFaceIndices(self):
+        return self.meshFaceInfo[:, 1]
+
+    def getFaceNodeCoordinates(self):
+        """
+            Returns the [nFaces, 3, 3] array of the coordinates of the three nodes of every face.
+        """
+        if 'faceNodeCoordinates' not in self.__dict__:
+            self.faceNodeCoordinates = getNodeCoordinatesArray(self.meshData, self.meshFaceInfo[:, 2:5])
+
+        return self.faceNodeCoordinates
+
+    def getFaceCenters(self):
+        if 'centers' not in self.__dict__:
+            self.centers = self.getFaceNodeCoordinates().sum(axis=1) / 3
+
+        return self.centers
+
+    def getLocalRadii(self):
+        if 'localRadii' not in self.__dict__ and not self._loadCachedGeometry():
+            self._computeVesselPathQuantities()
+
+        return self.localRadii
+
+    def getArcLengths(self):
+        if 'arcLengths' not in self.__dict__ and not self._loadCachedGeometry():
+            self._computeVesselPathQuantities()
+
+        return self.arcLengths
+
+    def getVesselPathCoordinateFrames(self):
+        """
+            Returns the [nFaces, 9] array of vessel path coordinate frames, see
+            vesselForestData.getVesselPathCoordinateFrame for the layout.
+            If there is no vessel forest, an empty [nFaces, 0] array is returned.
+        """
+        if 'vesselPathCoordinateFrames' not in self.__dict__ and not self._loadCachedGeometry():
+            self._computeVesselPathQuantities()
+
+        return self.vesselPathCoordinateFrames
+
+    def _computeVesselPathQuantities(self):
+        self.localRadii = numpy.zeros(self.getNumberOfFaces())
+        self.arcLengths = numpy.zeros(self.getNumberOfFaces())
+
+        if self.vesselForestData is None:
+            self.vesselPathCoordinateFrames = numpy.empty((self.getNumberOfFaces(), 0))
+            return
+
+        self.vesselPathCoordinateFrames = numpy.empty((self.getNumberOfFaces(), 9))
+
+        vesselPathIndex = VesselPathIndex.getVesselPathIndex(self.vesselForestData)
+        centers = self.getFaceCenters()
+
+        for faceIdentifierIndex, faceIdentifier in enumerate(self.faceIdentifiers):
+            faces = numpy.flatnonzero(self.faceIdentifierIndices == faceIdentifierIndex)
+            if len(faces) == 0:
+                continue
+
+            self.localRadii[faces], self.arcLengths[faces], self.vesselPathCoordinateFrames[faces] = \
+                vesselPathIndex.query(faceIdentifier, centers[faces])
+
+        self._storeCachedGeometry()
+
+    def getGeometryKey(self):
+        """
+            Returns a key identifying the mesh faces and their geometry, see MaterialGeometryCache.computeKey.
+        """
+        if 'geometryKey' not in self.__dict__:
+            self.geometryKey = MaterialGeometryCache.computeKey(self.vesselForestData, self.meshData,
+                                                                self.faceIdentifiers, self.meshFaceInfo,
+                                                                self.faceIdentifierIndices,
+                                                                self.getFaceNodeCoordinates())
+
+        return self.geometryKey
+
+    def _loadCachedGeometry(self):
+        """
+            Loads the vessel path quantities from MaterialGeometryCache, see MaterialGeometryCache.
+            The cache is only looked up once, and only when a vessel path quantity is needed, as the key is computed
+            from the face node coordinates and a few vessel forest queries.
+
+            Returns:
+                True if the quantities have been loaded
+        """
+        if not MaterialGeometryCache.enabled or self.getNumberOfFaces() == 0 or 'cacheLookedUp' in self.__dict__:
+            return False
+
+        self.cacheLookedUp = True
+        arrays = MaterialGeometryCache.load(self.getGeometryKey(), self.meshFaceInfo)
+        if arrays is None:
+            return False
+
+        self.localRadii = arrays['localRadii']
+        self.arcLengths = arrays['arcLengths']
+        self.vesselPathCoordinateFrames = arrays['vesselPathCoordinateFrames']
+        return True
+
+    def _storeCachedGeometry(self):
+        if not MaterialGeometryCache.enabled or self.getNumberOfFaces() == 0:
+            return
+
+        MaterialGeometryCache.store(self.getGeometryKey(), {'meshFaceInfo': self.meshFaceInfo,
+                                                          'localRadii': self.localRadii,
+                                                          'arcLengths': self.arcLengths,
+                                                          'vesselPathCoordinateFrames': self.vesselPathCoordinateFrames})
@@ -0,0 +1,143 @@
+import glob
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+from PythonQt.CRIMSON import Utils
+
+"""
+    A persistent on-disk cache of the per-face vessel path quantities of the material computations, i.e. the local
+    radii, the arc lengths and the vessel path coordinate frames.
+
+    Every entry is a .npz file named after a key computed from the mesh, the vessel forest and the faces it describes:
+    the mesh sizes, the face identifiers and the mesh faces they contain, and a hash of the coordinates of all the nodes
+    of the faces. The C++ interface does not expose the vessel paths themselves, only closest-point queries, so the
+    vessel forest is represented in the key by the answers to a few of them. An edit of a vessel path which leaves
+    these answers exactly unchanged would not be detected, and the stale quantities would be used. For this reason the
+    cache is disabled by default; enable it for repeated runs on a vessel forest which is not being edited, and
+    empty it with clear() after editing the vessel paths.
+
+    The total size of the cache is capped, the least recently used entries are removed first.
+"""
+
+# Set to True to enable the cache, see above
+enabled = False
+
+cacheDirectory = os.path.join(tempfile.gettempdir(), 'CRIMSONMaterialGeometryCache')
+
+# Maximum total size of the cache files
+maxCacheSizeInBytes = 512 * 1024 * 1024
+
+# Number of vessel forest queries whose results are included in the key
+_nProbeVesselQueries = 8
+
+_cacheFileExtension = '.npz'
+
+
+def computeKey(vesselForestData, meshData, faceIdentifiers, meshFaceInfo, faceIdentifierIndices, faceNodeCoordinates):
+    """
+        Computes the cache key of the faces described by meshFaceInfo, faceIdentifierIndices and faceNodeCoordinates,
+        see MaterialFaceArrays.
+    """
+    digest = hashlib.sha1()
+
+    digest.update(repr((meshData.getNNodes(), meshData.getNElements(), meshData.getNFaces())))
+    for faceIdentifier in faceIdentifiers:
+        digest.update(repr((faceIdentifier.faceType, tuple(faceIdentifier.parentSolidIndices))))
+    digest.update(numpy.ascontiguousarray(meshFaceInfo, dtype=numpy.int64).tostring())
+    digest.update(numpy.ascontiguousarray(faceNodeCoordinates, dtype=numpy.float64).tostring())
+
+    if vesselForestData is None:
+        digest.update('no vessel forest')
+    else:
+        nFaces = meshFaceInfo.shape[0]
+        for face in numpy.unique(numpy.linspace(0, nFaces - 1, min(_nProbeVesselQueries, nFaces)).astype(int)):
+            faceIdentifier = faceIdentifiers[faceIdentifierIndices[face]]
+            x, y, z = (float(value) for value in faceNodeCoordinates[face].mean(axis=0))
+            digest.update(repr(tuple(vesselForestData.getClosestPoint(faceIdentifier, x, y, z))))
+            digest.update(repr(tuple(vesselForestData.getVesselPathCoordinateFrame(faceIdentifier, x, y, z))))
+
+    return digest.hexdigest()
+
+
+def _getCacheFileName(key):
+    return os.path.join(cacheDirectory, key + _cacheFileExtension)
+
+
+def load(key, meshFaceInfo):
+    """
+        Returns the dictionary of arrays stored under the key, or None if there is no such entry.
+        The entry must describe the same mesh faces as meshFaceInfo.
+    """
+    fileName = _getCacheFileName(key)
+    if not os.path.exists(fileName):
+        return None
+
+    try:
+        with numpy.load(fileName) as cacheFile:
+            arrays = {name: cacheFile[name] for name in cacheFile.files}
+    except Exception as e:
+        Utils.logWarning('Failed to read material geometry cache file {0}: {1}'.format(fileName, e))
+        return None
+
+    if not numpy.array_equal(arrays.get('meshFaceInfo'), meshFaceInfo):
+        return None
+
+    # Mark the entry as recently used
+    os.utime(fileName, None)
+    return arrays
+
+
+def store(key, arrays):
+    """
+        Stores a dictionary of arrays under the key, and evicts the least recently used entries if the cache
+        has grown over maxCacheSizeInBytes.
+    """
+    try:
+        if not os.path.isdir(cacheDirectory):
+            os.makedirs(cacheDirectory)
+
+        fileName = _getCacheFileName(key)
+
+        # Write to a temporary file first, so that an interrupted write does not leave a corrupted entry behind
+        fileHandle, tempFileName = tempfile.mkstemp(suffix=_cacheFileExtension, dir=cacheDirectory)
+        with os.fdopen(fileHandle, 'wb') as tempFile:
+            numpy.savez(tempFile, **arrays)
+
+        if os.path.exists(fileName):
+            os.remove(fileName)
+        os.rename(tempFileName, fileName)
+    except (IOError, OSError) as e:
+        Utils.logWarning('Failed to write material geometry cache file: {0}'.format(e))
+        return
+
+    _evict(keep=fileName)
+
+
+def _evict(keep):
+    entries = []
+    for fileName in glob.glob(os.path.join(cacheDirectory, '*' + _cacheFileExtension)):
+        try:
+            entries.append((os.path.getmtime(fileName), os.path.getsize(fileName), fileName))
+        except OSError:
+            pass
+
+    totalSize = sum(size for _, size, _ in entries)
+    for _, size, fileName in sorted(entries):
+        if totalSize <= maxCacheSizeInBytes:
+            break
+        if fileName == keep:
+            continue
+
+        try:
+            os.remove(fileName)
+            totalSize -= size
+        except OSError:
+            pass
+
+
+def clear():
+    for fileName in glob.glob(os.path.join(cacheDirectory, '*' + _cacheFileExtension)):
+        os.remove(fileName)
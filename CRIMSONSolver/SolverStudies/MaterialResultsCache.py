@@ -0,0 +1,83 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy
+
+from CRIMSONSolver.Materials import MaterialData
+
+"""
+    In-memory memoisation of the material values computed by SolverStudy.computeMaterials.
+
+    The values are stored per material, keyed by a hash of everything they depend on: the material's properties (which
+    hold the constant values), its material datas (representation, table data and script text), and the mesh faces the
+    material is applied to. For the materials which are not all constant, the key also includes the geometry key of the
+    faces, see MaterialFaceArrays.getGeometryKey: a hash of the coordinates of all the nodes of the faces, and the
+    answers to a few vessel forest queries standing for the vessel forest. Computing the key thus costs no more vessel
+    forest queries than that, whatever the material uses.
+
+    As for MaterialGeometryCache, an edit of a vessel path which leaves these few answers exactly unchanged would not be
+    detected, and scripts whose results do not depend only on their inputs (e.g. random materials) would be memoised
+    as well. For these reasons the memoisation is disabled by default; enable it for repeated runs on a vessel forest
+    which is not being edited, and call clear() to recompute all the materials.
+"""
+
+# Set to True to enable the memoisation, see above
+enabled = False
+
+# Number of materials whose values are kept
+maxNumberOfEntries = 32
+
+_materialValues = OrderedDict()
+
+
+def computeMaterialKey(material, faceArrays):
+    digest = hashlib.sha1()
+
+    digest.update(material.__class__.__name__)
+    digest.update(repr(material.properties))
+
+    for materialData in material.materialDatas:
+        digest.update(repr((materialData.name, materialData.nComponents, materialData.componentNames,
+                            materialData.representation, materialData.scriptData,
+                            materialData.tableData.inputVariableType)))
+
+        tableData = materialData.tableData.data
+        if tableData is None:
+            digest.update('no table')
+        else:
+            tableData = numpy.ascontiguousarray(tableData, dtype=numpy.float64)
+            digest.update(repr(tableData.shape))
+            digest.update(tableData.tostring())
+
+    digest.update(numpy.ascontiguousarray(faceArrays.getMeshFaceInfo()).tostring())
+
+    if any(materialData.representation != MaterialData.RepresentationType.Constant
+           for materialData in material.materialDatas):
+        digest.update(faceArrays.getGeometryKey())
+
+    return digest.hexdigest()
+
+
+def get(key):
+    """
+        Returns the list of [nFaces, nComponents] value arrays (one for each material data) stored under the key,
+        or None.
+    """
+    values = _materialValues.pop(key, None)
+    if values is not None:
+        # Mark the entry as most recently used
+        _materialValues[key] = values
+
+    return values
+
+
+def put(key, values):
+    _materialValues.pop(key, None)
+    _materialValues[key] = values
+
+    while len(_materialValues) > maxNumberOfEntries:
+        _materialValues.popitem(last=False)
+
+
+def clear():
+    _materialValues.clear()
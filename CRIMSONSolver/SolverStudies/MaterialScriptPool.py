@@ -0,0 +1,168 @@
+import math
+import multiprocessing
+import operator
+import os
+import re
+import traceback
+
+import numpy
+
+"""
+    Evaluation of per-face material scripts, i.e. scripts defining computeMaterialValue(info), in a process pool.
+
+    The worker processes have no access to the C++ mesh and vessel forest data, so every face is described by a
+    picklable MaterialFaceInfoSnapshot instead of a MaterialFaceInfo. The snapshots are built from the
+    MaterialFaceArrays of the material, which means that the face centres, local radii, arc lengths and vessel path
+    coordinate frames are computed for all the faces before the scripts are run.
+
+    The pool is disabled by default. To enable it, set the number of workers, e.g. from the CRIMSON python console::
+
+        from CRIMSONSolver.SolverStudies import MaterialScriptPool
+        MaterialScriptPool.numberOfWorkers = 8
+
+    Note, that on Windows the worker processes are started by running a new interpreter, so
+    multiprocessing.set_executable must point to a python executable able to import numpy.
+
+    The scripts run in the calling process see the names of the SolverStudy module, as they always have. The worker
+    processes cannot provide those which need CRIMSON (e.g. Utils or QtGui), so there the scripts only see numpy, math,
+    operator, os and re, and must import anything else they use.
+"""
+
+# Number of worker processes used to evaluate the per-face material scripts.
+# With 0 or 1 workers, the scripts are evaluated in the calling process using the full MaterialFaceInfo.
+numberOfWorkers = 0
+
+# Number of mesh faces sent to a worker process at once
+chunkSize = 2000
+
+
+class MaterialFaceInfoSnapshot(object):
+    """
+        A picklable stand-in for MaterialFaceInfo with the same query methods, used in the worker processes.
+    """
+    def __init__(self, meshFaceInfoData, center, localRadius, arcLength, vesselPathCoordinateFrame):
+        self.meshFaceInfoData = meshFaceInfoData
+        self.center = center
+        self.localRadius = localRadius
+        self.arcLength = arcLength
+        self.vesselPathCoordinateFrame = vesselPathCoordinateFrame
+
+    def getMeshFaceInfo(self):
+        return self.meshFaceInfoData
+
+    def getFaceCenter(self):
+        return self.center
+
+    def getLocalRadius(self):
+        return self.localRadius
+
+    def getArcLength(self):
+        return self.arcLength
+
+    def getVesselPathCoordinateFrame(self):
+        return self.vesselPathCoordinateFrame
+
+
+def executeMaterialScript(materialName, scriptData, scriptGlobals=None):
+    """
+        Executes the script of a material in a namespace of its own, so that the functions defined by one material's
+        script cannot leak into another's.
+
+        Parameters:
+            scriptGlobals: the names the script sees, which it adds its own to. SolverStudy passes a copy of its module
+                globals. By default, as in the worker processes, only numpy, math, operator, os and re, see above.
+
+        Returns:
+            the namespace of the script, i.e. computeMaterialValue or computeMaterialValues and anything else it defines
+    """
+    if scriptGlobals is None:
+        scriptGlobals = {'__name__': 'material script', 'numpy': numpy, 'math': math, 'operator': operator, 'os': os, 're': re}
+    exec compile(scriptData, 'material {0}'.format(materialName), 'exec') in scriptGlobals
+    return scriptGlobals
+
+
+# Scripts compiled in this process, keyed by material name and script text
+_compiledScripts = {}
+
+
+def _getComputeMaterialValue(materialName, scriptData):
+    key = (materialName, scriptData)
+    if key not in _compiledScripts:
+        _compiledScripts[key] = executeMaterialScript(materialName, scriptData)['computeMaterialValue']
+
+    return _compiledScripts[key]
+
+
+def formatFaceError(materialName, meshFaceInfoData):
+    return 'Material script \'{0}\' failed for mesh face {1} (element {2}):\n{3}'.format(
+        materialName, meshFaceInfoData[1], meshFaceInfoData[0], traceback.format_exc())
+
+
+def _evaluateChunk(task):
+    """
+        Evaluates the material script for a chunk of faces in a worker process.
+
+        Returns:
+            (values, errorMessage) - exactly one of which is None
+    """
+    materialName, scriptData, nComponents, meshFaceInfo, centers, localRadii, arcLengths, frames = task
+
+    try:
+        computeMaterialValue = _getComputeMaterialValue(materialName, scriptData)
+    except Exception:
+        return None, 'Failed to compile the script for material \'{0}\':\n{1}'.format(materialName,
+                                                                                     traceback.format_exc())
+
+    values = numpy.empty((len(meshFaceInfo), nComponents))
+    for i in xrange(len(meshFaceInfo)):
+        info = MaterialFaceInfoSnapshot(meshFaceInfo[i], centers[i], localRadii[i], arcLengths[i], frames[i])
+        try:
+            values[i] = computeMaterialValue(info)
+        except Exception:
+            return None, formatFaceError(materialName, meshFaceInfo[i])
+
+    return values, None
+
+
+def computeMaterialValues(materialData, faceArrays, nWorkers=None, nFacesPerChunk=None):
+    """
+        Evaluates the per-face script of materialData for all the faces in faceArrays using a process pool.
+
+        Returns:
+            [nFaces, nComponents] array of material values, in the order of the faces in faceArrays.
+
+        Throws:
+            RuntimeError naming the failing mesh face if the script fails for any face.
+    """
+    nWorkers = nWorkers if nWorkers is not None else numberOfWorkers
+    nFacesPerChunk = nFacesPerChunk if nFacesPerChunk is not None else chunkSize
+
+    # Snapshot the face data as plain python types, so the workers do not need numpy arrays of any particular layout
+    meshFaceInfo = faceArrays.getMeshFaceInfo().tolist()
+    centers = faceArrays.getFaceCenters().tolist()
+    localRadii = faceArrays.getLocalRadii().tolist()
+    arcLengths = faceArrays.getArcLengths().tolist()
+    frames = faceArrays.getVesselPathCoordinateFrames().tolist()
+
+    tasks = [(materialData.name, materialData.scriptData, materialData.nComponents,
+              meshFaceInfo[start:start + nFacesPerChunk], centers[start:start + nFacesPerChunk],
+              localRadii[start:start + nFacesPerChunk], arcLengths[start:start + nFacesPerChunk],
+              frames[start:start + nFacesPerChunk])
+             for start in xrange(0, len(meshFaceInfo), nFacesPerChunk)]
+
+    if len(tasks) == 0:
+        return numpy.empty((0, materialData.nComponents))
+
+    pool = multiprocessing.Pool(min(nWorkers, len(tasks)))
+    try:
+        # map preserves the order of the tasks, so the output does not depend on the scheduling of the workers
+        results = pool.map(_evaluateChunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    for _, errorMessage in results:
+        if errorMessage is not None:
+            raise RuntimeError(errorMessage)
+
+    return numpy.concatenate([values for values, _ in results])
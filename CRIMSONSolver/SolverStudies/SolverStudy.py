@@ -17,18 +17,27 @@ from PythonQt.CRIMSON import FaceType
 from PythonQt.CRIMSON import Utils
 
 from CRIMSONCore.SolutionStorage import SolutionStorage
-from CRIMSONSolver.SolverStudies import PresolverExecutableName, PhastaSolverIO, PhastaConfig
+from CRIMSONSolver.SolverStudies import PresolverExecutableName, PhastaSolverIO, PhastaConfig, BctWriter, \
+    WaveformResampling, MaterialScriptPool, MaterialResultsCache
 from CRIMSONSolver.SolverSetupManagers.FlowProfileGenerator import FlowProfileGenerator
 from CRIMSONSolver.SolverStudies.FileList import FileList
+from CRIMSONSolver.SolverStudies.MaterialFaceArrays import MaterialFaceArrays
 from CRIMSONSolver.SolverStudies.SolverInpData import SolverInpData
 from CRIMSONSolver.SolverStudies.Timer import Timer
 from CRIMSONSolver.BoundaryConditions import NoSlip, InitialPressure, RCR, ZeroPressure, PrescribedVelocities, \
     DeformableWall, Netlist, PCMRI
 from CRIMSONSolver.Materials import MaterialData
 from CRIMSONSolver.ScalarProblem import Scalar, ScalarProblem, ScalarNeumann, ScalarDirichlet, InitialConcentration, NoFlux, ConsistentFlux
-from CRIMSONSolver.ScalarProblem.GenerateScalarProblemSpecification import GenerateSpecification
+from CRIMSONSolver.ScalarProblem.GenerateScalarProblemSpecification import GenerateSpecification, GenerateReactionKernels
 from CRIMSONCore.VersionedObject import VersionedObject, Versions
 
+# SWB.dat line: exterior face index, thickness, 5 unused values and the 15 values of the lower triangle of the
+# stiffness matrix. '%.12g' matches the precision of str(float) used previously.
+_swbLineFormat = '%d' + ' %.12g' * 21 + '\n'
+
+# Number of SWB.dat lines formatted at once
+_swbRowsPerChunk = 50000
+
 def _getThisScriptFolder():
     scriptFolder = os.path.dirname(os.path.realpath(__file__))
     return scriptFolder
@@ -238,7 +247,9 @@ def _writeScalarProblemSpecification(solverParameters, scalarProblem, scalars, o
             print('Warning: In Solver Parameters, Scalar Iteration #', (iterationIndex + 1), ' references an unknown scalar with symbol "', iterationSymbol, '"', sep='')
 
 
-    specificationFileString = GenerateSpecification(fluidIterationCount, scalarIterations, diffusionCoefficients, scalarSymbols, reactionCoefficients, reactionStrings)
+    reactionSubstepping = solverParameters.getReactionSubstepping()
+
+    specificationFileString = GenerateSpecification(fluidIterationCount, scalarIterations, diffusionCoefficients, scalarSymbols, reactionCoefficients, reactionStrings, reactionSubstepping)
 
     filePath = os.path.join(outputDir, 'generated_scalarProblemSpecification.py')
     with open(filePath, 'wb') as specificationFile:
@@ -246,6 +257,20 @@ def _writeScalarProblemSpecification(solverParameters, scalarProblem, scalars, o
 
     print('Wrote scalarProblemSpecification to "', filePath, "'", sep='')
 
+    reactionKernelsFilePath = os.path.join(outputDir, 'generated_reactionKernels.py')
+    reactionKernelsFileString = GenerateReactionKernels(specificationFileString)
+
+    if(reactionKernelsFileString is None):
+        # The flowsolver would ignore it as out of date anyway, but don't leave it lying around
+        if(os.path.exists(reactionKernelsFilePath)):
+            os.remove(reactionKernelsFilePath)
+        return
+
+    with open(reactionKernelsFilePath, 'wb') as reactionKernelsFile:
+        reactionKernelsFile.write(reactionKernelsFileString)
+
+    print('Wrote precompiled reaction kernels to "', reactionKernelsFilePath, "'", sep='')
+
 
 # A helper class providing lazily-evaluated quantities for material computation
 class MaterialFaceInfo(object):
@@ -520,17 +545,16 @@ class SolverStudy(VersionedObject):
             # DEBUG: Current working directory is C:\cscald2\CRIMSON-build\bin
             # print('DEBUG: Current working directory is', os.getcwd())
             crimsonSolverPath = _getCRIMSONSolverDirectory()
-            genericScalarProblemSpecificationPath = os.path.join(crimsonSolverPath, 'ScalarProblem/ForProcsCase/scalarProblemSpecification.py')
-            try:
-
-                
-                # this script won't be changed for most scalar simulations, we figure it's best to include it with the solver input data
-                # so that in case a highly technical user wants to modify it, they can.
-                #
-                # scalarProblemSpecification.py is in PythonModules/CrimsonSolver/ScalarProblem/ForProcsCase/
-                shutil.copy2(genericScalarProblemSpecificationPath, outputDir)
-            except Exception as ex:
-                raise RuntimeError('An error occurred while copying scalarProblemSpecification from "{}" to "{}": {}'.format(genericScalarProblemSpecificationPath, outputDir, ex.message))
+            for scriptName in ['scalarProblemSpecification.py', 'reactionKernels.py', 'reactionProfiling.py', 'reactionSubstepping.py']:
+                genericScriptPath = os.path.join(crimsonSolverPath, 'ScalarProblem/ForProcsCase', scriptName)
+                try:
+                    # these scripts won't be changed for most scalar simulations, we figure it's best to include them with the solver input data
+                    # so that in case a highly technical user wants to modify them, they can.
+                    #
+                    # these scripts are in PythonModules/CrimsonSolver/ScalarProblem/ForProcsCase/
+                    shutil.copy2(genericScriptPath, outputDir)
+                except Exception as ex:
+                    raise RuntimeError('An error occurred while copying {} from "{}" to "{}": {}'.format(scriptName, genericScriptPath, outputDir, ex.message))
 
 
         if solutionStorage is not None:
@@ -570,7 +594,7 @@ class SolverStudy(VersionedObject):
                 self._writeAdjacency(meshData, fileList)
             with Timer('Written boundary conditions'):
                 self._writeBoundaryConditions(vesselForestData, solidModelData, meshData, boundaryConditions, scalars, scalarBCs,
-                                              materials, faceIndicesAndFileNames, solverInpData, fileList,
+                                              materials, faceIndicesAndFileNames, solverParameters, solverInpData, fileList,
                                               faceIndicesInAllExteriorFaces)
 
             self._writeSolverSetup(solverInpData, fileList, enableScalar)
@@ -805,7 +829,8 @@ class SolverStudy(VersionedObject):
         return not hadError
 
     def _writeBoundaryConditions(self, vesselForestData, solidModelData, meshData, boundaryConditions, scalars, scalarBCsDict,
-                                materials, faceIndicesAndFileNames, solverInpData, fileList, faceIndicesInAllExteriorFaces):
+                                materials, faceIndicesAndFileNames, solverParameters, solverInpData, fileList,
+                                faceIndicesInAllExteriorFaces):
         
         if not self._validateBoundaryConditions(boundaryConditions):
             raise RuntimeError('Invalid boundary conditions. Aborting.')
@@ -846,6 +871,12 @@ class SolverStudy(VersionedObject):
 
         materialStorage = self.computeMaterials(materials, vesselForestData, solidModelData, meshData)
 
+        bctSampling = self._computeBctSampling(solverParameters,
+                                               [bc for bc in boundaryConditions if
+                                                is_boundary_condition_type(bc, PrescribedVelocities.PrescribedVelocities) or
+                                                is_boundary_condition_type(bc, PCMRI.PCMRI)],
+                                               validFaceIdentifiers, meshData)
+
         # Processing priority for a particular BC type defines the order of processing the BCs
         # Default value is assumed to be 1. The higher the priority, the later the BC is processed
         bcProcessingPriorities = {
@@ -977,7 +1008,8 @@ class SolverStudy(VersionedObject):
                 waveform = bc.smoothedWaveform
                 steadyWaveformValue = numpy.trapz(waveform[:, 1], x=waveform[:, 0]) / (waveform[-1, 0] - waveform[0, 0])
 
-                bctInfo.maxNTimeSteps = max(bctInfo.maxNTimeSteps, waveform.shape[0])
+                bctWaveform = bctSampling[bc]
+                bctInfo.maxNTimeSteps = max(bctInfo.maxNTimeSteps, bctWaveform.shape[0])
 
                 for faceId in validFaceIdentifiers(bc):
                     supreFile.write('prescribed_velocities {0}.nbc\n'.format(faceIndicesAndFileNames[faceId][1]));
@@ -1010,7 +1042,7 @@ class SolverStudy(VersionedObject):
                             for timeStep, flowVector in enumerate(flowVectorList):
                                 file.write('{0[0]} {0[1]} {0[2]} {1}\n'.format(flowVector, wave[timeStep, 0]))
 
-                writeBctProfile(bctFile, waveform)
+                writeBctProfile(bctFile, bctWaveform)
                 writeBctProfile(bctSteadyFile,
                                 numpy.array([[waveform[0, 0], steadyWaveformValue],
                                              [waveform[-1, 0], steadyWaveformValue]]))
@@ -1021,24 +1053,27 @@ class SolverStudy(VersionedObject):
                 bctFile = fileList['bct.dat']
                 bctSteadyFile = fileList['bct_steady.dat']
 
+                # Every call to the PC-MRI data goes through PythonQt, so only query the timepoints once
+                timepoints = numpy.array(bc.pcmriData.getTimepoints(), dtype=numpy.float64)
+
                 if bctInfo.first:
                     bctInfo.first = False
                     emptyLine = ' ' * 50 + '\n'
                     bctFile.write(emptyLine)
                     bctSteadyFile.write(emptyLine)
-                    bctInfo.period = bc.pcmriData.getTimepoints()[-1]  # Last time point
+                    bctInfo.period = timepoints[-1]  # Last time point
                 else:
-                    if abs(bc.pcmriData.getTimepoints()[-1] - bctInfo.period) > 1e-5:
+                    if abs(timepoints[-1] - bctInfo.period) > 1e-5:
                         Utils.logWarning(
                             'Periods of waveforms used for prescribed velocities are different. RCR boundary conditions may be inconsistent - the period used is {0}'.format(
                                 bctInfo.period))
 
                 waveform = bc.pcmriData.getFlowWaveform()
                 # steadyWaveformValue = numpy.trapz(waveform[:, 1], x=waveform[:, 0]) / (waveform[-1, 0] - waveform[0, 0])
-                steadyWaveformValue = numpy.trapz(waveform[:], x=bc.pcmriData.getTimepoints()) / \
-                                      (bc.pcmriData.getTimepoints()[-1] - bc.pcmriData.getTimepoints()[0])
+                steadyWaveformValue = numpy.trapz(waveform[:], x=timepoints) / (timepoints[-1] - timepoints[0])
 
-                bctInfo.maxNTimeSteps = max(bctInfo.maxNTimeSteps, len(bc.pcmriData.getTimepoints()))
+                bctTimeIndices = bctSampling[bc]
+                bctInfo.maxNTimeSteps = max(bctInfo.maxNTimeSteps, len(bctTimeIndices))
 
                 for faceId in validFaceIdentifiers(bc):
                     supreFile.write('prescribed_velocities {0}.nbc\n'.format(faceIndicesAndFileNames[faceId][1]));
@@ -1053,22 +1088,30 @@ class SolverStudy(VersionedObject):
 
                     steadyFlowWaveformFile = fileList['bctFlowWaveform_steady.dat']
                     numpy.savetxt(steadyFlowWaveformFile,
-                                    numpy.array([[bc.pcmriData.getTimepoints()[0], steadyWaveformValue],
-                                     [bc.pcmriData.getTimepoints()[-1], steadyWaveformValue]]) )
+                                    numpy.array([[timepoints[0], steadyWaveformValue],
+                                     [timepoints[-1], steadyWaveformValue]]) )
 
                 writeBctWaveforms(waveform, steadyWaveformValue)
 
 
                 def writeBctProfile(file):
+                    bctTimepoints = timepoints[bctTimeIndices]
+                    nodeChunkSize = BctWriter.getNodeChunkSize(len(bctTimepoints))
+
                     for faceId in validFaceIdentifiers(bc):
-                        for index, pointIndex in enumerate(meshData.getNodeIdsForFace(faceId)):
-                            bctInfo.totalPoints += 1
-                            file.write('{0[0]} {0[1]} {0[2]} {1}\n'.format(meshData.getNodeCoordinates(pointIndex),
-                                                                           len(bc.pcmriData.getTimepoints())))
+                        nodeIds = meshData.getNodeIdsForFace(faceId)
+                        bctInfo.totalPoints += len(nodeIds)
+
+                        # The mapped velocities are fetched and written in chunks of nodes, so the memory used
+                        # stays bounded for faces with many nodes and timepoints
+                        for chunkStart in xrange(0, len(nodeIds), nodeChunkSize):
+                            chunkEnd = min(chunkStart + nodeChunkSize, len(nodeIds))
+                            velocities = BctWriter.getMappedPCMRIVelocities(bc.pcmriData, xrange(chunkStart, chunkEnd),
+                                                                            bctTimeIndices)
+                            BctWriter.writeBctNodes(file,
+                                                    BctWriter.getNodeCoordinates(meshData, nodeIds[chunkStart:chunkEnd]),
+                                                    velocities, bctTimepoints)
 
-                            for timeIndex, timeStep in enumerate(bc.pcmriData.getTimepoints()):
-                                file.write('{0[0]} {0[1]} {0[2]} {1}\n'.format(bc.pcmriData.getSingleMappedPCMRIvector(index,timeIndex),
-                                                                               timeStep))
                 def writeBctProfileSteady(file, wave):
                     for faceId in validFaceIdentifiers(bc):
                         flowProfileGenerator = FlowProfileGenerator(0, solidModelData,
@@ -1084,8 +1127,8 @@ class SolverStudy(VersionedObject):
 
                 writeBctProfile(bctFile)
                 writeBctProfileSteady(bctSteadyFile,
-                                numpy.array([[bc.pcmriData.getTimepoints()[0], steadyWaveformValue],
-                                          [bc.pcmriData.getTimepoints()[-1], steadyWaveformValue]]))
+                                numpy.array([[timepoints[0], steadyWaveformValue],
+                                          [timepoints[-1], steadyWaveformValue]]))
 
 
             elif is_boundary_condition_type(bc, DeformableWall.DeformableWall):
@@ -1217,6 +1260,66 @@ class SolverStudy(VersionedObject):
                 len(bctInfo.faceIds)
             presribedVelocititesGroup['List of Dirichlet Surfaces'] = ' '.join(bctInfo.faceIds)
 
+    def _computeBctSampling(self, solverParameters, bctBoundaryConditions, validFaceIdentifiers, meshData):
+        """
+            Chooses the timepoints written to bct.dat for every prescribed velocity boundary condition.
+            All the faces share the same resampling parameters, and the bct.dat size is estimated up front
+            so the user can see the effect of the resampling before the file is written.
+
+            Returns:
+                dict mapping each PrescribedVelocities boundary condition to the [nTimepoints, 2] waveform to write,
+                and each PCMRI boundary condition to the array of PC-MRI time indices to write.
+        """
+        props = solverParameters.getProperties()
+        resample = props['Resample bct waveforms']
+        maxError = props['Maximum waveform error']
+        errorNorm = props['Waveform error norm']
+        uniform = props['Uniform resampling']
+
+        bctSampling = {}
+        numberOfNodesAndTimepoints = []
+        originalNumberOfNodesAndTimepoints = []
+
+        for bc in bctBoundaryConditions:
+            if bc.__class__.__name__ == PCMRI.PCMRI.__name__:
+                # PC-MRI velocities are only known at the acquired timepoints, so resample to a subset of those
+                timepoints = bc.pcmriData.getTimepoints()
+                originalNTimepoints = len(timepoints)
+                if resample:
+                    sampling = WaveformResampling.selectSampleIndices(timepoints, bc.pcmriData.getFlowWaveform(),
+                                                                      maxError, errorNorm)
+                else:
+                    sampling = numpy.arange(originalNTimepoints)
+                nTimepoints = len(sampling)
+            else:
+                originalNTimepoints = bc.smoothedWaveform.shape[0]
+                if resample:
+                    sampling = WaveformResampling.resampleWaveform(bc.smoothedWaveform, maxError, errorNorm, uniform)
+                else:
+                    sampling = bc.smoothedWaveform
+                nTimepoints = sampling.shape[0]
+
+            bctSampling[bc] = sampling
+
+            for faceId in validFaceIdentifiers(bc):
+                nNodes = len(meshData.getNodeIdsForFace(faceId))
+                numberOfNodesAndTimepoints.append((nNodes, nTimepoints))
+                originalNumberOfNodesAndTimepoints.append((nNodes, originalNTimepoints))
+
+        if len(bctSampling) > 0:
+            maxNTimepoints = max(x[1] for x in numberOfNodesAndTimepoints) if numberOfNodesAndTimepoints else 0
+            estimatedSizeMB = WaveformResampling.estimateBctFileSize(numberOfNodesAndTimepoints) / 1e6
+            if resample:
+                originalSizeMB = WaveformResampling.estimateBctFileSize(originalNumberOfNodesAndTimepoints) / 1e6
+                Utils.logInformation('Resampled bct waveforms: up to {0} timepoints per node, '
+                                     'estimated bct.dat size {1:.1f} MB (without resampling: {2:.1f} MB)'.format(
+                                         maxNTimepoints, estimatedSizeMB, originalSizeMB))
+            else:
+                Utils.logInformation('Writing up to {0} timepoints per node, estimated bct.dat size {1:.1f} MB'.format(
+                    maxNTimepoints, estimatedSizeMB))
+
+        return bctSampling
+
     def _writeMaterial(self, bc, faceIndicesInAllExteriorFaces, swbFile, materialStorage, shearConstant, meshData,
                        solidModelData, vesselForestData):
         thicknessArray = materialStorage.arrays['Thickness'].data
@@ -1229,53 +1332,89 @@ class SolverStudy(VersionedObject):
         Econst = bc.getProperties()["Young's modulus"]
         v = bc.getProperties()["Poisson ratio"]
 
-        faceIndexToAllExteriorFacesIndex = {y: x for x, y in enumerate(faceIndicesInAllExteriorFaces)}
-
         # SWB file MUST contain information for all exterior faces
-        for i in xrange(solidModelData.getNumberOfFaceIdentifiers()):
-            faceIdentifier = solidModelData.getFaceIdentifier(i)
-            for meshFaceInfo in meshData.getMeshFaceInfoForFace(faceIdentifier):
-                globalFaceId = meshFaceInfo[1]
-                t = thicknessArray[globalFaceId][0]
-
-                if numpy.isnan(t):
-                    t = tConst
-
-                if anisoStiffnessArray is not None and not numpy.isnan(anisoStiffnessArray[globalFaceId][0]):
-                    stiffnessMatrix = self._computeAnisotropicStiffnessMatrix(
-                        MaterialFaceInfo(vesselForestData, meshData, faceIdentifier, meshFaceInfo),
-                        anisoStiffnessArray[globalFaceId])
-                else:
-                    if isoStiffnessArray is not None and not numpy.isnan(isoStiffnessArray[globalFaceId][0]):
-                        E = isoStiffnessArray[globalFaceId][0]
-                    else:
-                        if faceIdentifier.faceType != FaceType.ftWall:
-                            continue # Ignore flow faces which have no material set
-                        else:
-                            E = Econst # Treat wall faces as having isotropic material with values from BC
-                    stiffnessMatrix = self._computeIsotropicStiffnessMatrix(v, E, shearConstant)
-
-                swbFile.write(
-                    '{0} {1} 0 0 0 0 0 '
-                    '{2[0][0]} {2[1][0]} {2[1][1]} '
-                    '{2[2][0]} {2[2][1]} {2[2][2]} '
-                    '{2[3][0]} {2[3][1]} {2[3][2]} '
-                    '{2[3][3]} {2[4][0]} {2[4][1]} '
-                    '{2[4][2]} {2[4][3]} {2[4][4]}\n'.format(
-                        faceIndexToAllExteriorFacesIndex[globalFaceId] + 1, t, stiffnessMatrix))
-
-    def _computeIsotropicStiffnessMatrix(self, poissonRatio, youngsModulus, shearConstant):
-        Kmatrix = numpy.zeros([5, 5])
-
-        C = youngsModulus / (1 - poissonRatio * poissonRatio)
+        faceArrays = MaterialFaceArrays(vesselForestData, meshData,
+                                        [solidModelData.getFaceIdentifier(i)
+                                         for i in xrange(solidModelData.getNumberOfFaceIdentifiers())])
+        globalFaceIds = faceArrays.getFaceIndices()
+        isWallFace = numpy.array([faceIdentifier.faceType == FaceType.ftWall
+                                  for faceIdentifier in faceArrays.faceIdentifiers],
+                                 dtype=bool)[faceArrays.faceIdentifierIndices]
+
+        thicknesses = thicknessArray[globalFaceIds, 0]
+        thicknesses[numpy.isnan(thicknesses)] = tConst
+
+        if anisoStiffnessArray is not None:
+            isAnisoFace = ~numpy.isnan(anisoStiffnessArray[globalFaceIds, 0])
+        else:
+            isAnisoFace = numpy.zeros(len(globalFaceIds), dtype=bool)
 
-        Kmatrix[0, 0] = Kmatrix[1, 1] = C
-        Kmatrix[0, 1] = Kmatrix[1, 0] = C * poissonRatio
-        Kmatrix[2, 2] = C * 0.5 * (1 - poissonRatio)
-        Kmatrix[3, 3] = Kmatrix[4, 4] = C * 0.5 * shearConstant * (1 - poissonRatio)
+        if isoStiffnessArray is not None:
+            youngsModuli = isoStiffnessArray[globalFaceIds, 0]
+        else:
+            youngsModuli = numpy.empty(len(globalFaceIds))
+            youngsModuli[:] = numpy.nan
+        isIsoFace = ~isAnisoFace & ~numpy.isnan(youngsModuli)
+
+        # Treat wall faces without a material as having isotropic material with values from BC
+        isDefaultFace = ~isAnisoFace & ~isIsoFace & isWallFace
+        youngsModuli[isDefaultFace] = Econst
+
+        # Flow faces which have no material set are ignored
+        isWrittenFace = isAnisoFace | isIsoFace | isDefaultFace
+
+        stiffnessMatrices = numpy.empty((len(globalFaceIds), 5, 5))
+        anisoFaceArrays = faceArrays.getSubset(isAnisoFace)
+        if anisoFaceArrays.getNumberOfFaces() > 0:
+            stiffnessMatrices[isAnisoFace] = self._computeAnisotropicStiffnessMatrices(
+                anisoFaceArrays.getFaceNodeCoordinates(), anisoFaceArrays.getFaceCenters(),
+                anisoFaceArrays.getVesselPathCoordinateFrames(), anisoStiffnessArray[anisoFaceArrays.getFaceIndices()])
+
+        isIsotropicFace = isIsoFace | isDefaultFace
+        stiffnessMatrices[isIsotropicFace] = self._computeIsotropicStiffnessMatrices(v, youngsModuli[isIsotropicFace],
+                                                                                     shearConstant)
+
+        # Index of every mesh face in the list of all exterior faces, -1 for the interior faces
+        exteriorFaceIndices = numpy.empty(meshData.getNFaces(), dtype=numpy.int64)
+        exteriorFaceIndices[:] = -1
+        exteriorFaceIndices[numpy.asarray(faceIndicesInAllExteriorFaces, dtype=numpy.int64)] = \
+            numpy.arange(len(faceIndicesInAllExteriorFaces))
+
+        # Every row is the exterior face index followed by the 21 wall properties:
+        # <thickness> 0 0 0 0 0 <lower triangle of the stiffness matrix>
+        lowerTriangle = numpy.tril_indices(5)
+        rows = numpy.zeros((numpy.count_nonzero(isWrittenFace), 22))
+        rows[:, 0] = exteriorFaceIndices[globalFaceIds[isWrittenFace]] + 1
+        rows[:, 1] = thicknesses[isWrittenFace]
+        rows[:, 7:] = stiffnessMatrices[isWrittenFace][:, lowerTriangle[0], lowerTriangle[1]]
+
+        if numpy.any(rows[:, 0] == 0):
+            raise RuntimeError('Mesh face {0} is not an exterior face'.format(
+                globalFaceIds[isWrittenFace][rows[:, 0] == 0][0]))
+
+        for start in xrange(0, rows.shape[0], _swbRowsPerChunk):
+            chunk = rows[start:start + _swbRowsPerChunk]
+            swbFile.write((_swbLineFormat * chunk.shape[0]) % tuple(chunk.ravel()))
+
+    def _computeIsotropicStiffnessMatrices(self, poissonRatio, youngsModuli, shearConstant):
+        """
+            Computes the isotropic stiffness matrices for an array of Young's moduli.
+
+            Returns:
+                [n, 5, 5] array of stiffness matrices
+        """
+        Kmatrix = numpy.zeros([len(youngsModuli), 5, 5])
+
+        C = youngsModuli / (1 - poissonRatio * poissonRatio)
+
+        Kmatrix[:, 0, 0] = Kmatrix[:, 1, 1] = C
+        Kmatrix[:, 0, 1] = Kmatrix[:, 1, 0] = C * poissonRatio
+        Kmatrix[:, 2, 2] = C * 0.5 * (1 - poissonRatio)
+        Kmatrix[:, 3, 3] = Kmatrix[:, 4, 4] = C * 0.5 * shearConstant * (1 - poissonRatio)
 
         return Kmatrix
 
+    # Per-face version of _computeAnisotropicStiffnessMatrices, kept as the reference implementation
     def _computeAnisotropicStiffnessMatrix(self, materialFaceInfo, youngsModulusAniso):
         coordinateFrame = materialFaceInfo.getVesselPathCoordinateFrame()
 
@@ -1367,6 +1506,101 @@ class SolverStudy(VersionedObject):
 
         return Kmatrix
 
+    def _computeAnisotropicStiffnessMatrices(self, faceNodeCoordinates, faceCenters, coordinateFrames,
+                                             youngsModulusAniso):
+        """
+            Computes the anisotropic stiffness matrices for n faces at once.
+
+            Parameters:
+                faceNodeCoordinates: [n, 3, 3] array of the coordinates of the three nodes of every face
+                faceCenters: [n, 3] array of face centers
+                coordinateFrames: [n, 9] array of vessel path coordinate frames
+                youngsModulusAniso: [n, 6] array of the anisotropic Young's modulus components
+
+            Returns:
+                [n, 5, 5] array of stiffness matrices
+        """
+        def normalize(v):
+            return v / numpy.linalg.norm(v, axis=1)[:, numpy.newaxis]
+
+        x1 = faceNodeCoordinates[:, 0]
+        x2 = faceNodeCoordinates[:, 1]
+        x3 = faceNodeCoordinates[:, 2]
+
+        # Face coordinate frames
+        v1 = normalize(x2 - x1)
+        v3 = normalize(numpy.cross(v1, x3 - x1))
+        v2 = numpy.cross(v3, v1)
+
+        # 'Membrane' coordinate frames
+        e3 = normalize(faceCenters - coordinateFrames[:, 0:3])
+        e2 = coordinateFrames[:, 3:6]
+        e1 = normalize(numpy.cross(e2, e3))
+        e3 = numpy.cross(e1, e2)
+
+        # Transformation matrices, Q[n, i, j] = dot(v_i, e_j)
+        Q = numpy.einsum('nik,njk->nij', numpy.stack((v1, v2, v3), axis=1), numpy.stack((e1, e2, e3), axis=1))
+
+        nFaces = faceNodeCoordinates.shape[0]
+        tempC = numpy.zeros([nFaces, 3, 3, 3, 3])
+
+        tempC[:, 0, 0, 0, 0] = youngsModulusAniso[:, 0]  # C_qqqq
+        tempC[:, 0, 0, 1, 1] = youngsModulusAniso[:, 1]  # C_qqzz
+        tempC[:, 1, 1, 0, 0] = tempC[:, 0, 0, 1, 1]
+        tempC[:, 1, 1, 1, 1] = youngsModulusAniso[:, 2]  # C_zzzz
+
+        tempC[:, 0, 1, 0, 1] = youngsModulusAniso[:, 3]  # 0.25 * (C_qzqz+C_qzzq+C_zqzq+C_zqqz)
+
+        tempC[:, 0, 1, 1, 0] = tempC[:, 0, 1, 0, 1]
+        tempC[:, 1, 0, 1, 0] = tempC[:, 0, 1, 0, 1]
+        tempC[:, 1, 0, 0, 1] = tempC[:, 0, 1, 0, 1]
+
+        tempC[:, 2, 0, 2, 0] = youngsModulusAniso[:, 4]  # C_rqrq
+
+        tempC[:, 2, 1, 2, 1] = youngsModulusAniso[:, 5]  # C_rzrz
+
+        # Rotate the tensors, Crot[i, j, k, l] = Q[i, a] Q[j, b] Q[k, c] Q[l, d] C[a, b, c, d],
+        # contracting one index at a time to avoid building the 3^8 products
+        tempCrot = numpy.einsum('nla,nijka->nijkl', Q, tempC)
+        tempCrot = numpy.einsum('nka,nijal->nijkl', Q, tempCrot)
+        tempCrot = numpy.einsum('nja,niakl->nijkl', Q, tempCrot)
+        tempCrot = numpy.einsum('nia,najkl->nijkl', Q, tempCrot)
+
+        Kmatrix = numpy.zeros([nFaces, 5, 5])
+
+        Kmatrix[:, 0, 0] = tempCrot[:, 0, 0, 0, 0]
+        Kmatrix[:, 0, 1] = tempCrot[:, 0, 0, 1, 1]
+        Kmatrix[:, 0, 2] = 0.5 * (tempCrot[:, 0, 0, 0, 1] + tempCrot[:, 0, 0, 1, 0])
+        Kmatrix[:, 0, 3] = tempCrot[:, 0, 0, 2, 0]
+        Kmatrix[:, 0, 4] = tempCrot[:, 0, 0, 2, 1]
+
+        Kmatrix[:, 1, 0] = tempCrot[:, 1, 1, 0, 0]
+        Kmatrix[:, 1, 1] = tempCrot[:, 1, 1, 1, 1]
+        Kmatrix[:, 1, 2] = 0.5 * (tempCrot[:, 1, 1, 0, 1] + tempCrot[:, 1, 1, 1, 0])
+        Kmatrix[:, 1, 3] = tempCrot[:, 1, 1, 2, 0]
+        Kmatrix[:, 1, 4] = tempCrot[:, 1, 1, 2, 1]
+
+        Kmatrix[:, 2, 0] = 0.5 * (tempCrot[:, 0, 1, 0, 0] + tempCrot[:, 1, 0, 0, 0])
+        Kmatrix[:, 2, 1] = 0.5 * (tempCrot[:, 0, 1, 1, 1] + tempCrot[:, 1, 0, 1, 1])
+        Kmatrix[:, 2, 2] = 0.25 * (tempCrot[:, 0, 1, 0, 1] + tempCrot[:, 0, 1, 1, 0] +
+                                   tempCrot[:, 1, 0, 1, 0] + tempCrot[:, 1, 0, 0, 1])
+        Kmatrix[:, 2, 3] = 0.5 * (tempCrot[:, 0, 1, 2, 0] + tempCrot[:, 1, 0, 2, 0])
+        Kmatrix[:, 2, 4] = 0.5 * (tempCrot[:, 0, 1, 2, 1] + tempCrot[:, 1, 0, 2, 1])
+
+        Kmatrix[:, 3, 0] = tempCrot[:, 2, 0, 0, 0]
+        Kmatrix[:, 3, 1] = tempCrot[:, 2, 0, 1, 1]
+        Kmatrix[:, 3, 2] = 0.5 * (tempCrot[:, 2, 0, 0, 1] + tempCrot[:, 2, 0, 1, 0])
+        Kmatrix[:, 3, 3] = tempCrot[:, 2, 0, 2, 0]
+        Kmatrix[:, 3, 4] = tempCrot[:, 2, 0, 2, 1]
+
+        Kmatrix[:, 4, 0] = tempCrot[:, 2, 1, 0, 0]
+        Kmatrix[:, 4, 1] = tempCrot[:, 2, 1, 1, 1]
+        Kmatrix[:, 4, 2] = 0.5 * (tempCrot[:, 2, 1, 0, 1] + tempCrot[:, 2, 1, 1, 0])
+        Kmatrix[:, 4, 3] = tempCrot[:, 2, 1, 2, 0]
+        Kmatrix[:, 4, 4] = tempCrot[:, 2, 1, 2, 1]
+
+        return Kmatrix
+
     def _writeSupreSurfaceIDs(self, faceIndicesAndFileNames, supreFile):
         supreFile.write('set_surface_id all_exterior_faces.ebc 1\n')
         for idAndName in sorted(faceIndicesAndFileNames.viewvalues(), key=lambda x: x[0]):
@@ -1449,56 +1683,132 @@ class SolverStudy(VersionedObject):
             validFaceIdentifiers = lambda bc: (x for x in bc.faceIdentifiers if
                                                solidModelData.faceIdentifierIndex(x) != -1)
 
-            def getMaterialConstantValue(materialData):
-                if materialData.nComponents == 1:
-                    return m.getProperties()[materialData.name]
+            reusedMaterials = []
+            recomputedMaterials = []
+
+            for materialIndex, m in enumerate(materials):
+                # All the per-face quantities are gathered once per material and shared by its material datas
+                faceArrays = MaterialFaceArrays(vesselForestData, meshData, validFaceIdentifiers(m))
+                faceIndices = faceArrays.getFaceIndices()
+
+                # With MaterialResultsCache enabled, materials whose inputs have not changed since the last call are not
+                # recomputed
+                materialValues = None
+                if MaterialResultsCache.enabled:
+                    materialKey = MaterialResultsCache.computeMaterialKey(m, faceArrays)
+                    materialValues = MaterialResultsCache.get(materialKey)
+                materialDescription = '{0} #{1}'.format(m.__class__.__name__, materialIndex)
+
+                if materialValues is None:
+                    recomputedMaterials.append(materialDescription)
+                    materialValues = [self._computeMaterialValues(m, materialData, faceArrays, vesselForestData, meshData)
+                                      for materialData in m.materialDatas]
+                    if MaterialResultsCache.enabled:
+                        MaterialResultsCache.put(materialKey, materialValues)
                 else:
-                    return [m.getProperties()[materialData.name][materialData.componentNames[component]] for component
-                            in xrange(materialData.nComponents)]
+                    reusedMaterials.append(materialDescription)
 
-            for m in materials:
-                for materialData in m.materialDatas:
+                for materialData, values in zip(m.materialDatas, materialValues):
                     if materialData.name not in solutionStorage.arrays:
                         newMat = numpy.zeros((meshData.getNFaces(), materialData.nComponents))
                         newMat[:] = numpy.NAN
                         solutionStorage.arrays[materialData.name] = SolutionStorage.ArrayInfo(newMat,
                                                                                               materialData.componentNames)
 
-                    if materialData.representation == MaterialData.RepresentationType.Table:
-                        # sort by argument value, see http://stackoverflow.com/questions/2828059/sorting-arrays-in-numpy-by-column
-                        tableData = materialData.tableData.data.transpose()
-                        tableData = tableData[tableData[:, 0].argsort()].transpose()
-                    elif materialData.representation == MaterialData.RepresentationType.Script:
-                        exec compile(materialData.scriptData, 'material {0}'.format(materialData.name),
-                                     'exec') in globals(), globals()
-                    for faceId in validFaceIdentifiers(m):
-                        constantValue = getMaterialConstantValue(materialData)
-                        for info in meshData.getMeshFaceInfoForFace(faceId):
-                            materialFaceInfo = MaterialFaceInfo(vesselForestData, meshData, faceId, info)
-
-                            if materialData.representation == MaterialData.RepresentationType.Constant:
-                                value = constantValue
-                            elif materialData.representation == MaterialData.RepresentationType.Table:
-                                if materialData.tableData.inputVariableType == MaterialData.InputVariableType.DistanceAlongPath:
-                                    x = materialFaceInfo.getArcLength()
-                                elif materialData.tableData.inputVariableType == MaterialData.InputVariableType.LocalRadius:
-                                    x = materialFaceInfo.getLocalRadius()
-                                elif materialData.tableData.inputVariableType == MaterialData.InputVariableType.x:
-                                    x = materialFaceInfo.getFaceCenter()[0]
-                                elif materialData.tableData.inputVariableType == MaterialData.InputVariableType.y:
-                                    x = materialFaceInfo.getFaceCenter()[1]
-                                elif materialData.tableData.inputVariableType == MaterialData.InputVariableType.z:
-                                    x = materialFaceInfo.getFaceCenter()[2]
-
-                                value = [numpy.interp(x, tableData[0], tableData[component])
-                                         for component in xrange(1, materialData.nComponents + 1)]
-                            elif materialData.representation == MaterialData.RepresentationType.Script:
-                                value = computeMaterialValue(materialFaceInfo)
-
-                            solutionStorage.arrays[materialData.name].data[info[1]] = value
-                            #
+                    solutionStorage.arrays[materialData.name].data[faceIndices] = values
+
+            if MaterialResultsCache.enabled:
+                Utils.logInformation('Materials reused: {0}; recomputed: {1}'.format(
+                    ', '.join(reusedMaterials) or 'none', ', '.join(recomputedMaterials) or 'none'))
+
         return solutionStorage
 
+    def _computeMaterialValues(self, material, materialData, faceArrays, vesselForestData, meshData):
+        """
+            Computes the values of a single material data for all the faces in faceArrays.
+
+            Returns:
+                [nFaces, nComponents] array of material values
+        """
+        values = numpy.empty((faceArrays.getNumberOfFaces(), materialData.nComponents))
+
+        if materialData.representation == MaterialData.RepresentationType.Constant:
+            if materialData.nComponents == 1:
+                values[:] = material.getProperties()[materialData.name]
+            else:
+                values[:] = [material.getProperties()[materialData.name][materialData.componentNames[component]]
+                             for component in xrange(materialData.nComponents)]
+
+        elif materialData.representation == MaterialData.RepresentationType.Table:
+            # sort by argument value, see http://stackoverflow.com/questions/2828059/sorting-arrays-in-numpy-by-column
+            tableData = materialData.tableData.data.transpose()
+            tableData = tableData[tableData[:, 0].argsort()].transpose()
+
+            inputVariableType = materialData.tableData.inputVariableType
+            if inputVariableType == MaterialData.InputVariableType.DistanceAlongPath:
+                x = faceArrays.getArcLengths()
+            elif inputVariableType == MaterialData.InputVariableType.LocalRadius:
+                x = faceArrays.getLocalRadii()
+            elif inputVariableType == MaterialData.InputVariableType.x:
+                x = faceArrays.getFaceCenters()[:, 0]
+            elif inputVariableType == MaterialData.InputVariableType.y:
+                x = faceArrays.getFaceCenters()[:, 1]
+            elif inputVariableType == MaterialData.InputVariableType.z:
+                x = faceArrays.getFaceCenters()[:, 2]
+
+            for component in xrange(1, materialData.nComponents + 1):
+                values[:, component - 1] = numpy.interp(x, tableData[0], tableData[component])
+
+        elif materialData.representation == MaterialData.RepresentationType.Script:
+            # The script sees the names of this module, as the scripts have always been run in its namespace
+            scriptGlobals = MaterialScriptPool.executeMaterialScript(materialData.name, materialData.scriptData,
+                                                                     dict(globals()))
+
+            if 'computeMaterialValues' in scriptGlobals:
+                values[:] = self._computeScriptMaterialValues(scriptGlobals['computeMaterialValues'], faceArrays,
+                                                              materialData)
+            elif 'computeMaterialValue' in scriptGlobals and MaterialScriptPool.numberOfWorkers > 1:
+                values[:] = MaterialScriptPool.computeMaterialValues(materialData, faceArrays)
+            elif 'computeMaterialValue' in scriptGlobals:
+                computeMaterialValue = scriptGlobals['computeMaterialValue']
+
+                faceCenters = faceArrays.getFaceCenters()
+                for i, info in enumerate(faceArrays.getMeshFaceInfo()):
+                    materialFaceInfo = MaterialFaceInfo(vesselForestData, meshData,
+                                                        faceArrays.faceIdentifiers[faceArrays.faceIdentifierIndices[i]],
+                                                        info.tolist())
+                    materialFaceInfo.center = faceCenters[i].tolist()
+
+                    try:
+                        values[i] = computeMaterialValue(materialFaceInfo)
+                    except Exception:
+                        raise RuntimeError(MaterialScriptPool.formatFaceError(materialData.name, info))
+            else:
+                raise RuntimeError('The script for material \'{0}\' defines neither computeMaterialValue(info) '
+                                   'nor computeMaterialValues(infoArrays)'.format(materialData.name))
+
+        return values
+
+    def _computeScriptMaterialValues(self, computeMaterialValues, faceArrays, materialData):
+        """
+            Runs the array form of a material script, computeMaterialValues(infoArrays), and checks the shape of its result.
+
+            Returns:
+                [nFaces, nComponents] array of material values
+        """
+        nFaces = faceArrays.getNumberOfFaces()
+        values = numpy.asarray(computeMaterialValues(faceArrays), dtype=numpy.float64)
+
+        # Single component materials may return a flat array
+        if values.shape == (nFaces,) and materialData.nComponents == 1:
+            values = values.reshape((nFaces, 1))
+
+        if values.shape != (nFaces, materialData.nComponents):
+            raise RuntimeError('computeMaterialValues for material \'{0}\' returned an array of shape {1}, '
+                               'expected {2}'.format(materialData.name, values.shape, (nFaces, materialData.nComponents)))
+
+        return values
+
     def upgrade_Pre2021_To_v2021A(self):
         print('Applying v2021A upgrades to Solver Study...')
 
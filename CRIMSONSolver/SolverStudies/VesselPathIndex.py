@@ -0,0 +1,354 @@
+import numpy
+
+from PythonQt.CRIMSON import Utils
+
+"""
+    A python-side spatial index answering the closest-point queries of the vessel forest for arrays of points.
+
+    vesselForestData.getClosestPoint and vesselForestData.getVesselPathCoordinateFrame are answered by the C++ code one
+    point at a time, which costs two PythonQt calls for every mesh face when computing materials.
+
+    The C++ interface does not expose the vessel paths themselves, so each path is sampled through the same closest-point
+    queries: the index queries a few seed points, and then keeps bisecting the path between consecutive samples until
+    they are no further apart than a fraction of the vessel radius. The first value returned by getClosestPoint is the
+    distance of the query point to the path, so the vessel radius is estimated from the seed points, which are mesh face
+    centres on the vessel wall; the bisection midpoints lie on the path and are not used for it. Every sample stores the
+    path point, the arc length and the coordinate frame. The samples are put into a uniform grid, and a query point is
+    projected onto the path segments adjacent to its nearest sample, with the sampled quantities interpolated linearly.
+    The distance of the query point to the interpolated path point is returned as its radius.
+
+    Before a batch of points is answered from the index, a few of the points are checked against the C++ queries.
+    If the index disagrees with them (e.g. because the vessel path has been edited since it was sampled), the batch
+    falls back to the C++ queries.
+
+    Only the face identifiers with a single parent solid, i.e. a single vessel path, are indexed.
+
+    The answers of the index only agree with the C++ queries to within tolerance, and only a few points of every batch
+    are checked, so the material table inputs and the anisotropic coordinate frames differ slightly from the ones of the
+    C++ queries. For this reason the index is disabled by default; enable it when the speed of the material computations
+    matters more than their exact reproduction.
+"""
+
+# Set to True to answer the queries from the index, see above. The C++ queries are used otherwise.
+enabled = False
+
+# Maximum distance between consecutive samples along the path, relative to the local radius
+sampleSpacing = 0.25
+
+# Maximum allowed difference between the index and the C++ queries, relative to the local radius
+tolerance = 1e-2
+
+# Number of points of every batch checked against the C++ queries
+nValidationPoints = 16
+
+# Number of points of every batch used to seed the sampling of a path
+_nSeedPoints = 32
+
+# Maximum number of samples of a path. If the spacing above would need more, the samples are spread more sparsely.
+maxSamplesPerPath = 4096
+
+# Bisection is stopped after this many rounds even if the spacing is not reached
+_maxRefinementRounds = 20
+
+# Number of query points processed at once by the brute force nearest sample search
+_bruteForceChunkSize = 1024
+
+
+class _UniformGrid(object):
+    """
+        Nearest neighbour search among a set of points bucketed into a uniform grid of cubic cells.
+    """
+    def __init__(self, points, cellSize):
+        self.points = points
+        self.cellSize = cellSize
+        self.origin = points.min(axis=0)
+
+        cells = self._getCells(points)
+        self.dimensions = cells.max(axis=0) + 1
+        keys = self._getKeys(cells)
+
+        self.order = numpy.argsort(keys, kind='mergesort')
+        self.sortedKeys = keys[self.order]
+
+    def _getCells(self, points):
+        return numpy.floor((points - self.origin) / self.cellSize).astype(numpy.int64)
+
+    def _getKeys(self, cells):
+        return (cells[:, 0] * self.dimensions[1] + cells[:, 1]) * self.dimensions[2] + cells[:, 2]
+
+    def findNearest(self, queryPoints):
+        """
+            Returns the index of the nearest point and the distance to it for every query point.
+        """
+        nQueries = queryPoints.shape[0]
+        nearest = numpy.zeros(nQueries, dtype=numpy.int64)
+        bestDistanceSq = numpy.empty(nQueries)
+        bestDistanceSq[:] = numpy.inf
+
+        queryCells = self._getCells(queryPoints)
+
+        for offset in numpy.ndindex(3, 3, 3):
+            cells = queryCells + (numpy.array(offset) - 1)
+            inside = numpy.all((cells >= 0) & (cells < self.dimensions), axis=1)
+            keys = self._getKeys(numpy.where(inside[:, numpy.newaxis], cells, 0))
+
+            begin = numpy.searchsorted(self.sortedKeys, keys, side='left')
+            end = numpy.searchsorted(self.sortedKeys, keys, side='right')
+            end[~inside] = begin[~inside]
+
+            for k in xrange((end - begin).max() if nQueries > 0 else 0):
+                candidates = numpy.flatnonzero(begin + k < end)
+                pointIndices = self.order[begin[candidates] + k]
+                distanceSq = ((self.points[pointIndices] - queryPoints[candidates]) ** 2).sum(axis=1)
+
+                better = distanceSq < bestDistanceSq[candidates]
+                bestDistanceSq[candidates[better]] = distanceSq[better]
+                nearest[candidates[better]] = pointIndices[better]
+
+        # All points within one cell size of a query point are in the neighbouring cells, so the search above is exact
+        # for the queries which found a point that close. The remaining ones are searched by brute force.
+        missed = numpy.flatnonzero(bestDistanceSq > self.cellSize ** 2)
+        for start in xrange(0, len(missed), _bruteForceChunkSize):
+            chunk = missed[start:start + _bruteForceChunkSize]
+            distanceSq = ((queryPoints[chunk, numpy.newaxis, :] - self.points[numpy.newaxis, :, :]) ** 2).sum(axis=2)
+            nearest[chunk] = distanceSq.argmin(axis=1)
+            bestDistanceSq[chunk] = distanceSq[numpy.arange(len(chunk)), nearest[chunk]]
+
+        return nearest, numpy.sqrt(bestDistanceSq)
+
+
+class _VesselPathSamples(object):
+    """
+        Samples of a single vessel path, ordered by arc length.
+    """
+    def __init__(self):
+        self.points = numpy.empty((0, 3))
+        self.arcLengths = numpy.empty(0)
+        self.frames = numpy.empty((0, 9))
+        # Typical distance of the query points to the path, i.e. the vessel radius
+        self.radiusScale = 0.0
+        self.grid = None
+
+    def getNumberOfSamples(self):
+        return len(self.arcLengths)
+
+    def add(self, arcLengths, frames):
+        if len(arcLengths) == 0:
+            return
+
+        arcLengths = numpy.concatenate((self.arcLengths, arcLengths))
+        _, unique = numpy.unique(arcLengths, return_index=True)
+
+        self.arcLengths = arcLengths[unique]
+        self.frames = numpy.concatenate((self.frames, frames))[unique]
+        self.points = self.frames[:, 0:3]
+        self.grid = None
+
+    def getGrid(self):
+        if self.grid is None:
+            # The query points are typically about a radius away from the path, a cell of this size makes most of the
+            # nearest sample searches exact without resorting to brute force
+            cellSize = 2 * max(self.radiusScale, (numpy.diff(self.arcLengths).max()
+                                                  if self.getNumberOfSamples() > 1 else 0), 1e-12)
+            self.grid = _UniformGrid(self.points, cellSize)
+
+        return self.grid
+
+
+class VesselPathIndex(object):
+    def __init__(self, vesselForestData):
+        self.vesselForestData = vesselForestData
+        # _VesselPathSamples for every indexed face identifier
+        self.samples = {}
+
+    def query(self, faceIdentifier, points):
+        """
+            Finds the closest vessel path points for an array of points near the face identifier.
+
+            Parameters:
+                points: [n, 3] array of points
+
+            Returns:
+                (radii, arcLengths, frames) - [n], [n] and [n, 9] arrays, see vesselForestData.getClosestPoint and
+                vesselForestData.getVesselPathCoordinateFrame
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 3))
+
+        if not enabled or len(faceIdentifier.parentSolidIndices) != 1 or len(points) <= nValidationPoints:
+            return self._queryVesselForest(faceIdentifier, points)
+
+        samples = self.samples.get(faceIdentifier)
+        if samples is None:
+            samples = _VesselPathSamples()
+            self._sample(faceIdentifier, samples, points)
+            self.samples[faceIdentifier] = samples
+
+        validationIndices = numpy.random.RandomState(0).choice(len(points), nValidationPoints, replace=False)
+        expected = self._queryVesselForest(faceIdentifier, points[validationIndices])
+
+        result = self._interpolate(samples, points)
+        if not self._isAccurate(result, expected, validationIndices):
+            Utils.logWarning('Vessel path index for {0} disagrees with the vessel forest, '
+                             'querying the vessel forest for every face instead'.format(faceIdentifier.parentSolidIndices))
+            del self.samples[faceIdentifier]
+            return self._queryVesselForest(faceIdentifier, points)
+
+        # The validation points are exact anyway
+        for value, expectedValue in zip(result, expected):
+            value[validationIndices] = expectedValue
+
+        return result
+
+    def _queryVesselForest(self, faceIdentifier, points):
+        n = len(points)
+        radii = numpy.zeros(n)
+        arcLengths = numpy.zeros(n)
+        frames = numpy.empty((n, 9))
+
+        for i, point in enumerate(points):
+            x, y, z = float(point[0]), float(point[1]), float(point[2])
+            radii[i], arcLengths[i] = self.vesselForestData.getClosestPoint(faceIdentifier, x, y, z)
+            frames[i] = self.vesselForestData.getVesselPathCoordinateFrame(faceIdentifier, x, y, z)
+
+        return radii, arcLengths, frames
+
+    def _sample(self, faceIdentifier, samples, points):
+        # Seed the samples with a spread of the points, including the extreme ones along every axis so
+        # that the samples cover the whole of the path near the points
+        seedIndices = numpy.concatenate((numpy.linspace(0, len(points) - 1, min(_nSeedPoints, len(points))).astype(int),
+                                         points.argmin(axis=0), points.argmax(axis=0)))
+        seedRadii, seedArcLengths, seedFrames = self._queryVesselForest(faceIdentifier, points[numpy.unique(seedIndices)])
+        samples.add(seedArcLengths, seedFrames)
+        samples.radiusScale = float(numpy.median(seedRadii))
+
+        if samples.getNumberOfSamples() < 2:
+            return
+
+        pathLength = samples.arcLengths[-1] - samples.arcLengths[0]
+        maxSpacing = max(sampleSpacing * samples.radiusScale, pathLength / maxSamplesPerPath)
+
+        # Extend the samples towards the points beyond the first and the last sample, which the seed points do not
+        # always reach on curved paths
+        for _ in xrange(_maxRefinementRounds):
+            self._bisect(faceIdentifier, samples, maxSpacing)
+
+            beyondEnds = self._findPointsBeyondEnds(samples, points)
+            if len(beyondEnds) == 0:
+                break
+
+            nSamplesBefore = samples.getNumberOfSamples()
+            _, arcLengths, frames = self._queryVesselForest(faceIdentifier, beyondEnds)
+            samples.add(arcLengths, frames)
+
+            if samples.getNumberOfSamples() == nSamplesBefore:
+                break
+
+    def _bisect(self, faceIdentifier, samples, maxSpacing):
+        # Bisect the path wherever consecutive samples are too far apart
+        for _ in xrange(_maxRefinementRounds):
+            gaps = numpy.flatnonzero(numpy.diff(samples.arcLengths) > maxSpacing)
+            gaps = gaps[:max(0, maxSamplesPerPath - samples.getNumberOfSamples())]
+            if len(gaps) == 0:
+                break
+
+            nSamplesBefore = samples.getNumberOfSamples()
+            midpoints = 0.5 * (samples.points[gaps] + samples.points[gaps + 1])
+            _, arcLengths, frames = self._queryVesselForest(faceIdentifier, midpoints)
+            samples.add(arcLengths, frames)
+
+            if samples.getNumberOfSamples() == nSamplesBefore:
+                break
+
+    def _findPointsBeyondEnds(self, samples, points):
+        """
+            Returns the points which are nearest to the first or the last sample and furthest beyond it along the path
+            tangent, if any. Their closest path points are past the sampled part of the path, unless the path ends there.
+        """
+        if samples.getNumberOfSamples() >= maxSamplesPerPath:
+            return numpy.empty((0, 3))
+
+        nearest, _ = samples.getGrid().findNearest(points)
+        margin = tolerance * samples.radiusScale
+
+        beyondEnds = []
+        for end, direction in ((0, -1), (samples.getNumberOfSamples() - 1, 1)):
+            candidates = numpy.flatnonzero(nearest == end)
+            beyond = direction * ((points[candidates] - samples.points[end]) * samples.frames[end, 3:6]).sum(axis=1)
+            if len(candidates) > 0 and beyond.max() > margin:
+                beyondEnds.append(candidates[beyond.argmax()])
+        return points[beyondEnds]
+
+    def _interpolate(self, samples, points):
+        nSamples = samples.getNumberOfSamples()
+        if nSamples == 1:
+            return (numpy.linalg.norm(points - samples.points[0], axis=1), numpy.repeat(samples.arcLengths, len(points)),
+                    numpy.repeat(samples.frames, len(points), axis=0))
+
+        nearest, _ = samples.getGrid().findNearest(points)
+
+        # The closest path point p(s) to a point x satisfies f(s) = dot(x - p(s), tangent(s)) = 0. Find the root of the
+        # linear interpolation of f on the segments before and after the nearest sample. A segment on which f changes
+        # sign contains the root, otherwise the closer one is kept.
+        # Unlike projecting onto the chord between the samples, this stays accurate on curved paths.
+        bestSegment = None
+        bestT = None
+        bestDistanceSq = None
+        bestBracketed = None
+        for segment in (numpy.maximum(nearest - 1, 0), numpy.minimum(nearest, nSamples - 2)):
+            fA = ((points - samples.points[segment]) * samples.frames[segment, 3:6]).sum(axis=1)
+            fB = ((points - samples.points[segment + 1]) * samples.frames[segment + 1, 3:6]).sum(axis=1)
+            denominator = fA - fB
+            t = numpy.clip(fA / numpy.where(denominator > 0, denominator, 1), 0, 1)
+            t[(denominator <= 0) & (fB >= 0)] = 1
+            t[(denominator <= 0) & (fA < 0)] = 0
+
+            a = samples.points[segment]
+            distanceSq = ((a + t[:, numpy.newaxis] * (samples.points[segment + 1] - a) - points) ** 2).sum(axis=1)
+            bracketed = (fA >= 0) & (fB <= 0)
+
+            if bestSegment is None:
+                bestSegment, bestT, bestDistanceSq, bestBracketed = segment, t, distanceSq, bracketed
+            else:
+                better = (bracketed & ~bestBracketed) | ((bracketed == bestBracketed) & (distanceSq < bestDistanceSq))
+                bestSegment = numpy.where(better, segment, bestSegment)
+                bestT = numpy.where(better, t, bestT)
+
+        def lerp(values):
+            t = bestT.reshape((-1,) + (1,) * (values.ndim - 1))
+            return (1 - t) * values[bestSegment] + t * values[bestSegment + 1]
+
+        radii = numpy.linalg.norm(points - lerp(samples.points), axis=1)
+        arcLengths = lerp(samples.arcLengths)
+        frames = lerp(samples.frames)
+        for vectorStart in (3, 6):
+            vectors = frames[:, vectorStart:vectorStart + 3]
+            vectors /= numpy.linalg.norm(vectors, axis=1)[:, numpy.newaxis]
+
+        return radii, arcLengths, frames
+
+    def _isAccurate(self, result, expected, validationIndices):
+        radii, arcLengths, frames = (value[validationIndices] for value in result)
+        expectedRadii, expectedArcLengths, expectedFrames = expected
+
+        scale = tolerance * numpy.maximum(expectedRadii, 1e-12)
+        return bool(numpy.all(numpy.abs(radii - expectedRadii) <= scale) and
+                    numpy.all(numpy.abs(arcLengths - expectedArcLengths) <= scale) and
+                    numpy.all(numpy.linalg.norm(frames[:, 0:3] - expectedFrames[:, 0:3], axis=1) <= scale) and
+                    numpy.all(numpy.abs(frames[:, 3:9] - expectedFrames[:, 3:9]) <= tolerance))
+
+
+# The index of the most recently used vessel forest, kept between the calls of computeMaterials and _writeMaterial
+_cachedIndex = None
+
+
+def getVesselPathIndex(vesselForestData):
+    """
+        Returns the VesselPathIndex for the vessel forest, reusing the previous one if the vessel forest is the same object.
+        A stale index (e.g. after a vessel path has been edited) is detected by the validation in VesselPathIndex.query.
+    """
+    global _cachedIndex
+
+    if _cachedIndex is None or _cachedIndex.vesselForestData is not vesselForestData:
+        _cachedIndex = VesselPathIndex(vesselForestData)
+
+    return _cachedIndex
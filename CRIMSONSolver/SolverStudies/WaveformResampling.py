@@ -0,0 +1,119 @@
+"""
+    Temporal resampling of the flow waveforms written to bct.dat.
+
+    bct.dat contains one line per node per timepoint, so the number of timepoints dominates its size.
+    The flowsolver interpolates linearly between the timepoints of each node, which means that any
+    timepoint that can be linearly reconstructed from its neighbours (within some tolerance) is redundant.
+
+    The functions here choose the smallest set of timepoints such that the piecewise-linear reconstruction
+    of the waveform stays within a given relative error of the input waveform.
+    The first and the last timepoints are always kept, so the period of the waveform is preserved.
+"""
+
+import numpy
+
+from CRIMSONSolver.SolverParameters.SolverParameters3D import WaveformErrorNorm
+
+
+# Rough number of bytes per line of bct.dat, i.e. four numbers with 12 significant digits
+_estimatedBytesPerBctLine = 60
+
+
+def _norm(times, values, errorNorm):
+    if errorNorm == WaveformErrorNorm.LInfinity:
+        return numpy.abs(values).max()
+
+    # L2 norm of the piecewise-linear function over the period
+    return numpy.sqrt(numpy.trapz(values * values, x=times))
+
+
+def computeRelativeError(times, values, sampleTimes, sampleValues, errorNorm):
+    """
+        Returns the error of the piecewise-linear reconstruction from (sampleTimes, sampleValues) evaluated at times,
+        relative to the norm of the values.
+        If the waveform is identically zero, the absolute error is returned.
+    """
+    reconstructedValues = numpy.interp(times, sampleTimes, sampleValues)
+    error = _norm(times, reconstructedValues - values, errorNorm)
+    scale = _norm(times, values, errorNorm)
+    return error / scale if scale > 0 else error
+
+
+def selectSampleIndices(times, values, maxError, errorNorm=WaveformErrorNorm.LInfinity):
+    """
+        Selects a (non-uniform) subset of the waveform samples whose linear reconstruction has
+        relative error at most maxError.
+
+        The samples are chosen greedily: starting from the first and the last sample, the sample with the largest
+        reconstruction error is added until the error bound is met.
+
+        Returns:
+            Sorted array of indices into times and values.
+    """
+    times = numpy.asarray(times, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+
+    nSamples = len(times)
+    if nSamples <= 2:
+        return numpy.arange(nSamples)
+
+    selected = numpy.zeros(nSamples, dtype=bool)
+    selected[0] = selected[-1] = True
+
+    while True:
+        sampleIndices = numpy.flatnonzero(selected)
+        if computeRelativeError(times, values, times[sampleIndices], values[sampleIndices], errorNorm) <= maxError:
+            return sampleIndices
+
+        pointwiseError = numpy.abs(numpy.interp(times, times[sampleIndices], values[sampleIndices]) - values)
+        pointwiseError[selected] = -1
+        worstIndex = pointwiseError.argmax()
+        if pointwiseError[worstIndex] <= 0:
+            return sampleIndices
+        selected[worstIndex] = True
+
+
+def resampleWaveformUniformly(waveform, maxError, errorNorm=WaveformErrorNorm.LInfinity):
+    """
+        Finds the smallest number of uniformly spaced samples whose linear reconstruction has relative error at most
+        maxError. The waveform is a [nSamples, 2] array of (time, value) rows, as used by PrescribedVelocities.
+
+        Returns:
+            The resampled [nUniformSamples, 2] waveform. If no smaller uniform sampling satisfies the error bound,
+            the original waveform is returned.
+    """
+    times = waveform[:, 0]
+    values = waveform[:, 1]
+
+    for nUniformSamples in xrange(2, waveform.shape[0]):
+        sampleTimes = numpy.linspace(times[0], times[-1], nUniformSamples)
+        sampleValues = numpy.interp(sampleTimes, times, values)
+        if computeRelativeError(times, values, sampleTimes, sampleValues, errorNorm) <= maxError:
+            return numpy.column_stack((sampleTimes, sampleValues))
+
+    return waveform
+
+
+def resampleWaveform(waveform, maxError, errorNorm=WaveformErrorNorm.LInfinity, uniform=False):
+    """
+        Resamples a [nSamples, 2] waveform of (time, value) rows so that its linear reconstruction stays within
+        maxError (relative) of the original one.
+    """
+    if waveform.shape[0] <= 2:
+        return waveform
+
+    if uniform:
+        return resampleWaveformUniformly(waveform, maxError, errorNorm)
+
+    return waveform[selectSampleIndices(waveform[:, 0], waveform[:, 1], maxError, errorNorm)]
+
+
+def estimateBctFileSize(numberOfNodesAndTimepoints):
+    """
+        Estimates the size of bct.dat in bytes.
+
+        Parameters:
+            numberOfNodesAndTimepoints: iterable of (numberOfNodes, numberOfTimepoints) tuples, one for each face
+    """
+    nLines = sum(nNodes * (nTimepoints + 1) for nNodes, nTimepoints in numberOfNodesAndTimepoints)
+    return nLines * _estimatedBytesPerBctLine
@@ -0,0 +1,28 @@
+"""
+    A stand-in for the flowsolver's CRIMSONScalarProblem module, so that scalarProblemSpecification.py can run outside
+    the flowsolver. It only keeps what the specification tells it, the state vectors are set by the caller.
+
+    benchmarkScalarProblemSpecification.py copies this file next to the specification it benchmarks.
+"""
+
+
+class AbstractRuntimeVectorHandler(object):
+    def __init__(self, mpi_rank, timestepIndexAtConstruction):
+        self.mpi_rank = mpi_rank
+        self.timestepIndexAtConstruction = timestepIndexAtConstruction
+
+        # <scalar number>: state vector, as the flowsolver provides them
+        self.scalarStateVectorsDictionary = {}
+
+        self.diffusionCoefficients = {}
+        self.nonlinearSolveSteps = {}
+        self.nonlinearUpdateSteps = {}
+
+    def setDiffusionCoefficientForSpecies(self, scalarNumber, diffusionCoefficient):
+        self.diffusionCoefficients[scalarNumber] = diffusionCoefficient
+
+    def addNonlinearSolveStepToSpecies(self, scalarNumber, iterations):
+        self.nonlinearSolveSteps.setdefault(scalarNumber, []).extend(iterations)
+
+    def addNonlinearUpdateStepToSpecies(self, scalarNumber, iterations):
+        self.nonlinearUpdateSteps.setdefault(scalarNumber, []).extend(iterations)
@@ -0,0 +1,131 @@
+"""
+    Compares saving and loading scene objects with CRIMSONCore.IO in the legacy format (protocol 0 pickles) and in the
+    binary format, without and with compression.
+
+    A synthetic scene is generated: boundary conditions with prescribed velocity waveforms, materials with tables and
+    netlists with circuit files, each one saved to a file of its own as CRIMSON does. The times are for the whole scene.
+
+    The large attributes are lazy attributes in the binary format, see CRIMSONCore.IO.LazyAttributesObject. They are
+    read by the load unless --lazy is given (see CRIMSONCore.IO.lazyLoading), in which case the load time does not
+    include reading them, and the first access time is the time to read all of them after the load.
+
+    Usage, e.g.:
+        python benchmarks/benchmarkIO.py --objects 20 --samples 1000 100000
+        python benchmarks/benchmarkIO.py --objects 20 --samples 100000 --lazy
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import PythonQtMock as PythonQt
+sys.modules['PythonQt'] = PythonQt
+
+from CRIMSONCore import IO, VersionedObject
+from CRIMSONCore.FaceData import FaceData
+from CRIMSONCore.FaceIdentifier import FaceIdentifier
+
+
+class _SceneObject(FaceData):
+    _lazyAttributes = ['originalWaveform', 'smoothedWaveform', 'table', 'netlistSurfacesDat']
+
+    def __init__(self, index, nSamples):
+        FaceData.__init__(self)
+        self.properties = [
+            {
+                "Parameters": [
+                    {"Heart model": False},
+                    {"Initial pressure": 1000.0 + index},
+                    {"Profile type": 0, "attributes": {"enumNames": ["Plug", "Parabolic", "Womersley"]}}
+                ]
+            }
+        ]
+        self.faceIdentifiers = [FaceIdentifier(1, (u'Vessel {0}'.format(index),))]
+
+        random = numpy.random.RandomState(index)
+        # As PrescribedVelocities
+        self.originalWaveform = numpy.column_stack((numpy.linspace(0.0, 1.0, nSamples), random.rand(nSamples)))
+        self.smoothedWaveform = self.originalWaveform.copy()
+        # As a material table: the input variable and 3 components
+        self.table = random.rand(4, nSamples)
+        # As Netlist
+        self.netlistSurfacesDat = '\n'.join('{0} {1!r}'.format(i, value) for i, value in enumerate(random.rand(nSamples // 10 + 1)))
+
+
+def _timeScene(scene, directory, save, repeats):
+    fileNames = [os.path.join(directory, 'object{0}'.format(i)) for i in range(len(scene))]
+
+    def saveScene():
+        for obj, fileName in zip(scene, fileNames):
+            save(obj, fileName)
+
+    def loadScene():
+        return [IO.loadFromFile(fileName) for fileName in fileNames]
+
+    def loadAndAccessScene():
+        for obj in loadScene():
+            obj.loadLazyAttributes()
+
+    saveTime = min(timeit.repeat(saveScene, number=1, repeat=repeats))
+    loadTime = min(timeit.repeat(loadScene, number=1, repeat=repeats))
+    accessTime = max(0.0, min(timeit.repeat(loadAndAccessScene, number=1, repeat=repeats)) - loadTime)
+    size = sum(os.path.getsize(fileName) for fileName in fileNames)
+
+    for original, loaded in zip(scene, loadScene()):
+        if not numpy.array_equal(original.table, loaded.table) or original.netlistSurfacesDat != loaded.netlistSurfacesDat:
+            raise RuntimeError('The scene was not loaded as it was saved')
+
+    return (saveTime, loadTime, accessTime, size)
+
+
+def _saveLegacy(obj, fileName):
+    IO.writeLegacyFormat = True
+    try:
+        IO.saveToFile(obj, fileName)
+    finally:
+        IO.writeLegacyFormat = False
+
+
+def Benchmark(nObjects, sampleCounts, compressionLevels, repeats):
+    formats = [('legacy', _saveLegacy)]
+    for level in compressionLevels:
+        formats.append(('binary' if level == 0 else 'zlib {0}'.format(level),
+                        lambda obj, fileName, level=level: IO.saveToFile(obj, fileName, level)))
+
+    print('{:>8} {:>10} {:>12} {:>12} {:>14} {:>12}'.format('samples', 'format', 'save', 'load', 'first access', 'size'))
+
+    # The loads would print a line per object
+    VersionedObject.debugPrint = VersionedObject.printNothing
+
+    for nSamples in sampleCounts:
+        scene = [_SceneObject(i, nSamples) for i in range(nObjects)]
+        directory = tempfile.mkdtemp(prefix='ioBenchmark')
+        try:
+            for (formatName, save) in formats:
+                (saveTime, loadTime, accessTime, size) = _timeScene(scene, directory, save, repeats)
+                print('{:>8} {:>10} {:>9.1f} ms {:>9.1f} ms {:>11.1f} ms {:>9.1f} MB'.format(
+                    nSamples, formatName, saveTime * 1000, loadTime * 1000, accessTime * 1000, size / 1024.0 / 1024.0))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks saving and loading scene objects with CRIMSONCore.IO.')
+    parser.add_argument('--objects', type=int, default=20, help='number of objects of the scene')
+    parser.add_argument('--samples', type=int, nargs='+', default=[1000, 100000], help='number of samples of the waveforms and tables')
+    parser.add_argument('--compression', type=int, nargs='+', default=[0, 1], help='zlib levels of the binary format, 0 for none')
+    parser.add_argument('--repeats', type=int, default=3, help='the fastest repeat is reported')
+    parser.add_argument('--lazy', action='store_true', help='read the lazy attributes on their first access')
+    arguments = parser.parse_args()
+
+    IO.lazyLoading = arguments.lazy
+
+    Benchmark(arguments.objects, arguments.samples, arguments.compression, arguments.repeats)
@@ -0,0 +1,104 @@
+"""
+    Compares the name lookups of PropertyStorage.getProperties(), which use the name index of the storage, with the walk
+    of the whole property tree PropertyAccessor.findItemIndex does for every access.
+
+    Synthetic property trees are generated with the given depth and number of properties per group. A sample of the leaf
+    properties, spread over the tree, is read and written by its (unique) name, and read through its parent group, as
+    SolverInpData and the property editor do. The index is built on the first access, its construction is reported
+    separately.
+
+    The bulk access of all the values is timed as well: getPropertyValues, and setPropertyValues of all of them, per
+    property.
+
+    Usage, e.g.:
+        python benchmarks/benchmarkPropertyStorage.py --depths 1 3 6 --breadths 4 8 --leaves 100
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import PythonQtMock as PythonQt
+sys.modules['PythonQt'] = PythonQt
+
+from CRIMSONCore.PropertyStorage import PropertyAccessor, PropertyStorage
+
+
+"""
+    Returns:
+        (properties, [(<group name>, <leaf name>)]) for a tree of groups nested depth times, each with breadth properties.
+        The group name of the top-level leaves, for depth 0, is None.
+        The groups alternate between the old and the new property syntax.
+"""
+def GeneratePropertyTree(depth, breadth, prefix='Property'):
+    properties = []
+    leaves = []
+    for i in range(breadth):
+        name = '{} {}'.format(prefix, i)
+        if depth == 0:
+            properties.append({name: float(i), "attributes": {"minimum": 0.0}})
+            leaves.append((None, name))
+            continue
+
+        (children, childLeaves) = GeneratePropertyTree(depth - 1, breadth, name)
+        if depth % 2 == 0:
+            properties.append({"name": name, "value": children})
+        else:
+            properties.append({name: children})
+        leaves.extend((name if groupName is None else groupName, leafName) for (groupName, leafName) in childLeaves)
+
+    return (properties, leaves)
+
+
+def _timeAccesses(getAccessor, leaves, repeats):
+    def accessAll():
+        accessor = getAccessor()
+        for (groupName, leafName) in leaves:
+            value = accessor[leafName]
+            accessor[leafName] = value
+            accessor[groupName][leafName] = value
+
+    return min(timeit.repeat(accessAll, number=1, repeat=repeats))
+
+
+def Benchmark(depths, breadths, repeats, maximumLeaves=100):
+    print('{:>6} {:>8} {:>10} {:>14} {:>16} {:>16} {:>9} {:>18} {:>18}'.format(
+        'depth', 'breadth', 'properties', 'index build', 'walk / access', 'index / access', 'speed up',
+        'get all / value', 'set all / value'))
+
+    for (depth, breadth) in itertools.product(depths, breadths):
+        storage = PropertyStorage()
+        (storage.properties, leaves) = GeneratePropertyTree(depth, breadth)
+        leaves = leaves[::max(1, len(leaves) // maximumLeaves)]
+        nProperties = sum(breadth ** level for level in range(1, depth + 2))
+
+        buildTime = min(timeit.repeat(lambda: (storage.propertyStructureChanged(), storage._getPropertyIndex()), number=1, repeat=repeats))
+
+        # Three accesses per leaf, see _timeAccesses
+        nAccesses = 3 * len(leaves)
+        walkTime = _timeAccesses(lambda: PropertyAccessor(storage.properties), leaves, repeats) / nAccesses
+        indexTime = _timeAccesses(storage.getProperties, leaves, repeats) / nAccesses
+
+        values = storage.getPropertyValues()
+        getAllTime = min(timeit.repeat(storage.getPropertyValues, number=1, repeat=repeats)) / len(values)
+        setAllTime = min(timeit.repeat(lambda: storage.setPropertyValues(values), number=1, repeat=repeats)) / len(values)
+
+        print('{:>6} {:>8} {:>10} {:>11.3f} ms {:>13.3f} us {:>13.3f} us {:>8.1f}x {:>15.3f} us {:>15.3f} us'.format(
+            depth, breadth, nProperties, buildTime * 1000, walkTime * 1e6, indexTime * 1e6, walkTime / indexTime,
+            getAllTime * 1e6, setAllTime * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the property name lookups of PropertyStorage.')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 3, 5], help='number of nested group levels')
+    parser.add_argument('--breadths', type=int, nargs='+', default=[2, 4, 8], help='number of properties per group')
+    parser.add_argument('--repeats', type=int, default=3, help='the fastest repeat is reported')
+    parser.add_argument('--leaves', type=int, default=100, help='maximum number of leaf properties accessed')
+    arguments = parser.parse_args()
+
+    Benchmark(arguments.depths, arguments.breadths, arguments.repeats, arguments.leaves)
@@ -0,0 +1,102 @@
+"""
+    Compares the fused reaction kernels (ForProcsCase/reactionKernels.py) with the sympy lambdas used before them.
+
+    Every species of the benchmark network is computed once with and once without the gradient, as the flowsolver does
+    in a timestep, and the results of the two are checked against each other.
+
+    Usage:
+        python benchmarks/benchmarkReactionKernels.py [number of nodes ...]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+import numpy
+import sympy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CRIMSONSolver', 'ScalarProblem', 'ForProcsCase'))
+import reactionKernels
+
+
+"""
+    A simplified coagulation cascade: each species activates the next one, and is inhibited by the last one.
+"""
+def _CreateNetwork(nSpecies=9):
+    scalarNames = ['c{}'.format(i) for i in range(nSpecies)]
+    coefficientNames = ['k{}'.format(i) for i in range(3 * nSpecies)]
+    symbols = dict((name, sympy.Symbol(name)) for name in scalarNames + coefficientNames)
+
+    c = [symbols[name] for name in scalarNames]
+    k = [symbols[name] for name in coefficientNames]
+
+    reactionExpressions = {}
+    for i in range(nSpecies):
+        activation = k[3 * i] * c[i - 1] * c[i] ** 2 / (k[3 * i + 1] + c[i]) if i > 0 else k[0]
+        inhibition = k[3 * i + 2] * c[i] * c[-1] * c[i - 1] ** 2
+        reactionExpressions[scalarNames[i]] = activation - inhibition
+
+    gradientExpressions = dict((name, reactionExpressions[name].diff(symbols[name])) for name in scalarNames)
+
+    coefficients = dict((name, 0.5 + 0.1 * i) for i, name in enumerate(coefficientNames))
+    return (scalarNames, coefficientNames, symbols, reactionExpressions, gradientExpressions, coefficients)
+
+
+def Benchmark(nNodes, repeats=5, simplification=None):
+    (scalarNames, coefficientNames, symbols, reactionExpressions, gradientExpressions, coefficients) = _CreateNetwork()
+    symbolNames = scalarNames + coefficientNames
+
+    random = numpy.random.RandomState(0)
+    values = dict((name, random.rand(nNodes)) for name in scalarNames)
+    values.update(coefficients)
+    symbolStateArray = [values[name] for name in symbolNames]
+
+    orderedSymbols = [symbols[name] for name in symbolNames]
+    reactionLambdas = dict((name, sympy.lambdify(orderedSymbols, reactionExpressions[name], 'numpy')) for name in scalarNames)
+    gradientLambdas = dict((name, sympy.lambdify(orderedSymbols, gradientExpressions[name], 'numpy')) for name in scalarNames)
+
+    kernels = reactionKernels.CompileReactionKernels(reactionKernels.GenerateReactionKernelsSource(
+        symbolNames, scalarNames, symbols, reactionExpressions, gradientExpressions, simplification))
+    kernelBuffers = reactionKernels.KernelBuffers(kernels['NumberOfBuffers'])
+
+    reactionTermOutput = numpy.empty(nNodes)
+
+    def runLambdas():
+        for name in scalarNames:
+            reactionTermOutput[...] = reactionLambdas[name](*symbolStateArray)
+            reactionTermOutput[...] = gradientLambdas[name](*symbolStateArray)
+
+    def runKernels():
+        buffers = kernelBuffers.get(reactionTermOutput.shape)
+        for name in scalarNames:
+            kernels['ReactionKernels'][name](reactionTermOutput, buffers, *symbolStateArray)
+            kernels['GradientKernels'][name](reactionTermOutput, buffers, *symbolStateArray)
+
+    reactionOuts = [numpy.empty(nNodes) for _ in scalarNames]
+    gradientOuts = [numpy.empty(nNodes) for _ in scalarNames]
+
+    def runAllSpeciesKernel():
+        kernels['allReactionsAndGradients'](reactionOuts, gradientOuts, kernelBuffers.get(reactionTermOutput.shape), *symbolStateArray)
+
+    runAllSpeciesKernel()
+    for scalarIndex, name in enumerate(scalarNames):
+        numpy.testing.assert_allclose(reactionOuts[scalarIndex], reactionLambdas[name](*symbolStateArray), rtol=1e-10, atol=1e-12)
+        numpy.testing.assert_allclose(gradientOuts[scalarIndex], gradientLambdas[name](*symbolStateArray), rtol=1e-10, atol=1e-12)
+
+    timings = []
+    for (name, function) in [('lambdas', runLambdas), ('fused kernels', runKernels), ('all species kernel', runAllSpeciesKernel)]:
+        function()
+        timings.append((name, min(timeit.repeat(function, number=1, repeat=repeats))))
+
+    print('{} nodes, simplification: {}'.format(nNodes, simplification))
+    for (name, seconds) in timings:
+        print('    {:<20} {:10.4f} ms ({:.2f}x)'.format(name, seconds * 1000, timings[0][1] / seconds))
+
+
+if __name__ == '__main__':
+    nodeCounts = [int(argument) for argument in sys.argv[1:]] or [1000, 100000, 1000000]
+    for nNodes in nodeCounts:
+        for simplification in [None, reactionKernels.Simplification.Horner]:
+            Benchmark(nNodes, simplification=simplification)
@@ -0,0 +1,238 @@
+"""
+    Measures the performance of ForProcsCase/scalarProblemSpecification.py outside the flowsolver.
+
+    A synthetic reaction network is generated with GenerateSpecification, as the UI would, and the specification runs
+    against the stand-in CRIMSONScalarProblem.py of this directory. Every configuration runs in its own process, so
+    that the start up is measured from scratch and the peak memory of each one is separate. The times reported are:
+        constructor: ScalarProblemSpecification(...), i.e. the set up of the reactions
+        getSymbolStateArray: per call
+        RHS, LHS: per call of computeScalarLHSorRHSVectorForOneSpecies without and with the gradient, over all species
+    and the memory:
+        peak: the largest traced allocation during the reaction term computations, beyond the state vectors
+              (python 3 only, numpy allocations are traced with tracemalloc)
+        maxrss: the peak resident memory of the process
+
+    The memoisation of the reaction terms is disabled unless --memoise is given, as the state vectors do not change.
+
+    Each evaluation is run with every block size given with --block-sizes (see CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE in
+    scalarProblemSpecification.py), 0 evaluating all the nodes at once.
+
+    Usage, e.g.:
+        python benchmarks/benchmarkScalarProblemSpecification.py --species 9 --coefficients 30 --degree 3 --nodes 1000 100000 1000000
+        python benchmarks/benchmarkScalarProblemSpecification.py --evaluation lambdas fused precompiled --nodes 50000000
+        python benchmarks/benchmarkScalarProblemSpecification.py --species 20 --nodes 10000000 --block-sizes 0 auto 4096 65536
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+_benchmarksDirectory = os.path.dirname(os.path.abspath(__file__))
+_scalarProblemDirectory = os.path.join(_benchmarksDirectory, '..', 'CRIMSONSolver', 'ScalarProblem')
+_forProcsCaseDirectory = os.path.join(_scalarProblemDirectory, 'ForProcsCase')
+
+# The scripts the flowsolver runs, see SolverStudy.writeSolverSetup
+_caseScriptNames = ['scalarProblemSpecification.py', 'reactionKernels.py', 'reactionProfiling.py', 'reactionSubstepping.py']
+
+# How the reaction terms are evaluated, as environment variables of the specification
+_evaluationModes = {
+    'lambdas': {'CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION': 'lambdas'},
+    'fused': {'CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION': 'fused'},
+    'precompiled': {'CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION': 'fused'},
+}
+
+
+"""
+    Generates a random mass action network.
+
+    Parameters:
+        nSpecies: number of scalars
+        nCoefficients: number of reaction coefficients
+        degree: maximum total degree of the terms of the reactions
+        termsPerReaction: number of terms of each reaction
+
+    Returns:
+        (scalar names, {<coefficient name>: <value>}, {<scalar name>: <reaction string>})
+"""
+def GenerateReactionNetwork(nSpecies, nCoefficients, degree, termsPerReaction=3, seed=0):
+    generator = random.Random(seed)
+
+    scalarNames = ['s{}'.format(i) for i in range(nSpecies)]
+    coefficientNames = ['k{}'.format(i) for i in range(nCoefficients)]
+    coefficients = dict((name, round(generator.uniform(0.1, 2.0), 3)) for name in coefficientNames)
+
+    reactionStrings = {}
+    for scalarName in scalarNames:
+        terms = []
+        for termIndex in range(termsPerReaction):
+            # The first term involves the species itself, so that its gradient is not trivially zero
+            powers = {}
+            for factorIndex in range(generator.randint(1, degree)):
+                factor = scalarName if termIndex == 0 and factorIndex == 0 else generator.choice(scalarNames)
+                powers[factor] = powers.get(factor, 0) + 1
+
+            monomial = '*'.join(name if power == 1 else '{}**{}'.format(name, power) for (name, power) in sorted(powers.items()))
+            sign = '-' if termIndex == 0 or generator.random() < 0.5 else '+'
+            terms.append('{} {}*{}'.format(sign, generator.choice(coefficientNames), monomial))
+
+        reactionStrings[scalarName] = ' '.join(terms).lstrip('+ ')
+
+    return (scalarNames, coefficients, reactionStrings)
+
+
+def _writeCase(caseDirectory, network, precompile):
+    sys.path.insert(0, _scalarProblemDirectory)
+    import GenerateScalarProblemSpecification
+
+    (scalarNames, coefficients, reactionStrings) = network
+    iterations = [{"Operation": scalarName, "Iterations": 1} for scalarName in scalarNames]
+    diffusionCoefficients = dict((scalarName, 1.0) for scalarName in scalarNames)
+
+    specification = GenerateScalarProblemSpecification.GenerateSpecification(1, iterations, diffusionCoefficients, scalarNames,
+                                                                             coefficients, reactionStrings)
+    with open(os.path.join(caseDirectory, 'generated_scalarProblemSpecification.py'), 'w') as specificationFile:
+        specificationFile.write(specification)
+
+    if(precompile):
+        reactionKernelsModule = GenerateScalarProblemSpecification.GenerateReactionKernels(specification)
+        with open(os.path.join(caseDirectory, 'generated_reactionKernels.py'), 'w') as reactionKernelsFile:
+            reactionKernelsFile.write(reactionKernelsModule)
+
+    for scriptName in _caseScriptNames:
+        shutil.copy2(os.path.join(_forProcsCaseDirectory, scriptName), caseDirectory)
+    shutil.copy2(os.path.join(_benchmarksDirectory, 'CRIMSONScalarProblem.py'), caseDirectory)
+
+
+def _timePerCall(function, repeats):
+    # The median of the calls, the first one is not included as it allocates buffers
+    function()
+    times = sorted(timeit.repeat(function, number=1, repeat=repeats))
+    return times[len(times) // 2]
+
+
+def _maxResidentMemoryInBytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+"""
+    Runs in the case directory, in a process of its own. Prints the results as json.
+"""
+def _runWorker(nNodes, repeats):
+    sys.path.insert(0, os.getcwd())
+
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    import numpy
+
+    startTime = timeit.default_timer()
+    import scalarProblemSpecification
+    specification = scalarProblemSpecification.ScalarProblemSpecification(0, 0)
+    constructorTime = timeit.default_timer() - startTime
+
+    nScalars = len(scalarProblemSpecification.ScalarIndexToName)
+    randomState = numpy.random.RandomState(0)
+    for scalarIndex in range(nScalars):
+        specification.scalarStateVectorsDictionary[scalarIndex + 1] = randomState.rand(nNodes)
+    reactionTermOutput = numpy.empty(nNodes)
+
+    getSymbolStateArrayTime = _timePerCall(specification.getSymbolStateArray, repeats)
+
+    if(tracemalloc is not None):
+        tracemalloc.start()
+
+    results = {}
+    for (name, computeGradient) in [('RHS', False), ('LHS', True)]:
+        times = []
+        for scalarIndex in range(nScalars):
+            times.append(_timePerCall(lambda: specification.computeScalarLHSorRHSVectorForOneSpecies(reactionTermOutput, scalarIndex + 1, computeGradient), repeats))
+        results[name] = sum(times) / len(times)
+
+    peakMemory = tracemalloc.get_traced_memory()[1] if tracemalloc is not None else None
+
+    print(json.dumps({
+        'usedPrecompiledKernels': scalarProblemSpecification.PrecompiledReactionKernels is not None,
+        'constructor': constructorTime,
+        'getSymbolStateArray': getSymbolStateArrayTime,
+        'RHS': results['RHS'],
+        'LHS': results['LHS'],
+        'peak': peakMemory,
+        'maxrss': _maxResidentMemoryInBytes(),
+    }))
+
+
+def _formatBytes(nBytes):
+    if(nBytes is None):
+        return '-'
+    return '{:.1f} MB'.format(nBytes / 1024.0 / 1024.0)
+
+
+def Benchmark(network, nodeCounts, evaluationModes, repeats, memoise, blockSizes=('auto',)):
+    print('{:<12} {:>8} {:>10} {:>14} {:>20} {:>14} {:>14} {:>10} {:>10}'.format(
+        'evaluation', 'block', 'nodes', 'constructor', 'getSymbolStateArray', 'RHS / call', 'LHS / call', 'peak', 'maxrss'))
+
+    for evaluationMode in evaluationModes:
+        caseDirectory = tempfile.mkdtemp(prefix='scalarProblemBenchmark')
+        try:
+            _writeCase(caseDirectory, network, precompile=(evaluationMode == 'precompiled'))
+
+            environment = dict(os.environ)
+            environment.update(_evaluationModes[evaluationMode])
+            environment['CRIMSON_SCALAR_PROBLEM_LOG_LEVEL'] = 'quiet'
+            environment['CRIMSON_SCALAR_PROBLEM_MEMOISE_REACTIONS'] = '1' if memoise else '0'
+
+            for (nNodes, blockSize) in itertools.product(nodeCounts, blockSizes):
+                environment['CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE'] = str(blockSize)
+
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker', str(nNodes), '--repeats', str(repeats)],
+                                                 cwd=caseDirectory, env=environment)
+                result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+                if(evaluationMode == 'precompiled' and not result['usedPrecompiledKernels']):
+                    print('Warning: the precompiled reaction kernels were not used')
+
+                print('{:<12} {:>8} {:>10} {:>11.1f} ms {:>17.3f} ms {:>11.3f} ms {:>11.3f} ms {:>10} {:>10}'.format(
+                    evaluationMode, blockSize, nNodes, result['constructor'] * 1000, result['getSymbolStateArray'] * 1000,
+                    result['RHS'] * 1000, result['LHS'] * 1000, _formatBytes(result['peak']), _formatBytes(result['maxrss'])))
+        finally:
+            shutil.rmtree(caseDirectory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks scalarProblemSpecification.py on a synthetic reaction network.')
+    parser.add_argument('--species', type=int, default=9, help='number of scalars')
+    parser.add_argument('--coefficients', type=int, default=30, help='number of reaction coefficients')
+    parser.add_argument('--degree', type=int, default=3, help='maximum total degree of the reaction terms')
+    parser.add_argument('--terms', type=int, default=3, help='number of terms of each reaction')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--evaluation', nargs='+', choices=sorted(_evaluationModes), default=['lambdas', 'fused', 'precompiled'])
+    parser.add_argument('--repeats', type=int, default=5, help='calls timed per measurement, the median is reported')
+    parser.add_argument('--memoise', action='store_true', help='leave the memoisation of the reaction terms enabled')
+    parser.add_argument('--block-sizes', nargs='+', default=['0', 'auto'], help='node block sizes to evaluate with, 0 for no blocks')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if(arguments.worker is not None):
+        _runWorker(arguments.worker, arguments.repeats)
+    else:
+        network = GenerateReactionNetwork(arguments.species, arguments.coefficients, arguments.degree, arguments.terms, arguments.seed)
+        Benchmark(network, arguments.nodes, arguments.evaluation, arguments.repeats, arguments.memoise, arguments.block_sizes)
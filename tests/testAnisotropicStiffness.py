@@ -0,0 +1,59 @@
+import PythonQtMock as PythonQt
+import sys
+
+sys.modules['PythonQt'] = PythonQt
+
+import unittest
+import numpy
+from CRIMSONSolver.SolverStudies.SolverStudy import SolverStudy
+
+
+class FaceInfoStub(object):
+    def __init__(self, nodeCoordinates, center, frame):
+        self.meshData = MeshDataStub(nodeCoordinates)
+        self.meshFaceInfoData = [0, 0, 0, 1, 2]
+        self.center = center
+        self.frame = frame
+
+    def getFaceCenter(self):
+        return self.center
+
+    def getVesselPathCoordinateFrame(self):
+        return self.frame
+
+
+class MeshDataStub(object):
+    def __init__(self, nodeCoordinates):
+        self.nodeCoordinates = nodeCoordinates
+
+    def getNodeCoordinates(self, nodeIndex):
+        return self.nodeCoordinates[nodeIndex]
+
+
+class TestAnisotropicStiffness(unittest.TestCase):
+    def test_batchedMatchesPerFace(self):
+        random = numpy.random.RandomState(0)
+        nFaces = 20
+
+        faceNodeCoordinates = random.rand(nFaces, 3, 3)
+        faceCenters = faceNodeCoordinates.sum(axis=1) / 3
+        coordinateFrames = numpy.zeros((nFaces, 9))
+        coordinateFrames[:, 0:3] = faceCenters + random.rand(nFaces, 3)
+        tangents = random.rand(nFaces, 3)
+        coordinateFrames[:, 3:6] = tangents / numpy.linalg.norm(tangents, axis=1)[:, numpy.newaxis]
+        youngsModulusAniso = random.rand(nFaces, 6) * 1e6
+
+        study = SolverStudy.__new__(SolverStudy)
+        stiffnessMatrices = study._computeAnisotropicStiffnessMatrices(faceNodeCoordinates, faceCenters,
+                                                                       coordinateFrames, youngsModulusAniso)
+
+        self.assertEqual(stiffnessMatrices.shape, (nFaces, 5, 5))
+
+        for i in xrange(nFaces):
+            faceInfo = FaceInfoStub(faceNodeCoordinates[i], faceCenters[i], coordinateFrames[i])
+            expected = study._computeAnisotropicStiffnessMatrix(faceInfo, youngsModulusAniso[i])
+            numpy.testing.assert_allclose(stiffnessMatrices[i], expected, rtol=1e-12, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import PythonQtMock as PythonQt
+import sys
+
+sys.modules['PythonQt'] = PythonQt
+
+import unittest
+import cPickle
+import imp
+import importlib
+import os
+import shutil
+import tempfile
+import numpy
+from CRIMSONCore.PropertyStorage import PropertyStorage
+
+# The module itself, as the attribute of the package can be the top level module IO loaded by CRIMSONCore/__init__.py
+IO = importlib.import_module('CRIMSONCore.IO')
+
+
+def getTopLevelIO():
+    if 'IO' in sys.modules:
+        return sys.modules['IO']
+
+    moduleFile, path, description = imp.find_module('IO', [os.path.dirname(IO.__file__)])
+    try:
+        return imp.load_module('IO', moduleFile, path, description)
+    finally:
+        moduleFile.close()
+
+
+class SceneObjectStub(PropertyStorage):
+    def __init__(self):
+        PropertyStorage.__init__(self)
+        self.properties = [{'Pressure': 1.0}]
+
+        self.waveform = numpy.random.RandomState(0).rand(10000, 2)
+        # Both attributes reference the same array
+        self.sharedWaveform = self.waveform
+        self.fortranTable = numpy.asfortranarray(numpy.random.RandomState(1).rand(50, 60))
+        self.stridedView = self.fortranTable[::2, 1]
+        self.smallArray = numpy.arange(3)
+        self.objectArray = numpy.array([1, 'a'], dtype=object)
+        self.text = 'x' * 10000
+
+
+class LazySceneObjectStub(PropertyStorage):
+    _lazyAttributes = ['netlistSurfacesDat', 'table']
+
+    def __init__(self):
+        PropertyStorage.__init__(self)
+        self.netlistSurfacesDat = 'x' * IO.minimumSidecarBytes
+        self.table = numpy.random.RandomState(0).rand(IO.minimumSidecarBytes)
+
+
+class TestIO(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.directory, 'object.dat')
+        self.lazyLoading = IO.lazyLoading
+
+    def tearDown(self):
+        IO.lazyLoading = self.lazyLoading
+        shutil.rmtree(self.directory)
+
+    def assertLoadedEqual(self, obj, loadedObj):
+        self.assertEqual(loadedObj.getProperties()['Pressure'], 1.0)
+        for name in ['waveform', 'sharedWaveform', 'fortranTable', 'stridedView', 'smallArray', 'objectArray']:
+            self.assertEqual(getattr(loadedObj, name).dtype, getattr(obj, name).dtype)
+            numpy.testing.assert_array_equal(getattr(loadedObj, name), getattr(obj, name))
+        self.assertEqual(loadedObj.text, obj.text)
+
+    def test_loadLegacyFile(self):
+        # The files saved before the binary format are protocol 0 pickles
+        obj = SceneObjectStub()
+        with open(self.fileName, 'wb') as f:
+            cPickle.dump(obj, f, 0)
+
+        self.assertLoadedEqual(obj, IO.loadFromFile(self.fileName))
+
+    def test_roundTrip(self):
+        obj = SceneObjectStub()
+        IO.saveToFile(obj, self.fileName, 0)
+        with open(self.fileName, 'rb') as f:
+            self.assertEqual(f.read(len(IO._magic)), IO._magic)
+
+        loadedObj = IO.loadFromFile(self.fileName)
+        self.assertLoadedEqual(obj, loadedObj)
+
+        # The shared array is stored once, and loaded as one array
+        self.assertIs(loadedObj.sharedWaveform, loadedObj.waveform)
+        self.assertTrue(loadedObj.waveform.flags.writeable)
+        loadedObj.waveform[0, 0] = 5.0
+        self.assertEqual(loadedObj.sharedWaveform[0, 0], 5.0)
+
+    def test_compressedRoundTrip(self):
+        obj = SceneObjectStub()
+        IO.saveToFile(obj, self.fileName, 0)
+        uncompressedSize = os.path.getsize(self.fileName)
+
+        IO.saveToFile(obj, self.fileName, 6)
+        self.assertLess(os.path.getsize(self.fileName), uncompressedSize)
+
+        loadedObj = IO.loadFromFile(self.fileName)
+        self.assertLoadedEqual(obj, loadedObj)
+        self.assertIs(loadedObj.sharedWaveform, loadedObj.waveform)
+        self.assertTrue(loadedObj.waveform.flags.writeable)
+
+    def test_newerFormatVersionIsRejected(self):
+        IO.saveToFile(SceneObjectStub(), self.fileName)
+
+        with open(self.fileName, 'r+b') as f:
+            magic, formatVersion, level, objectPickleLength, tablesPickleLength = IO._header.unpack(f.read(IO._header.size))
+            f.seek(0)
+            f.write(IO._header.pack(magic, IO._formatVersion + 1, level, objectPickleLength, tablesPickleLength))
+
+        with self.assertRaises(RuntimeError):
+            IO.loadFromFile(self.fileName)
+
+    def assertLazyAttributesLoaded(self, obj, loadedObj):
+        # The lazy attributes are only read on their first access
+        self.assertNotIn('netlistSurfacesDat', loadedObj.__dict__)
+        self.assertNotIn('table', loadedObj.__dict__)
+
+        self.assertIsInstance(loadedObj.netlistSurfacesDat, str)
+        self.assertEqual(loadedObj.netlistSurfacesDat, obj.netlistSurfacesDat)
+        numpy.testing.assert_array_equal(loadedObj.table, obj.table)
+        self.assertTrue(loadedObj.table.flags.writeable)
+
+    def test_lazyAttributes(self):
+        IO.lazyLoading = True
+        for level in [0, 6]:
+            obj = LazySceneObjectStub()
+            IO.saveToFile(obj, self.fileName, level)
+            self.assertLazyAttributesLoaded(obj, IO.loadFromFile(self.fileName))
+
+    def test_lazyAttributesWithTopLevelModule(self):
+        # CRIMSONCore/__init__.py also loads the module as the top level module IO, with classes of its own
+        topLevelIO = getTopLevelIO()
+        self.assertIsNot(topLevelIO.LazyPayload, IO.LazyPayload)
+        IO.lazyLoading = True
+        topLevelLazyLoading = topLevelIO.lazyLoading
+        topLevelIO.lazyLoading = True
+        self.addCleanup(setattr, topLevelIO, 'lazyLoading', topLevelLazyLoading)
+
+        for (saveModule, loadModule) in [(IO, topLevelIO), (topLevelIO, IO), (topLevelIO, topLevelIO)]:
+            obj = LazySceneObjectStub()
+            saveModule.saveToFile(obj, self.fileName)
+            self.assertLazyAttributesLoaded(obj, loadModule.loadFromFile(self.fileName))
+
+    def test_lazyAttributesOfReplacedFile(self):
+        IO.lazyLoading = True
+        obj = LazySceneObjectStub()
+        IO.saveToFile(obj, self.fileName)
+        loadedObj = IO.loadFromFile(self.fileName)
+
+        # Saving the loaded object over its file reads its lazy attributes first
+        IO.saveToFile(loadedObj, self.fileName)
+        self.assertIn('netlistSurfacesDat', loadedObj.__dict__)
+        self.assertLazyAttributesLoaded(obj, IO.loadFromFile(self.fileName))
+
+        # The entries are not read from another file saved in the meantime
+        loadedObj = IO.loadFromFile(self.fileName)
+        IO.saveToFile(SceneObjectStub(), self.fileName)
+        with self.assertRaises(RuntimeError):
+            loadedObj.netlistSurfacesDat
+
+    def test_removedFile(self):
+        # As the scene files, which are extracted to a temporary directory removed once the scene is loaded
+        obj = LazySceneObjectStub()
+        IO.saveToFile(obj, self.fileName)
+        loadedObj = IO.loadFromFile(self.fileName)
+        os.remove(self.fileName)
+
+        self.assertEqual(loadedObj.netlistSurfacesDat, obj.netlistSurfacesDat)
+        IO.saveToFile(loadedObj, self.fileName)
+        savedObj = IO.loadFromFile(self.fileName)
+        self.assertEqual(savedObj.netlistSurfacesDat, obj.netlistSurfacesDat)
+        numpy.testing.assert_array_equal(savedObj.table, obj.table)
+
+    def test_removedFileWithLazyLoading(self):
+        IO.lazyLoading = True
+        obj = LazySceneObjectStub()
+        IO.saveToFile(obj, self.fileName)
+        loadedObj = IO.loadFromFile(self.fileName)
+        os.remove(self.fileName)
+
+        with self.assertRaises(IOError):
+            loadedObj.netlistSurfacesDat
+
+        # The attributes which cannot be read are not dropped by saving the object, every save fails
+        otherFileName = os.path.join(self.directory, 'other.dat')
+        for _ in range(2):
+            with self.assertRaises(IOError):
+                IO.saveToFile(loadedObj, otherFileName)
+        self.assertIn('netlistSurfacesDat', loadedObj._lazyPayloads)
+        self.assertIn('table', loadedObj._lazyPayloads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,8 @@ sys.modules['PythonQt'] = PythonQt
 
 import unittest
 from CRIMSONCore.PropertyStorage import PropertyStorage
+from CRIMSONSolver.ScalarProblem.Scalar import Scalar
+from CRIMSONSolver.SolverParameters.SolverParameters3D import SolverParameters3D
 
 
 class TestPropertyStorage(unittest.TestCase):
@@ -40,3 +42,121 @@ class TestPropertyStorage(unittest.TestCase):
 
         with self.assertRaises(TypeError):
             storage.getProperties()['b'] = 1.0
+
+
+    def testAmbiguousNamesAndStructureChanges(self):
+        storage = PropertyStorage()
+        storage.properties = [
+            {'a': [
+                {'b': 1}
+               ]
+             },
+            {'B': 2}]
+
+        # The first match of a depth-first walk is used, case-insensitively
+        self.assertEqual(storage.getProperties()['b'], 1)
+        self.assertEqual(storage.getProperties()['A']['B'], 1)
+
+        storage.properties.insert(0, {'b': 3})
+        self.assertEqual(storage.getProperties()['b'], 3)
+
+        storage.properties[1]['a'].append({'c': 4})
+        self.assertEqual(storage.getProperties()['c'], 4)
+
+        storage.properties[1]['a'][0] = {'b': 5}
+        storage.propertyStructureChanged()
+        self.assertEqual(storage.getProperties()['a']['b'], 5)
+
+    def testBulkAccess(self):
+        storage = PropertyStorage()
+        storage.properties = [
+            {"name": 'a',
+             "value": [
+                 {'b': 1},
+                 {'c': 'text'}
+                ]
+             },
+            {'b': 2.0}]
+
+        self.assertEqual(storage.getPropertyValues(), {'a/b': 1, 'a/c': 'text', 'b': 2.0})
+
+        storage.setPropertyValues({'A/B': 3, 'b': 4.0})
+        self.assertEqual(storage.getProperties()['a']['b'], 3)
+        self.assertEqual(storage.properties[1]['b'], 4.0)
+
+        # Nothing is set if any of the values is rejected
+        with self.assertRaises(TypeError):
+            storage.setPropertyValues({'a/b': 5, 'b': 5})
+        with self.assertRaises(TypeError):
+            storage.setPropertyValues({'a': 5})
+        with self.assertRaises(KeyError):
+            storage.setPropertyValues({'a/b': 5, 'c': 'text'})
+        self.assertEqual(storage.getProperties()['a']['b'], 3)
+
+    def testChangeTracking(self):
+        storage = PropertyStorage()
+        storage.properties = [
+            {'a': [
+                 {'b': 1}
+                ]
+             },
+            {'c': 2.0}]
+
+        changes = []
+        storage.subscribeToChanges(lambda changedStorage, path, revision: changes.append(path))
+
+        revision = storage.getRevision()
+        self.assertFalse(storage.hasChangedSince(revision))
+
+        # Setting the same value is not a change
+        storage.getProperties()['b'] = 1
+        self.assertFalse(storage.hasChangedSince(revision))
+
+        storage.getProperties()['b'] = 2
+        self.assertTrue(storage.hasChangedSince(revision))
+        self.assertEqual(storage.getChangedPathsSince(revision), ['a/b'])
+
+        secondRevision = storage.getRevision()
+        storage.setPropertyValues({'c': 3.0})
+        storage.markChanged('faceIdentifiers')
+        self.assertEqual(storage.getChangedPathsSince(secondRevision), ['faceIdentifiers', 'c'])
+        self.assertEqual(storage.getChangedPathsSince(revision), ['faceIdentifiers', 'c', 'a/b'])
+        self.assertEqual(changes, ['a/b', 'c', 'faceIdentifiers'])
+
+    def testChangeTrackingOfBulkAccess(self):
+        # Each change is reported with the path it was set by
+        class RecordingPropertyStorage(PropertyStorage):
+            def propertyValueChanged(self, propertyList, index, itemName):
+                self.changedItems.append((propertyList[index].keys()[0], itemName))
+                PropertyStorage.propertyValueChanged(self, propertyList, index, itemName)
+
+        storage = RecordingPropertyStorage()
+        storage.changedItems = []
+        storage.properties = [
+            {'a': [
+                 {'b': 1},
+                 {'d': 'x'}
+                ]
+             },
+            {'c': 2.0}]
+
+        revision = storage.getRevision()
+        storage.setPropertyValues({'a/b': 2, 'c': 3.0, 'a/d': 'x'})
+        self.assertEqual(sorted(storage.changedItems), [('b', 'a/b'), ('c', 'c')])
+        self.assertEqual(sorted(storage.getChangedPathsSince(revision)), ['a/b', 'c'])
+
+    def testChangeTrackingOfSetters(self):
+        # The setters called by the UI for the data which is not in the property tree
+        scalar = Scalar()
+        revision = scalar.getRevision()
+        scalar.setScalarSymbol(u'A')
+        scalar.setReactionString(u'-k*A')
+        self.assertEqual(scalar.getChangedPathsSince(revision), ['reactionString', 'scalarSymbol'])
+
+        solverParameters = SolverParameters3D()
+        revision = solverParameters.getRevision()
+        solverParameters.setIterations([{'Operation': 'Flow', 'Iterations': 1}])
+        solverParameters.setFluidIterationCount(3)
+        self.assertEqual(solverParameters.getFluidIterationCount(), 3)
+        self.assertEqual(solverParameters.getChangedPathsSince(revision),
+                         ['Simulation parameters/Step construction', 'Iterations'])
@@ -0,0 +1,170 @@
+import PythonQtMock as PythonQt
+import sys
+
+sys.modules['PythonQt'] = PythonQt
+
+import unittest
+import os
+import numpy
+import sympy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CRIMSONSolver', 'ScalarProblem', 'ForProcsCase'))
+import reactionKernels
+import reactionSubstepping
+from reactionSubstepping import Method, ReactionSubstepper, ReactionTimestepTracker
+
+
+class TestReactionSubstepper(unittest.TestCase):
+    """
+        The linear decay chain A -> B -> (nothing), dA/dt = -k*A, dB/dt = k*A - m*B, whose solution is known.
+    """
+    k = 2.0
+    m = 0.5
+
+    @classmethod
+    def setUpClass(cls):
+        A, B, k, m = sympy.symbols('A B k m')
+        symbols = {'A': A, 'B': B, 'k': k, 'm': m}
+        reactions = {'A': -k * A, 'B': k * A - m * B}
+        gradients = {'A': -k, 'B': -m}
+
+        cls.symbolNames = ['A', 'B', 'k', 'm']
+        cls.kernels = reactionKernels.CompileReactionKernels(
+            reactionKernels.GenerateReactionKernelsSource(cls.symbolNames, ['A', 'B'], symbols, reactions, gradients))
+
+    def createSubstepper(self, method, numberOfSubsteps, k=None):
+        coefficients = {'k': self.k if k is None else k, 'm': self.m}
+        return ReactionSubstepper(self.kernels, self.symbolNames, ['A', 'B'], coefficients, method, numberOfSubsteps)
+
+    def initialConcentrations(self):
+        return numpy.array([numpy.linspace(1.0, 2.0, 5), numpy.linspace(0.0, 1.0, 5)])
+
+    def exactConcentrations(self, concentrations, t):
+        A0, B0 = concentrations
+        A = A0 * numpy.exp(-self.k * t)
+        B = B0 * numpy.exp(-self.m * t) + A0 * self.k / (self.m - self.k) * (numpy.exp(-self.k * t) - numpy.exp(-self.m * t))
+        return numpy.array([A, B])
+
+    def integrationError(self, method, numberOfSubsteps, timestepSize=1.0):
+        concentrations = self.initialConcentrations()
+        integrated = self.createSubstepper(method, numberOfSubsteps).integrate(concentrations, timestepSize)
+        return numpy.max(numpy.abs(integrated - self.exactConcentrations(concentrations, timestepSize)))
+
+    def test_linearlyImplicitEuler(self):
+        # On a linear problem, every sub-step of A is exactly a division by 1 + h*k
+        concentrations = self.initialConcentrations()
+        integrated = self.createSubstepper(Method.LinearlyImplicitEuler, 8).integrate(concentrations, 1.0)
+        numpy.testing.assert_allclose(integrated[0], concentrations[0] / (1.0 + self.k / 8) ** 8, rtol=1e-12)
+
+        # First order
+        errors = [self.integrationError(Method.LinearlyImplicitEuler, n) for n in [32, 64, 128]]
+        self.assertLess(errors[2], 1e-2)
+        for (error, halvedError) in zip(errors, errors[1:]):
+            self.assertAlmostEqual(error / halvedError, 2.0, delta=0.1)
+
+    def test_rosenbrock2(self):
+        # Second order
+        errors = [self.integrationError(Method.Rosenbrock2, n) for n in [64, 128, 256]]
+        self.assertLess(errors[2], 1e-4)
+        for (error, halvedError) in zip(errors, errors[1:]):
+            self.assertAlmostEqual(error / halvedError, 4.0, delta=0.25)
+
+    def test_stiffDecay(self):
+        # Both methods are L-stable: a decay much faster than the timestep is damped in a single sub-step
+        concentrations = self.initialConcentrations()
+        for method in [Method.LinearlyImplicitEuler, Method.Rosenbrock2]:
+            substepper = self.createSubstepper(method, 1, k=1e8)
+            integrated = substepper.integrate(concentrations, 1.0)
+            self.assertTrue(numpy.all(numpy.abs(integrated[0]) < 1e-6 * concentrations[0]), method)
+
+            sourceTerms = substepper.computeEquivalentSourceTerms(concentrations, 1.0)
+            numpy.testing.assert_allclose(sourceTerms[0], -concentrations[0], rtol=1e-6)
+
+    def test_chunks(self):
+        concentrations = numpy.random.RandomState(0).rand(2, 100)
+        expected = self.createSubstepper(Method.Rosenbrock2, 4).integrate(concentrations, 1.0)
+
+        nodesPerChunk = reactionSubstepping.nodesPerChunk
+        reactionSubstepping.nodesPerChunk = 7
+        try:
+            integrated = self.createSubstepper(Method.Rosenbrock2, 4).integrate(concentrations, 1.0)
+        finally:
+            reactionSubstepping.nodesPerChunk = nodesPerChunk
+
+        numpy.testing.assert_allclose(integrated, expected, rtol=1e-14)
+
+    def test_invalidSettings(self):
+        with self.assertRaises(RuntimeError):
+            self.createSubstepper('unknown', 4)
+        with self.assertRaises(RuntimeError):
+            self.createSubstepper(Method.Rosenbrock2, 0)
+
+
+class TestReactionTimestepTracker(unittest.TestCase):
+    # The iterations a x2, b x1
+    requestSequence = ['a', 'a', 'b']
+
+    def countRequests(self, tracker, requests):
+        """
+            Returns, for every request, the timestep after it and whether it started a timestep
+        """
+        return [(tracker.countRequest(scalarName), tracker.timestep) for scalarName in requests]
+
+    def test_expectedRequests(self):
+        tracker = ReactionTimestepTracker(self.requestSequence, 10)
+        self.assertEqual(self.countRequests(tracker, ['a', 'a', 'b'] * 3),
+                         [(True, 10), (False, 10), (False, 10),
+                          (True, 11), (False, 11), (False, 11),
+                          (True, 12), (False, 12), (False, 12)])
+        self.assertEqual(tracker.numberOfUnexpectedRequests, 0)
+
+    def test_repeatedRequests(self):
+        # An extra solve iteration of a species stays in the timestep
+        tracker = ReactionTimestepTracker(self.requestSequence, 0)
+        self.assertEqual(self.countRequests(tracker, ['a', 'a', 'b', 'b', 'a', 'a', 'a', 'b']),
+                         [(True, 0), (False, 0), (False, 0), (False, 0),
+                          (True, 1), (False, 1), (False, 1), (False, 1)])
+        self.assertEqual(tracker.numberOfUnexpectedRequests, 2)
+
+    def test_skippedRequests(self):
+        # A solve stopped early: the tracker skips to the species requested
+        tracker = ReactionTimestepTracker(self.requestSequence, 0)
+        self.assertEqual(self.countRequests(tracker, ['a', 'b', 'a', 'b', 'b']),
+                         [(True, 0), (False, 0), (True, 1), (False, 1), (False, 1)])
+        self.assertEqual(tracker.numberOfUnexpectedRequests, 3)
+
+    def test_earlierSpeciesStartsTimestep(self):
+        tracker = ReactionTimestepTracker(['a', 'b', 'c'], 0)
+        self.assertEqual(self.countRequests(tracker, ['a', 'b', 'a', 'c', 'b']),
+                         [(True, 0), (False, 0), (True, 1), (False, 1), (True, 2)])
+
+    def test_unknownSpecies(self):
+        tracker = ReactionTimestepTracker(self.requestSequence, 0)
+        self.assertEqual(self.countRequests(tracker, ['x', 'a', 'x', 'b', 'a']),
+                         [(True, 0), (False, 0), (False, 0), (False, 0), (True, 1)])
+
+    def test_emptySequence(self):
+        tracker = ReactionTimestepTracker([], 0)
+        self.assertEqual(self.countRequests(tracker, ['a', 'a']), [(False, 0), (False, 0)])
+
+    def test_beginTimestep(self):
+        # Once the flowsolver begins the timesteps, the order of the requests does not matter
+        tracker = ReactionTimestepTracker(self.requestSequence, 5)
+        results = []
+        for requests in [['a', 'a', 'b'], ['a'], ['b', 'a', 'a', 'b', 'b']]:
+            tracker.beginTimestep()
+            results.append(self.countRequests(tracker, requests))
+
+        self.assertEqual(results, [[(True, 5), (False, 5), (False, 5)],
+                                   [(True, 6)],
+                                   [(True, 7), (False, 7), (False, 7), (False, 7), (False, 7)]])
+        self.assertEqual(tracker.numberOfUnexpectedRequests, 0)
+
+        # A timestep without any request is still counted
+        tracker.beginTimestep()
+        tracker.beginTimestep()
+        self.assertEqual(self.countRequests(tracker, ['a']), [(True, 9)])
+
+
+if __name__ == '__main__':
+    unittest.main()
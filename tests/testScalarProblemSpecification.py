@@ -0,0 +1,298 @@
+import PythonQtMock as PythonQt
+import sys
+
+sys.modules['PythonQt'] = PythonQt
+
+import unittest
+import importlib
+import os
+import shutil
+import tempfile
+import numpy
+
+_scalarProblemDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CRIMSONSolver', 'ScalarProblem')
+_forProcsCaseDirectory = os.path.join(_scalarProblemDirectory, 'ForProcsCase')
+_benchmarksDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+
+sys.path.insert(0, _scalarProblemDirectory)
+import GenerateScalarProblemSpecification
+
+_caseScriptNames = ['scalarProblemSpecification.py', 'reactionKernels.py', 'reactionProfiling.py', 'reactionSubstepping.py']
+
+# Imported from the case directory, each case gets modules of its own
+_caseModuleNames = ['scalarProblemSpecification', 'generated_scalarProblemSpecification', 'generated_reactionKernels', 'CRIMSONScalarProblem']
+
+# The evaluation settings of scalarProblemSpecification.py, read from the environment at import
+_settingNames = ['CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION', 'CRIMSON_SCALAR_PROBLEM_MEMOISE_REACTIONS',
+                 'CRIMSON_SCALAR_PROBLEM_ACTIVE_REGION_TOLERANCE', 'CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE',
+                 'CRIMSON_SCALAR_PROBLEM_PROFILE', 'CRIMSON_SCALAR_PROBLEM_LOG_LEVEL']
+
+
+class TestScalarProblemSpecification(unittest.TestCase):
+    """
+        Every evaluation path of the reaction terms, their gradients and their Jacobian against the sympy lambdas.
+
+        The network has a reaction which does not depend on its own species, whose gradient is identically zero, and a
+        constant term.
+    """
+    scalarNames = ['A', 'B', 'C', 'D']
+    coefficients = {'k1': 1.5, 'k2': 0.25, 'k3': 0.75, 'k4': 0.125}
+    reactionStrings = {'A': '-k1*A*B + k2*C',
+                       'B': '-k1*A*B + k2*C - k3*B**2',
+                       'C': 'k1*A*B - k2*C/(1 + A)',
+                       'D': 'k4 + k3*B**2'}
+
+    numberOfNodes = 1000
+
+    def setUp(self):
+        self.directories = []
+        # Python 2 clears the globals of a module once it is dropped, the specifications need theirs
+        self.modules = []
+        self.caseDirectory = None
+        self.states = numpy.random.RandomState(0).uniform(0.5, 2.0, (len(self.scalarNames), self.numberOfNodes))
+        self.reference = self.createSpecification(CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION='lambdas')
+        self.assertIsNone(self.reference._reactionKernels)
+
+    def tearDown(self):
+        if self.caseDirectory is not None:
+            sys.path.remove(self.caseDirectory)
+        for moduleName in _caseModuleNames:
+            sys.modules.pop(moduleName, None)
+        for directory in self.directories:
+            shutil.rmtree(directory)
+
+    def writeCase(self, precompile=False, editSpecification=False):
+        caseDirectory = tempfile.mkdtemp()
+        self.directories.append(caseDirectory)
+
+        iterations = [{"Operation": scalarName, "Iterations": 1} for scalarName in self.scalarNames]
+        diffusionCoefficients = dict((scalarName, 1.0) for scalarName in self.scalarNames)
+        specification = GenerateScalarProblemSpecification.GenerateSpecification(1, iterations, diffusionCoefficients, self.scalarNames,
+                                                                                 self.coefficients, self.reactionStrings)
+
+        if precompile:
+            reactionKernelsModule = GenerateScalarProblemSpecification.GenerateReactionKernels(specification)
+            self.assertIsNotNone(reactionKernelsModule)
+            with open(os.path.join(caseDirectory, 'generated_reactionKernels.py'), 'w') as reactionKernelsFile:
+                reactionKernelsFile.write(reactionKernelsModule)
+
+        if editSpecification:
+            # As edited by hand after the kernels were generated
+            specification += '\n# Edited\n'
+
+        with open(os.path.join(caseDirectory, 'generated_scalarProblemSpecification.py'), 'w') as specificationFile:
+            specificationFile.write(specification)
+
+        for scriptName in _caseScriptNames:
+            shutil.copy2(os.path.join(_forProcsCaseDirectory, scriptName), caseDirectory)
+        shutil.copy2(os.path.join(_benchmarksDirectory, 'CRIMSONScalarProblem.py'), caseDirectory)
+
+        return caseDirectory
+
+    def importCase(self, caseDirectory, settings):
+        """
+            Imports scalarProblemSpecification.py of the case, with the settings as its environment
+        """
+        environment = dict((name, os.environ.get(name)) for name in _settingNames)
+        os.environ['CRIMSON_SCALAR_PROBLEM_LOG_LEVEL'] = 'quiet'
+        for name in _settingNames:
+            if name in settings:
+                os.environ[name] = settings[name]
+            elif name != 'CRIMSON_SCALAR_PROBLEM_LOG_LEVEL':
+                os.environ.pop(name, None)
+
+        for moduleName in _caseModuleNames:
+            sys.modules.pop(moduleName, None)
+
+        # The files of the cases are written within the same second, their bytecode could be mistaken for each other
+        dontWriteBytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = True
+        # The specification imports generated_scalarProblemSpecification.py when it first needs the sympy expressions
+        if self.caseDirectory is not None:
+            sys.path.remove(self.caseDirectory)
+        self.caseDirectory = caseDirectory
+        sys.path.insert(0, caseDirectory)
+        try:
+            return importlib.import_module('scalarProblemSpecification')
+        finally:
+            sys.dont_write_bytecode = dontWriteBytecode
+            for name in _settingNames:
+                if environment[name] is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = environment[name]
+
+    def createSpecification(self, precompile=False, editSpecification=False, **settings):
+        self.module = self.importCase(self.writeCase(precompile, editSpecification), settings)
+        self.modules.append(self.module)
+
+        specification = self.module.ScalarProblemSpecification(0, 0)
+        # The requests of the tests do not follow the iterations
+        specification.beginReactionTimestep()
+        self.setStates(specification, self.states)
+        return specification
+
+    def setStates(self, specification, states):
+        for scalarIndex in range(len(self.scalarNames)):
+            specification.scalarStateVectorsDictionary[scalarIndex + 1] = states[scalarIndex].copy()
+
+    def compute(self, specification):
+        """
+            Returns the reaction terms, their gradients, and the Jacobian entries by their (row, column) scalar numbers
+        """
+        reactions = []
+        gradients = []
+        for scalarIndex in range(len(self.scalarNames)):
+            for (computeGradient, results) in [(False, reactions), (True, gradients)]:
+                output = numpy.empty(self.numberOfNodes)
+                specification.computeScalarLHSorRHSVectorForOneSpecies(output, scalarIndex + 1, computeGradient)
+                results.append(output)
+
+        jacobian = specification.computeReactionJacobian()
+        entries = dict((entry, jacobian[entryIndex].copy()) for (entryIndex, entry) in enumerate(specification.getReactionJacobianStructure()))
+
+        return (numpy.array(reactions), numpy.array(gradients), entries)
+
+    def assertMatchesReference(self, specification):
+        self.setStates(self.reference, [specification.scalarStateVectorsDictionary[scalarIndex + 1] for scalarIndex in range(len(self.scalarNames))])
+        (expectedReactions, expectedGradients, expectedEntries) = self.compute(self.reference)
+        (reactions, gradients, entries) = self.compute(specification)
+
+        numpy.testing.assert_allclose(reactions, expectedReactions, rtol=1e-12, atol=1e-14)
+        numpy.testing.assert_allclose(gradients, expectedGradients, rtol=1e-12, atol=1e-14)
+        self.assertEqual(sorted(entries), sorted(expectedEntries))
+        for entry in expectedEntries:
+            numpy.testing.assert_allclose(entries[entry], expectedEntries[entry], rtol=1e-12, atol=1e-14, err_msg=str(entry))
+
+        # The gradients are the diagonal of the Jacobian
+        for scalarIndex in range(len(self.scalarNames)):
+            entryIndex = specification.getReactionJacobianEntryIndex(scalarIndex + 1, scalarIndex + 1)
+            if entryIndex is None:
+                numpy.testing.assert_array_equal(gradients[scalarIndex], 0.0)
+            else:
+                numpy.testing.assert_allclose(entries[(scalarIndex + 1, scalarIndex + 1)], gradients[scalarIndex], rtol=1e-12, atol=1e-14)
+
+    def perturbStates(self, specification, nodes, seed=1):
+        perturbed = numpy.zeros(self.numberOfNodes, dtype=bool)
+        perturbed[nodes] = True
+        for scalarIndex in range(len(self.scalarNames)):
+            stateVector = specification.scalarStateVectorsDictionary[scalarIndex + 1]
+            stateVector[perturbed] *= numpy.random.RandomState(seed + scalarIndex).uniform(0.5, 1.5, numpy.count_nonzero(perturbed))
+
+    def test_structure(self):
+        self.assertEqual(self.reference.getReactionJacobianStructure(),
+                         [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3), (3, 1), (3, 2), (3, 3), (4, 2)])
+        self.assertIsNone(self.reference.getReactionJacobianEntryIndex(4, 4))
+
+    def test_fusedKernels(self):
+        specification = self.createSpecification()
+        self.assertIsNone(self.module.PrecompiledReactionKernels)
+        self.assertIsNotNone(specification._reactionKernels)
+
+        self.assertMatchesReference(specification)
+
+    def test_precompiledKernels(self):
+        specification = self.createSpecification(precompile=True)
+        self.assertIsNotNone(self.module.PrecompiledReactionKernels)
+        self.assertIsNone(specification._symbolLambdas)
+
+        self.assertMatchesReference(specification)
+
+        # The lambdas are still set up for what the kernels cannot compute
+        output = numpy.empty(self.numberOfNodes)
+        self.setStates(specification, [stateVector[0] for stateVector in self.states])
+        specification.computeScalarLHSorRHSVectorForOneSpecies(output, 3, False)
+        self.assertEqual(specification._evaluationPath, 'lambda')
+        self.setStates(self.reference, [stateVector[0] for stateVector in self.states])
+        expected = numpy.empty(self.numberOfNodes)
+        self.reference.computeScalarLHSorRHSVectorForOneSpecies(expected, 3, False)
+        numpy.testing.assert_allclose(output, expected, rtol=1e-12)
+
+    def test_stalePrecompiledKernels(self):
+        # The kernels are generated at start up instead
+        specification = self.createSpecification(precompile=True, editSpecification=True)
+        self.assertIsNone(self.module.PrecompiledReactionKernels)
+        self.assertIsNotNone(specification._reactionKernels)
+
+        self.assertMatchesReference(specification)
+
+    def test_blocks(self):
+        for precompile in [False, True]:
+            # The last block is smaller than the others
+            specification = self.createSpecification(precompile, CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE='64')
+            self.assertEqual(self.module.reactionEvaluationBlockSize, 64)
+
+            self.assertMatchesReference(specification)
+
+        specification = self.createSpecification(CRIMSON_SCALAR_PROBLEM_REACTION_EVALUATION='lambdas', CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE='64')
+        self.assertMatchesReference(specification)
+
+    def test_memoisation(self):
+        for precompile in [False, True]:
+            specification = self.createSpecification(precompile, CRIMSON_SCALAR_PROBLEM_MEMOISE_REACTIONS='1')
+            self.assertMatchesReference(specification)
+
+            # Nothing has changed
+            output = numpy.empty(self.numberOfNodes)
+            specification.computeScalarLHSorRHSVectorForOneSpecies(output, 1, False)
+            self.assertEqual(specification._evaluationPath, 'memoised')
+            specification.computeReactionJacobian()
+            self.assertEqual(specification._evaluationPath, 'memoised')
+
+            # The state vectors are changed in place
+            self.perturbStates(specification, slice(None, None, 3))
+            self.assertMatchesReference(specification)
+
+            # D changes none of the reaction terms
+            specification.scalarStateVectorsDictionary[4] *= 2.0
+            specification.computeScalarLHSorRHSVectorForOneSpecies(output, 2, True)
+            self.assertEqual(specification._evaluationPath, 'memoised')
+            self.assertMatchesReference(specification)
+
+            specification.clearReactionTermCache()
+            specification.computeScalarLHSorRHSVectorForOneSpecies(output, 1, False)
+            self.assertNotEqual(specification._evaluationPath, 'memoised')
+
+    def test_activeRegion(self):
+        for precompile in [False, True]:
+            specification = self.createSpecification(precompile, CRIMSON_SCALAR_PROBLEM_ACTIVE_REGION_TOLERANCE='1e-12')
+
+            # The baseline
+            self.assertMatchesReference(specification)
+
+            self.perturbStates(specification, slice(100, 200))
+            self.assertMatchesReference(specification)
+            output = numpy.empty(self.numberOfNodes)
+            specification.computeScalarLHSorRHSVectorForOneSpecies(output, 1, False)
+            self.assertEqual(specification._evaluationPath, 'activeRegion')
+            self.assertEqual(len(specification._activeNodeIndices), 100)
+
+            # Nodes perturbed below the tolerance stay inactive
+            specification.scalarStateVectorsDictionary[1][500] += 1e-14
+            self.assertMatchesReference(specification)
+            self.assertEqual(len(specification._activeNodeIndices), 100)
+
+            # Too many active nodes, every node is evaluated
+            self.perturbStates(specification, slice(None, None, 2), seed=10)
+            self.assertMatchesReference(specification)
+            specification.computeScalarLHSorRHSVectorForOneSpecies(output, 1, False)
+            self.assertNotEqual(specification._evaluationPath, 'activeRegion')
+
+            specification.resetActiveRegion()
+            self.assertMatchesReference(specification)
+            specification.computeScalarLHSorRHSVectorForOneSpecies(output, 1, False)
+            self.assertEqual(specification._evaluationPath, 'activeRegion')
+            self.assertEqual(len(specification._activeNodeIndices), 0)
+
+    def test_combinedSettings(self):
+        specification = self.createSpecification(True, CRIMSON_SCALAR_PROBLEM_MEMOISE_REACTIONS='1', CRIMSON_SCALAR_PROBLEM_BLOCK_SIZE='64',
+                                                 CRIMSON_SCALAR_PROBLEM_ACTIVE_REGION_TOLERANCE='1e-12')
+        self.assertMatchesReference(specification)
+
+        for seed in range(3):
+            self.perturbStates(specification, slice(10 * seed, 10 * seed + 50), seed)
+            self.assertMatchesReference(specification)
+
+
+if __name__ == '__main__':
+    unittest.main()
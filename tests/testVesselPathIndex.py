@@ -0,0 +1,120 @@
+import PythonQtMock as PythonQt
+import sys
+
+sys.modules['PythonQt'] = PythonQt
+
+import unittest
+import numpy
+from CRIMSONSolver.SolverStudies import VesselPathIndex
+
+
+class FaceIdentifierStub(object):
+    def __init__(self, parentSolidIndex):
+        self.parentSolidIndices = (parentSolidIndex,)
+
+
+class VesselForestStub(object):
+    """
+        A vessel forest of two analytic paths: a straight one along the z axis and a circular arc in the z = 0 plane.
+    """
+    straightLength = 50.0
+    arcRadius = 10.0
+    arcAngle = 1.5 * numpy.pi
+
+    def __init__(self):
+        self.nQueries = 0
+
+    def _closestPathPoint(self, faceIdentifier, x, y, z):
+        if faceIdentifier.parentSolidIndices[0] == 0:
+            arcLength = min(max(z, 0.0), self.straightLength)
+            return numpy.array([0.0, 0.0, arcLength]), arcLength, numpy.array([0.0, 0.0, 1.0]), numpy.array([1.0, 0.0, 0.0])
+
+        angle = min(max(numpy.arctan2(y, x) % (2 * numpy.pi), 0.0), self.arcAngle)
+        radial = numpy.array([numpy.cos(angle), numpy.sin(angle), 0.0])
+        return self.arcRadius * radial, self.arcRadius * angle, numpy.array([-radial[1], radial[0], 0.0]), radial
+
+    def getClosestPoint(self, faceIdentifier, x, y, z):
+        self.nQueries += 1
+        pathPoint, arcLength, _, _ = self._closestPathPoint(faceIdentifier, x, y, z)
+        return numpy.linalg.norm(numpy.array([x, y, z]) - pathPoint), arcLength
+
+    def getVesselPathCoordinateFrame(self, faceIdentifier, x, y, z):
+        self.nQueries += 1
+        pathPoint, _, tangent, normal = self._closestPathPoint(faceIdentifier, x, y, z)
+        return numpy.concatenate((pathPoint, tangent, normal)).tolist()
+
+
+def wallPoints(faceIdentifier, nPoints, radius):
+    """
+        Random points on the wall of a vessel of the given radius around a path of VesselForestStub.
+    """
+    random = numpy.random.RandomState(faceIdentifier.parentSolidIndices[0])
+    around = random.uniform(0, 2 * numpy.pi, nPoints)
+    if faceIdentifier.parentSolidIndices[0] == 0:
+        along = random.uniform(0, VesselForestStub.straightLength, nPoints)
+        return numpy.column_stack((radius * numpy.cos(around), radius * numpy.sin(around), along))
+
+    along = random.uniform(0, VesselForestStub.arcAngle, nPoints)
+    distance = VesselForestStub.arcRadius + radius * numpy.cos(around)
+    return numpy.column_stack((distance * numpy.cos(along), distance * numpy.sin(along), radius * numpy.sin(around)))
+
+
+class TestVesselPathIndex(unittest.TestCase):
+    def setUp(self):
+        self.enabled = VesselPathIndex.enabled
+        VesselPathIndex.enabled = True
+
+    def tearDown(self):
+        VesselPathIndex.enabled = self.enabled
+
+    def checkPath(self, faceIdentifier, radius):
+        nPoints = 2000
+        vesselForest = VesselForestStub()
+        points = wallPoints(faceIdentifier, nPoints, radius)
+
+        index = VesselPathIndex.VesselPathIndex(vesselForest)
+        radii, arcLengths, frames = index.query(faceIdentifier, points)
+
+        # The index was used rather than falling back to two queries per point
+        self.assertIn(faceIdentifier, index.samples)
+        self.assertLess(vesselForest.nQueries, nPoints)
+
+        expectedRadii, expectedArcLengths, expectedFrames = index._queryVesselForest(faceIdentifier, points)
+        numpy.testing.assert_allclose(radii, expectedRadii, atol=VesselPathIndex.tolerance * radius)
+        numpy.testing.assert_allclose(arcLengths, expectedArcLengths, atol=VesselPathIndex.tolerance * radius)
+        numpy.testing.assert_allclose(frames, expectedFrames, atol=VesselPathIndex.tolerance * radius)
+
+    def test_straightPath(self):
+        self.checkPath(FaceIdentifierStub(0), 1.0)
+
+    def test_curvedPath(self):
+        self.checkPath(FaceIdentifierStub(1), 1.0)
+
+    def test_numberOfSamplesIsCapped(self):
+        # A thin vessel would need more samples than allowed
+        faceIdentifier = FaceIdentifierStub(0)
+        index = VesselPathIndex.VesselPathIndex(VesselForestStub())
+        index.query(faceIdentifier, wallPoints(faceIdentifier, 200, 1e-3))
+
+        self.assertLessEqual(index.samples[faceIdentifier].getNumberOfSamples(), VesselPathIndex.maxSamplesPerPath)
+
+    def test_disabled(self):
+        # The C++ queries are used for every point
+        VesselPathIndex.enabled = False
+        faceIdentifier = FaceIdentifierStub(1)
+        points = wallPoints(faceIdentifier, 200, 1.0)
+        vesselForest = VesselForestStub()
+
+        index = VesselPathIndex.VesselPathIndex(vesselForest)
+        radii, arcLengths, frames = index.query(faceIdentifier, points)
+
+        self.assertNotIn(faceIdentifier, index.samples)
+        self.assertEqual(vesselForest.nQueries, 2 * len(points))
+        expectedRadii, expectedArcLengths, expectedFrames = index._queryVesselForest(faceIdentifier, points)
+        numpy.testing.assert_array_equal(radii, expectedRadii)
+        numpy.testing.assert_array_equal(arcLengths, expectedArcLengths)
+        numpy.testing.assert_array_equal(frames, expectedFrames)
+
+
+if __name__ == '__main__':
+    unittest.main()